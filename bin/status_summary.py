@@ -20,9 +20,10 @@ Format:
 """
 
 import sys
-import json
 from collections import defaultdict
 
+from codar.savanna.status import load_workflow_status
+
 
 def print_status_summary(status_data):
     total_count = len(status_data)
@@ -61,8 +62,7 @@ def main():
         sys.exit(1)
 
     status_file_path = sys.argv[1]
-    with open(status_file_path) as f:
-        status_data = json.load(f)
+    status_data = load_workflow_status(status_file_path)
     print_status_summary(status_data)
 
 
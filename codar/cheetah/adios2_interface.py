@@ -37,12 +37,22 @@ def get_adios_version(xml_file):
     :return: 1 (adios version 1) or 2 (adios version 2)
     """
 
+    return get_tree_adios_version(ET.parse(xml_file))
+
+
+def get_tree_adios_version(tree):
+    """
+    Get the ADIOS version of a parsed xml file.
+
+    :param tree: ElementTree of the adios xml file
+    :return: 1 (adios version 1) or 2 (adios version 2)
+    """
+
     # Get the root and then the first child node
     # The 'tag' of that node should be 'io' for adios2, and
     # 'adios-group' for adios1
-    tree = ET.parse(xml_file)
     root = tree.getroot()
-    first_child_node = root.getchildren()[0]
+    first_child_node = root[0]
     if first_child_node.tag == 'io':
         return 2
     return 1
@@ -60,6 +70,18 @@ def set_engine(xmlfile, io_obj, engine_type, parameters=None):
     """
 
     tree = ET.parse(xmlfile)
+    set_tree_engine(tree, io_obj, engine_type, parameters)
+
+    # Write the file back
+    tree.write(xmlfile, xml_declaration=True)
+
+
+def set_tree_engine(tree, io_obj, engine_type, parameters=None):
+    """
+    Set the engine type for an input IO object in a parsed xml file.
+    Same as set_engine, but modifies tree in memory.
+    """
+
     io_node = _get_io_node(tree, io_obj)
     _validate_engine(engine_type, parameters)
 
@@ -69,9 +91,6 @@ def set_engine(xmlfile, io_obj, engine_type, parameters=None):
 
     _replace_and_add_elem(io_node, node, "engine")
 
-    # Write the file back
-    tree.write(xmlfile, xml_declaration=True)
-
 
 def set_transport(xmlfile, io_obj, transport_type, parameters=None):
     """
@@ -85,6 +104,18 @@ def set_transport(xmlfile, io_obj, transport_type, parameters=None):
     """
 
     tree = ET.parse(xmlfile)
+    set_tree_transport(tree, io_obj, transport_type, parameters)
+
+    # Write the file back
+    tree.write(xmlfile, xml_declaration=True)
+
+
+def set_tree_transport(tree, io_obj, transport_type, parameters=None):
+    """
+    Set the transport type for an io object in a parsed xml file. Same as
+    set_transport, but modifies tree in memory.
+    """
+
     io_node = _get_io_node(tree, io_obj)
     _validate_transport(transport_type, parameters)
     node = ET.Element("transport")
@@ -93,9 +124,6 @@ def set_transport(xmlfile, io_obj, transport_type, parameters=None):
 
     _replace_and_add_elem(io_node, node, "transport")
 
-    # Write the file back
-    tree.write(xmlfile, xml_declaration=True)
-
 
 def set_var_operation(xmlfile, io_obj, var_name, operation, parameters=None):
     """
@@ -110,6 +138,19 @@ def set_var_operation(xmlfile, io_obj, var_name, operation, parameters=None):
     """
 
     tree = ET.parse(xmlfile)
+    set_tree_var_operation(tree, io_obj, var_name, operation, parameters)
+
+    # Write the file back
+    tree.write(xmlfile, xml_declaration=True)
+
+
+def set_tree_var_operation(tree, io_obj, var_name, operation,
+                           parameters=None):
+    """
+    Set an operation on a variable in a parsed xml file. Same as
+    set_var_operation, but modifies tree in memory.
+    """
+
     io_node = _get_io_node(tree, io_obj)
     _validate_var_operation(operation, parameters)
 
@@ -130,9 +171,6 @@ def set_var_operation(xmlfile, io_obj, var_name, operation, parameters=None):
     new_var_node.append(oper_child)
     io_node.append(new_var_node)
 
-    # Write the file back
-    tree.write(xmlfile, xml_declaration=True)
-
 
 def _get_io_node(tree, io_obj):
     root = tree.getroot()
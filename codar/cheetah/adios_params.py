@@ -23,20 +23,28 @@ def adios_xml_transform(xml_filepath, group_name, var_name, value):
     """
 
     tree = ET.parse(xml_filepath)
+    tree_transform(tree, group_name, var_name, value)
+    tree.write(xml_filepath, xml_declaration=True)
+
 
+def tree_transform(tree, group_name, var_name, value):
+    """Same as adios_xml_transform, on a parsed ADIOS XML file."""
     tag = tree.find('adios-group[@name="%s"]/global-bounds/var[@name="%s"]'
                     % (group_name, var_name))
     tag.set('transform', value)
-    tree.write(xml_filepath, xml_declaration=True)
 
 
 def adios_xml_transport(xml_filepath, group_name, method_name, method_opts):
     tree = ET.parse(xml_filepath)
+    tree_transport(tree, group_name, method_name, method_opts)
+    tree.write(xml_filepath, xml_declaration=True)
+
 
+def tree_transport(tree, group_name, method_name, method_opts):
+    """Same as adios_xml_transport, on a parsed ADIOS XML file."""
     elem = tree.find('method[@group="' + group_name + '"]')
     elem.set('method', method_name)
     elem.text = method_opts
-    tree.write(xml_filepath, xml_declaration=True)
 
 
 def xml_has_transport(xml_filepath, transport_type):
@@ -54,7 +62,11 @@ def xml_has_transport(xml_filepath, transport_type):
     # tmp_tree = tmp_tree.lower()
     # tree = ET.fromstring(tmp_tree)
 
-    tree = ET.parse(xml_filepath)
+    return tree_has_transport(ET.parse(xml_filepath), transport_type)
+
+
+def tree_has_transport(tree, transport_type):
+    """Same as xml_has_transport, on a parsed ADIOS XML file."""
     elem = tree.find('method[@method="' + transport_type + '"]')
     if elem is not None:
         return True
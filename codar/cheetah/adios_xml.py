@@ -0,0 +1,35 @@
+"""
+Cache of the ADIOS XML files of the codes of a campaign. The XML file of a
+code is a template for the file in the working directory of every run of
+the code, so it is parsed once and shared by all the runs. A run that sets
+ADIOS parameters edits a copy of the parsed template in memory, and writes
+it once to the working directory; the DATASPACES and DIMES transport checks
+are done on the same trees.
+"""
+
+import copy
+import threading
+import xml.etree.ElementTree as ET
+
+
+class ADIOSXMLTemplates(object):
+    """Parsed ADIOS XML files by path. Thread safe, so it can be shared by
+    runs created in parallel."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trees = {}
+
+    def get(self, xml_path):
+        """Get the parsed file as an ElementTree, which must not be
+        modified."""
+        with self._lock:
+            tree = self._trees.get(xml_path)
+            if tree is None:
+                tree = ET.parse(xml_path)
+                self._trees[xml_path] = tree
+            return tree
+
+    def copy(self, xml_path):
+        """Get a copy of the parsed file that can be modified."""
+        return ET.ElementTree(copy.deepcopy(self.get(xml_path).getroot()))
@@ -19,6 +19,10 @@ start=$(date +%s)
  --log-file=codar.FOBrun.log \
  --machine-name=$CODAR_CHEETAH_MACHINE_NAME \
  --status-file=codar.workflow.status.json \
+ --metrics-file=codar.workflow.metrics.jsonl \
+ --scheduler-policy=${CODAR_WORKFLOW_SCHEDULER_POLICY:-greedy} \
+ --output-mode=${CODAR_WORKFLOW_OUTPUT:-files} \
+ --max-post-processes=${CODAR_WORKFLOW_MAX_POST_PROCESSES:-0} \
  --log-level=$CODAR_CHEETAH_WORKFLOW_LOG_LEVEL
 
 end=$(date +%s)
@@ -8,10 +8,13 @@ if [ -f "$CODAR_CHEETAH_MACHINE_CONFIG" ]; then
     source "$CODAR_CHEETAH_MACHINE_CONFIG"
 fi
 
-# Don't submit job if all experiments have been run
+# Don't submit job if all experiments have been run. The status journal
+# must be replayed, the snapshot is stale if the last job was killed.
 if [ -f codar.workflow.status.json ]; then
-    grep state codar.workflow.status.json | grep -q 'not_started'
-    if [ $? != 0 ]; then
+    "$CODAR_PYTHON" -c 'import sys
+from codar.savanna.status import has_not_started
+sys.exit(0 if has_not_started(sys.argv[1]) else 3)' codar.workflow.status.json
+    if [ $? == 3 ]; then
         echo "No more experiments remaining. Skipping group .."
         exit
     fi
@@ -206,3 +206,54 @@ def json_config_set_option (filename, key, value):
 
     with open(filename, 'w') as f:
         json.dump(json_dict, f, indent=4)
+
+
+class JSONListWriter(object):
+    """Write a JSON list to file_path one item at a time. The file is the
+    same as json.dump of the whole list with the same indent and
+    sort_keys, so large lists do not have to be held in memory. Use as a
+    context manager, or call close when done. The context manager calls
+    abort instead if the block raises."""
+
+    def __init__(self, file_path, indent=None, sort_keys=False):
+        self.file_path = file_path
+        self.indent = indent
+        self.sort_keys = sort_keys
+        self._count = 0
+        self._f = open(file_path, 'w')
+
+    def write(self, item):
+        text = json.dumps(item, indent=self.indent, sort_keys=self.sort_keys)
+        if self.indent is None:
+            self._f.write(', ' if self._count else '[')
+        else:
+            # newlines in strings are escaped, so these are all line breaks
+            prefix = ' ' * self.indent
+            text = prefix + text.replace('\n', '\n' + prefix)
+            self._f.write(',\n' if self._count else '[\n')
+        self._f.write(text)
+        self._count += 1
+
+    def close(self):
+        if self._count == 0:
+            self._f.write('[]')
+        elif self.indent is None:
+            self._f.write(']')
+        else:
+            self._f.write('\n]')
+        self._f.close()
+
+    def abort(self):
+        """Close and remove the file, so a partial list is never left
+        looking like a complete one."""
+        self._f.close()
+        os.remove(self.file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -10,16 +10,21 @@ import json
 import shlex
 import subprocess
 import math
+import functools
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from codar.cheetah import adios_params, config, templates, exc
 from codar.cheetah.parameters import ParamAdiosXML, ParamADIOS2XML, \
     ParamConfig, ParamKeyValue, ParamEnvVar
-from codar.cheetah.helpers import parse_timedelta_seconds
+from codar.cheetah.helpers import parse_timedelta_seconds, JSONListWriter
 from codar.cheetah.helpers import copy_to_dir, copytree_to_dir, dir_size, \
     json_config_set_option, relative_or_absolute_path, copy_to_path
 from codar.cheetah.parameters import SymLink
-from codar.cheetah.adios2_interface import get_adios_version
 from codar.cheetah import adios2_interface as adios2
+from codar.cheetah.adios_xml import ADIOSXMLTemplates
+from codar.savanna.producer import NDJSONPipelineWriter
 
 
 TAU_PROFILE_PATTERN = "codar.cheetah.tau-{code}"
@@ -68,11 +73,25 @@ class Launcher(object):
                                kill_on_partial_failure=False,
                                run_post_process_script=None,
                                run_post_process_stop_on_failure=False,
+                               run_post_process_timeout=None,
                                scheduler_options=None,
-                               run_dir_setup_script=None):
+                               run_dir_setup_script=None,
+                               runtime_estimate=None,
+                               fobs_format=None,
+                               workflow_output=None,
+                               workers=None,
+                               adios_xml_templates=None,
+                               params_writer=None):
         """Copy scripts for the appropriate scheduler to group directory,
         and write environment configuration. Returns required number of nodes,
-        which will be calculated if the passed nodes is None"""
+        which will be calculated if the passed nodes is None. If max_nprocs
+        is None, the largest number of processes of a run is used. runs can
+        be a generator, each run is created as it is produced and is not
+        kept. If workers is more than 1, that many run directories are
+        created in parallel. adios_xml_templates is the ADIOSXMLTemplates
+        cache of the campaign, a new one is used if None. If params_writer
+        is not None, the app params of each run are written to it once
+        the run directory is created."""
         script_dir = os.path.join(config.CHEETAH_PATH_SCHEDULER,
                                   self.scheduler_name, 'group')
         if not os.path.isdir(script_dir):
@@ -81,251 +100,42 @@ class Launcher(object):
         if scheduler_options is None:
             scheduler_options = {}
         copytree_to_dir(script_dir, self.output_directory)
+        if adios_xml_templates is None:
+            adios_xml_templates = ADIOSXMLTemplates()
 
         fobs_path = os.path.join(self.output_directory, 'fobs.json')
         min_nodes = 1
 
-        f = open(fobs_path, 'w')
-        fob_list = []
-        for i, run in enumerate(runs):
-            # TODO: abstract this to higher levels
-            os.makedirs(run.run_path, exist_ok=True)
-
-            # Create working dir for each component
-            for rc in run.run_components:
-                os.makedirs(rc.working_dir, exist_ok=True)
-
-            if run.sosflow_profiling:
-                run.insert_sosflow(sosd_path, sos_analysis_path,
-                                   run.run_path,
-                                   machine.processes_per_node)
-
-            if tau_config is not None:
-                copy_to_dir(tau_config, run.run_path)
-
-            # Copy the global input files common to all components
-            for input_rpath in run.inputs:
-                copy_to_dir(input_rpath, run.run_path)
-
-            # Copy input files requested by each component
-            # save working dirs for later use
-            working_dirs = {} # map component name to path
-            for rc in run.run_components:
-                working_dirs[rc.name] = rc.working_dir
-
-                # if rc has an adios xml file, copy it to working dir
-                if rc.adios_xml_file:
-                    copy_to_dir(rc.adios_xml_file, rc.working_dir)
-
-                # now copy other inputs marked under component_inputs
-                if rc.component_inputs is not None:
-                    for input_file in rc.component_inputs:
-                        # input type is symlink
-                        if type(input_file) == SymLink:
-                            dest = os.path.join(rc.working_dir,
-                                                os.path.basename(
-                                                    input_file))
-                            os.symlink(input_file, dest)
-
-                        # input type is a regular file
-                        else:
-                            copy_to_dir(input_file, rc.working_dir)
-
-            # ADIOS XML param support
-            adios_xml_params = \
-                run.instance.get_parameter_values_by_type(ParamAdiosXML) or \
-                run.instance.get_parameter_values_by_type(ParamADIOS2XML)
-            for pv in adios_xml_params:
-                working_dir = working_dirs[pv.target]
-
-                # dirty way of getting the adios xml filename of the rc
-                # that is represented by pv.target
-                rc_adios_xml = self._get_rc_adios_xml_filename(
-                    run, pv.target)
-                xml_filepath = os.path.join(working_dir,
-                                            os.path.basename(rc_adios_xml))
-
-                # Check if this is adios1 or adios2
-                adios_version = get_adios_version(rc_adios_xml)
-
-                if adios_version == 1:
-                    if pv.param_type == "adios_transform":
-                        adios_params.adios_xml_transform(
-                            xml_filepath,pv.group_name, pv.var_name, pv.value)
-                    elif pv.param_type == "adios_transport":
-                        # value could be
-                        # "MPI_AGGREGATE:num_aggregators=64;num_osts"
-                        # extract the method name and the method options
-                        method_name = pv.value
-                        method_opts = ""
-                        if ":" in pv.value:
-                            value_tokens = pv.value.split(":", 1)
-                            method_name = value_tokens[0]
-                            method_opts = value_tokens[1]
-
-                        adios_params.adios_xml_transport(
-                            xml_filepath, pv.group_name, method_name,
-                            method_opts)
-                    else:
-                        raise exc.CheetahException("Unrecognized adios param")
-
-                else:   # adios version == 2
-                    operation_value = list(pv.value.keys())[0]
-                    if pv.operation_name in ('engine', 'transport'):
-                        parameters = pv.value.values()
-                        if pv.operation_name == 'engine':
-                            adios2.set_engine(xml_filepath, pv.io_name,
-                                              operation_value, parameters)
-                        else:
-                            adios2.set_transport(xml_filepath, pv.io_name,
-                                                 operation_value, parameters)
-                    else:   # operation_name == 'var_operation'
-                        var_name = list(pv.value.keys())[0]
-                        var_name_dict = pv.value[var_name]
-                        var_operation_value = list(var_name_dict.keys())[0]
-                        var_op_dict = var_name_dict[var_operation_value]
-                        parameters = var_op_dict.values()
-                        adios2.set_var_operation(xml_filepath, pv.io_name,
-                                                 var_name,
-                                                 var_operation_value,
-                                                 parameters)
-
-            # Insert dataspaces server instances if RCs will couple
-            # using dataspaces.
-            # This must be called after the ADIOS params are parsed and
-            # the final ADIOS XML is generated
-            run.add_dataspaces_support(machine)\
-
-            # Calculate the no. of nodes required by this run.
-            # This must be done after dataspaces support is added.
-            if run.total_nodes > min_nodes:
-                min_nodes = run.total_nodes
-
-            # Generic config file support. Note: slurps entire
-            # config file into memory, requires adding file to
-            # campaign 'inputs' option.
-            config_params = \
-                run.instance.get_parameter_values_by_type(ParamConfig)
-            for pv in config_params:
-                working_dir = working_dirs[pv.target]
-                src_filepath = relative_or_absolute_path(app_dir,
-                                                         pv.config_filename)
-                config_filepath = os.path.join(working_dir,
-                                               pv.config_filename)
-                if not os.path.isfile(config_filepath):
-                    copy_to_path(src_filepath, config_filepath)
-                lines = []
-                # read and modify lines
-                # hack: handle json files. currently works only on singly
-                # nested json files
-                if config_filepath.endswith(".json"):
-                    json_config_set_option(config_filepath, pv.match_string,
-                                           pv.value)
-                else:  # handle other file types
-                    with open(config_filepath) as config_f:
-                        for line in config_f:
-                            line = line.replace(pv.match_string, pv.value)
-                            lines.append(line)
-                    # rewrite file with modified lines
-                    with open(config_filepath, 'w') as config_f:
-                        config_f.write("".join(lines))
-
-            # Key value config file support. Note: slurps entire
-            # config file into memory, requires adding file to
-            # campaign 'inputs' option.
-            kv_params = \
-                run.instance.get_parameter_values_by_type(ParamKeyValue)
-            for pv in kv_params:
-                working_dir = working_dirs[pv.target]
-                src_filepath = relative_or_absolute_path(app_dir,
-                                                         pv.config_filename)
-                kv_filepath = os.path.join(working_dir, pv.config_filename)
-                copy_to_path(src_filepath, kv_filepath)
-                lines = []
-                # read and modify lines
-                with open(kv_filepath) as kv_f:
-                    for line in kv_f:
-                        parts = line.split('=', 1)
-                        if len(parts) == 2:
-                            k = parts[0].strip()
-                            if k == pv.key_name:
-                                # assume all k=v type formats will
-                                # support no spaces around equals
-                                line = k + '=' + str(pv.value) + '\n'
-                        lines.append(line)
-                # rewrite file with modified lines
-                with open(kv_filepath, 'w') as kv_f:
-                    kv_f.write("".join(lines))
-
-            # Env var parameter values
-            kv_params = run.instance.get_parameter_values_by_type(ParamEnvVar)
-            for pv in kv_params:
-                rc = run._get_rc_by_name(pv.target)
-                rc.env[pv.option] = str(pv.value)
-
-            # save code commands as text
-            params_path_txt = os.path.join(run.run_path,
-                                           self.run_command_name)
-            with open(params_path_txt, 'w') as params_f:
-                for rc in run.run_components:
-                    params_f.write(' '.join(map(shlex.quote,
-                                                [rc.exe] + rc.args)))
-                    params_f.write('\n')
-
-            # save params as JSON for use in post-processing, more
-            # useful for post-processing scripts then the command
-            # text
-            params_path_json = os.path.join(run.run_path,
-                                            self.run_json_name)
-            run_data = run.get_app_param_dict()
-            with open(params_path_json, 'w') as params_f:
-                json.dump(run_data, params_f, indent=2)
-
-            fob_runs = []
-            for j, rc in enumerate(run.run_components):
-
-                tau_profile_dir = os.path.join(run.run_path,
-                            TAU_PROFILE_PATTERN.format(code=rc.name))
-                os.makedirs(tau_profile_dir)
-
-                rc.env["PROFILEDIR"] = tau_profile_dir
-                rc.env["TRACEDIR"] = tau_profile_dir
-
-                if timeout is not None:
-                    rc.timeout = parse_timedelta_seconds(timeout)
-
-                fob_runs.append(rc.as_fob_data())
-
-            fob = dict(id=run.run_id, launch_mode=launch_mode, runs=fob_runs,
-                       working_dir=run.run_path,
-                       kill_on_partial_failure=kill_on_partial_failure,
-                       post_process_script=run_post_process_script,
-                       post_process_stop_on_failure=
-                            run_post_process_stop_on_failure,
-                       post_process_args=[params_path_json],
-                       node_layout=run.node_layout.serialize_to_dict(),
-                       total_nodes=run.total_nodes,
-                       machine_name=machine.name)
-            fob_list.append(fob)
-
-            # write to file run dir
-            run_fob_path = os.path.join(run.run_path,
-                                        "codar.cheetah.fob.json")
-            with open(run_fob_path, "w") as runf:
-                runf.write(json.dumps(fob, sort_keys=True, indent=4))
-                runf.write("\n")
-
-            if run_dir_setup_script is not None:
-                self._execute_run_dir_setup_script(run.run_path,
-                                                   run_dir_setup_script)
-
-            # Get the size of the run dir. This should be the last step
-            # in the creation of the run dir.
-            self._get_pre_submit_dir_size(run)
-
-        # Write fob_list to group-level json file
-        f.write(json.dumps(fob_list, sort_keys=True, indent=4))
-        f.close()
+        # Both formats are written one run at a time
+        if fobs_format == 'ndjson':
+            fobs_writer = NDJSONPipelineWriter(fobs_path)
+        else:
+            fobs_writer = JSONListWriter(fobs_path, indent=4, sort_keys=True)
+        runs = _ProcessCounter(runs, max_nprocs)
+        create_run = functools.partial(
+            self._create_run_directory, app_dir=app_dir,
+            launch_mode=launch_mode, timeout=timeout, machine=machine,
+            sosd_path=sosd_path, sos_analysis_path=sos_analysis_path,
+            tau_config=tau_config,
+            kill_on_partial_failure=kill_on_partial_failure,
+            run_post_process_script=run_post_process_script,
+            run_post_process_stop_on_failure=
+                run_post_process_stop_on_failure,
+            run_post_process_timeout=run_post_process_timeout,
+            run_dir_setup_script=run_dir_setup_script,
+            runtime_estimate=runtime_estimate,
+            workflow_output=workflow_output,
+            adios_xml_templates=adios_xml_templates)
+        with fobs_writer:
+            for run, fob in _map_runs(create_run, runs, workers):
+                # Calculate the no. of nodes required by this run.
+                # This must be done after dataspaces support is added.
+                if run.total_nodes > min_nodes:
+                    min_nodes = run.total_nodes
+                fobs_writer.write(fob)
+                if params_writer is not None:
+                    params_writer.write(run.get_app_param_dict())
+        max_nprocs = runs.max_nprocs
 
         if nodes is None:
             nodes = min_nodes
@@ -360,8 +170,287 @@ class Launcher(object):
         with open(env_path, 'w') as f:
             f.write(group_env)
 
+        if timeout:
+            walltime_guess = (parse_timedelta_seconds(timeout) * runs.count
+                              + 60)
+            walltime_group = parse_timedelta_seconds(walltime)
+            if walltime_group < walltime_guess:
+                warnings.warn('group "%s" walltime %d is less than '
+                              '(per_run_timeout * nruns) + 60 = %d, '
+                              'it is recommended to set it higher to '
+                              'avoid problems with the workflow '
+                              'engine being killed before it can write '
+                              'all status information'
+                              % (group_name, walltime_group, walltime_guess))
+
         return nodes
 
+    def _create_run_directory(self, run, app_dir, launch_mode, timeout,
+                              machine, sosd_path, sos_analysis_path,
+                              tau_config, kill_on_partial_failure,
+                              run_post_process_script,
+                              run_post_process_stop_on_failure,
+                              run_post_process_timeout, run_dir_setup_script,
+                              runtime_estimate, workflow_output,
+                              adios_xml_templates):
+        """Create the directory of a run, with its inputs, parameter
+        files and FOB, and return the FOB data. Only touches the run and
+        its directory, so runs can be created in parallel."""
+        # TODO: abstract this to higher levels
+        os.makedirs(run.run_path, exist_ok=True)
+
+        # Create working dir for each component
+        for rc in run.run_components:
+            os.makedirs(rc.working_dir, exist_ok=True)
+
+        if run.sosflow_profiling:
+            run.insert_sosflow(sosd_path, sos_analysis_path,
+                               run.run_path,
+                               machine.processes_per_node)
+
+        if tau_config is not None:
+            copy_to_dir(tau_config, run.run_path)
+
+        # Copy the global input files common to all components
+        for input_rpath in run.inputs:
+            copy_to_dir(input_rpath, run.run_path)
+
+        # ADIOS XML param support. The XML file of each component with
+        # ADIOS params is edited in memory, from a copy of the template
+        # parsed once for the campaign, and written once below.
+        adios_xml_params = \
+            run.instance.get_parameter_values_by_type(ParamAdiosXML) or \
+            run.instance.get_parameter_values_by_type(ParamADIOS2XML)
+        adios_xml_trees = {} # map component name to edited tree
+        for pv in adios_xml_params:
+            # dirty way of getting the adios xml filename of the rc
+            # that is represented by pv.target
+            rc_adios_xml = self._get_rc_adios_xml_filename(
+                run, pv.target)
+            tree = adios_xml_trees.get(pv.target)
+            if tree is None:
+                tree = adios_xml_templates.copy(rc_adios_xml)
+                adios_xml_trees[pv.target] = tree
+
+            # Check if this is adios1 or adios2
+            adios_version = adios2.get_tree_adios_version(tree)
+
+            if adios_version == 1:
+                if pv.param_type == "adios_transform":
+                    adios_params.tree_transform(
+                        tree, pv.group_name, pv.var_name, pv.value)
+                elif pv.param_type == "adios_transport":
+                    # value could be
+                    # "MPI_AGGREGATE:num_aggregators=64;num_osts"
+                    # extract the method name and the method options
+                    method_name = pv.value
+                    method_opts = ""
+                    if ":" in pv.value:
+                        value_tokens = pv.value.split(":", 1)
+                        method_name = value_tokens[0]
+                        method_opts = value_tokens[1]
+
+                    adios_params.tree_transport(
+                        tree, pv.group_name, method_name, method_opts)
+                else:
+                    raise exc.CheetahException("Unrecognized adios param")
+
+            else:   # adios version == 2
+                operation_value = list(pv.value.keys())[0]
+                if pv.operation_name in ('engine', 'transport'):
+                    parameters = pv.value.values()
+                    if pv.operation_name == 'engine':
+                        adios2.set_tree_engine(tree, pv.io_name,
+                                               operation_value, parameters)
+                    else:
+                        adios2.set_tree_transport(tree, pv.io_name,
+                                                  operation_value,
+                                                  parameters)
+                else:   # operation_name == 'var_operation'
+                    var_name = list(pv.value.keys())[0]
+                    var_name_dict = pv.value[var_name]
+                    var_operation_value = list(var_name_dict.keys())[0]
+                    var_op_dict = var_name_dict[var_operation_value]
+                    parameters = var_op_dict.values()
+                    adios2.set_tree_var_operation(tree, pv.io_name,
+                                                  var_name,
+                                                  var_operation_value,
+                                                  parameters)
+
+        # Copy input files requested by each component
+        # save working dirs for later use
+        working_dirs = {} # map component name to path
+        for rc in run.run_components:
+            working_dirs[rc.name] = rc.working_dir
+
+            # if rc has an adios xml file, write the edited copy or copy
+            # the template to working dir
+            if rc.adios_xml_file:
+                tree = adios_xml_trees.get(rc.name)
+                if tree is None:
+                    copy_to_dir(rc.adios_xml_file, rc.working_dir)
+                else:
+                    tree.write(os.path.join(
+                                   rc.working_dir,
+                                   os.path.basename(rc.adios_xml_file)),
+                               xml_declaration=True)
+
+            # now copy other inputs marked under component_inputs
+            if rc.component_inputs is not None:
+                for input_file in rc.component_inputs:
+                    # input type is symlink
+                    if type(input_file) == SymLink:
+                        dest = os.path.join(rc.working_dir,
+                                            os.path.basename(
+                                                input_file))
+                        os.symlink(input_file, dest)
+
+                    # input type is a regular file
+                    else:
+                        copy_to_dir(input_file, rc.working_dir)
+
+        # Insert dataspaces server instances if RCs will couple
+        # using dataspaces.
+        # This must be called after the ADIOS params are parsed and
+        # the final ADIOS XML is generated. The transports are checked on
+        # the trees in memory, the edited ones or the templates.
+        for rc in run.run_components:
+            if rc.adios_xml_file and rc.name not in adios_xml_trees:
+                adios_xml_trees[rc.name] = adios_xml_templates.get(
+                    rc.adios_xml_file)
+        run.add_dataspaces_support(machine, adios_xml_trees)
+
+        # Generic config file support. Note: slurps entire
+        # config file into memory, requires adding file to
+        # campaign 'inputs' option.
+        config_params = \
+            run.instance.get_parameter_values_by_type(ParamConfig)
+        for pv in config_params:
+            working_dir = working_dirs[pv.target]
+            src_filepath = relative_or_absolute_path(app_dir,
+                                                     pv.config_filename)
+            config_filepath = os.path.join(working_dir,
+                                           pv.config_filename)
+            if not os.path.isfile(config_filepath):
+                copy_to_path(src_filepath, config_filepath)
+            lines = []
+            # read and modify lines
+            # hack: handle json files. currently works only on singly
+            # nested json files
+            if config_filepath.endswith(".json"):
+                json_config_set_option(config_filepath, pv.match_string,
+                                       pv.value)
+            else:  # handle other file types
+                with open(config_filepath) as config_f:
+                    for line in config_f:
+                        line = line.replace(pv.match_string, pv.value)
+                        lines.append(line)
+                # rewrite file with modified lines
+                with open(config_filepath, 'w') as config_f:
+                    config_f.write("".join(lines))
+
+        # Key value config file support. Note: slurps entire
+        # config file into memory, requires adding file to
+        # campaign 'inputs' option.
+        kv_params = \
+            run.instance.get_parameter_values_by_type(ParamKeyValue)
+        for pv in kv_params:
+            working_dir = working_dirs[pv.target]
+            src_filepath = relative_or_absolute_path(app_dir,
+                                                     pv.config_filename)
+            kv_filepath = os.path.join(working_dir, pv.config_filename)
+            copy_to_path(src_filepath, kv_filepath)
+            lines = []
+            # read and modify lines
+            with open(kv_filepath) as kv_f:
+                for line in kv_f:
+                    parts = line.split('=', 1)
+                    if len(parts) == 2:
+                        k = parts[0].strip()
+                        if k == pv.key_name:
+                            # assume all k=v type formats will
+                            # support no spaces around equals
+                            line = k + '=' + str(pv.value) + '\n'
+                    lines.append(line)
+            # rewrite file with modified lines
+            with open(kv_filepath, 'w') as kv_f:
+                kv_f.write("".join(lines))
+
+        # Env var parameter values
+        kv_params = run.instance.get_parameter_values_by_type(ParamEnvVar)
+        for pv in kv_params:
+            rc = run._get_rc_by_name(pv.target)
+            rc.env[pv.option] = str(pv.value)
+
+        # save code commands as text
+        params_path_txt = os.path.join(run.run_path,
+                                       self.run_command_name)
+        with open(params_path_txt, 'w') as params_f:
+            for rc in run.run_components:
+                params_f.write(' '.join(map(shlex.quote,
+                                            [rc.exe] + rc.args)))
+                params_f.write('\n')
+
+        # save params as JSON for use in post-processing, more
+        # useful for post-processing scripts then the command
+        # text
+        params_path_json = os.path.join(run.run_path,
+                                        self.run_json_name)
+        run_data = run.get_app_param_dict()
+        with open(params_path_json, 'w') as params_f:
+            json.dump(run_data, params_f, indent=2)
+
+        fob_runs = []
+        for j, rc in enumerate(run.run_components):
+
+            # In segments output mode, avoid an empty directory per
+            # code unless TAU is configured for the campaign.
+            if tau_config is not None or workflow_output != 'segments':
+                tau_profile_dir = os.path.join(run.run_path,
+                            TAU_PROFILE_PATTERN.format(code=rc.name))
+                os.makedirs(tau_profile_dir)
+
+                rc.env["PROFILEDIR"] = tau_profile_dir
+                rc.env["TRACEDIR"] = tau_profile_dir
+
+            if timeout is not None:
+                rc.timeout = parse_timedelta_seconds(timeout)
+
+            fob_runs.append(rc.as_fob_data())
+
+        fob = dict(id=run.run_id, launch_mode=launch_mode, runs=fob_runs,
+                   working_dir=run.run_path,
+                   kill_on_partial_failure=kill_on_partial_failure,
+                   post_process_script=run_post_process_script,
+                   post_process_stop_on_failure=
+                        run_post_process_stop_on_failure,
+                   post_process_args=[params_path_json],
+                   node_layout=run.node_layout.serialize_to_dict(),
+                   total_nodes=run.total_nodes,
+                   machine_name=machine.name)
+        if runtime_estimate is not None:
+            fob['runtime_estimate'] = \
+                parse_timedelta_seconds(runtime_estimate)
+        if run_post_process_timeout is not None:
+            fob['post_process_timeout'] = \
+                parse_timedelta_seconds(run_post_process_timeout)
+        # write to file run dir
+        run_fob_path = os.path.join(run.run_path,
+                                    "codar.cheetah.fob.json")
+        with open(run_fob_path, "w") as runf:
+            runf.write(json.dumps(fob, sort_keys=True, indent=4))
+            runf.write("\n")
+
+        if run_dir_setup_script is not None:
+            self._execute_run_dir_setup_script(run.run_path,
+                                               run_dir_setup_script)
+
+        # Get the size of the run dir. This should be the last step
+        # in the creation of the run dir.
+        self._get_pre_submit_dir_size(run)
+
+        return fob
+
     def _get_pre_submit_dir_size(self, run):
         """
         Get and write the size of the run directory prior to running the
@@ -405,3 +494,70 @@ class Launcher(object):
         return jobid
 
 
+class _ProcessCounter(object):
+    """Iterate over runs, keeping track of the largest total number of
+    processes of a run and of the number of runs. This is counted before
+    the run is created, since creating it can add components like the
+    dataspaces servers. If max_nprocs is not None, it is the result, and
+    runs with more processes raise a CheetahException."""
+
+    def __init__(self, runs, max_nprocs=None):
+        self.runs = runs
+        self.limit = max_nprocs
+        self.max_nprocs = max_nprocs or 0
+        self.count = 0
+
+    def __iter__(self):
+        for run in self.runs:
+            nprocs = run.get_total_nprocs()
+            if self.limit is not None and self.limit < nprocs:
+                # TODO: improve error message, specifying which
+                # group and by how much it's off etc
+                raise exc.CheetahException("max_procs for group is too low")
+            self.max_nprocs = max(self.max_nprocs, nprocs)
+            self.count += 1
+            yield run
+
+
+def _map_runs(create_run, runs, workers=None):
+    """Yield (run, create_run(run)) for each run, in order. If workers is
+    more than 1, runs are created by a pool of threads, which is worth it
+    since creating a run directory is mostly waiting on the file system
+    and setup scripts. In both cases a failed run does not stop the others,
+    the errors of all failed runs are raised together as a
+    CheetahException once the other runs are done."""
+    errors = []
+    if not workers or workers <= 1:
+        for run in runs:
+            try:
+                result = create_run(run)
+            except Exception as e:
+                errors.append((run, e))
+                continue
+            yield run, result
+    else:
+        pending = deque()
+        runs = iter(runs)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                # bound the runs in flight, in case runs is a long iterator
+                while len(pending) < 2 * workers:
+                    run = next(runs, None)
+                    if run is None:
+                        break
+                    pending.append((run, pool.submit(create_run, run)))
+                if not pending:
+                    break
+                run, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append((run, e))
+                    continue
+                yield run, result
+    if errors:
+        raise exc.CheetahException(
+            "failed to create %d run directories:\n%s"
+            % (len(errors), "\n".join("  %s: %s: %s"
+                                       % (run.run_path, type(e).__name__, e)
+                                       for run, e in errors)))
@@ -11,14 +11,13 @@ name.
 import os
 import sys
 import stat
-import json
 import math
 import shlex
 import inspect
 import getpass
 from pathlib import Path
 from collections import OrderedDict
-import warnings
+import xml.etree.ElementTree as ET
 import pdb
 
 from codar.savanna import machines
@@ -26,9 +25,10 @@ from codar.savanna.node_layout import NodeLayout
 from codar.cheetah import parameters, config, templates, exc, machine_launchers
 from codar.cheetah.helpers import copy_to_dir, copy_to_path
 from codar.cheetah.helpers import relative_or_absolute_path, \
-    relative_or_absolute_path_list, parse_timedelta_seconds
+    relative_or_absolute_path_list, JSONListWriter
 from codar.cheetah.parameters import SymLink
-from codar.cheetah.adios_params import xml_has_transport
+from codar.cheetah.adios_params import tree_has_transport
+from codar.cheetah.adios_xml import ADIOSXMLTemplates
 from codar.cheetah.parameters import ParamCmdLineArg
 from codar.cheetah.exc import CheetahException
 
@@ -64,6 +64,14 @@ class Campaign(object):
     run_post_process_script = None
     run_post_process_stop_group_on_failure = False
 
+    # Optional. Time after which a post process script is killed, in
+    # the same format as per_run_timeout, default is 120 seconds. At most
+    # run_post_process_max_running scripts run at once, the others wait
+    # in a queue; default is the number of CPUs of the node running the
+    # workflow script.
+    run_post_process_timeout = None
+    run_post_process_max_running = None
+
     # Optional. Designed to set up application specific environment
     # variables and load environment modules. Must be a dictionary with
     # machine name keys and values pointing at bash scripts. The
@@ -96,6 +104,28 @@ class Campaign(object):
     sos_analysis_path = None
     sosd_num_aggregators = 1
 
+    # Scheduling policy used by the workflow script to pick the next run
+    # to start: 'greedy' (default) starts the biggest run that fits in the
+    # free nodes, 'easy' and 'conservative' use runtime estimates (see
+    # SweepGroup runtime_estimate and per_run_timeout) to backfill smaller
+    # runs without delaying bigger ones.
+    workflow_scheduler_policy = None
+
+    # Format of the fobs.json file listing the runs of each group: 'json'
+    # (default) is a single JSON list, 'ndjson' has one run per line plus a
+    # byte offset index, so the workflow script can read runs as it needs
+    # them instead of loading the whole file. Recommended for groups with
+    # a very large number of runs.
+    fobs_format = None
+
+    # Where the workflow script puts the stdout, stderr, return code and
+    # walltime of each run: 'files' (default) writes them to files in the
+    # run directory, 'segments' appends them to a few large files in the
+    # group directory, so a group with many runs does not create several
+    # small files per run. Use cheetah status --print-code-output or
+    # codar.savanna.logsink to read them.
+    workflow_output = None
+
     # Optional. If set, passed single argument which is the absolute
     # path to a JSON file containing all runs. Must be relative to the
     # app directory, just like codes values. It will be run from the
@@ -124,7 +154,6 @@ class Campaign(object):
         assert len(self.sweeps) > 0
         self.machine = self._get_machine(machine_name)
         self.app_dir = os.path.abspath(app_dir)
-        self.runs = []
 
         # allow inputs to be either aboslute paths or relative to
         # app_dir
@@ -177,6 +206,20 @@ class Campaign(object):
             self.run_dir_setup_script = self._experiment_relative_path(
                                                 self.run_dir_setup_script)
 
+        if self.workflow_scheduler_policy not in (None, 'greedy', 'easy',
+                                                  'conservative'):
+            raise exc.CheetahException(
+                "workflow_scheduler_policy must be one of greedy, easy, "
+                "conservative")
+
+        if self.fobs_format not in (None, 'json', 'ndjson'):
+            raise exc.CheetahException(
+                "fobs_format must be one of json, ndjson")
+
+        if self.workflow_output not in (None, 'files', 'segments'):
+            raise exc.CheetahException(
+                "workflow_output must be one of files, segments")
+
         self.machine_app_config_script = None
         if self.app_config_scripts is not None:
             assert isinstance(self.app_config_scripts, dict)
@@ -196,12 +239,14 @@ class Campaign(object):
                 % (machine_name, self.name))
         return machine
 
-    def make_experiment_run_dir(self, output_dir, _check_code_paths=True):
+    def make_experiment_run_dir(self, output_dir, _check_code_paths=True,
+                                workers=None):
         """Produce scripts and directory structure for running the experiment.
 
         Directory structure will be a subdirectory for each scheduler group,
         and within each scheduler group directory, a subdirectory for each
-        run."""
+        run. If workers is more than 1, that many run directories are
+        created in parallel."""
 
         # set to False for unit tests
         if _check_code_paths:
@@ -242,6 +287,11 @@ class Campaign(object):
             workflow_script_path=config.WORKFLOW_SCRIPT,
             workflow_runner=self.machine.runner_name,
             workflow_debug_level="DEBUG",
+            workflow_scheduler_policy=(self.workflow_scheduler_policy
+                                       or "greedy"),
+            workflow_output=(self.workflow_output or "files"),
+            workflow_max_post_processes=(
+                self.run_post_process_max_running or 0),
             umask=(self.umask or ""),
             codar_python=self.python_path,
         )
@@ -249,115 +299,107 @@ class Campaign(object):
         with open(campaign_env_path, 'w') as f:
             f.write(campaign_env)
 
-        # Traverse through sweep groups
-        for group_i, group in enumerate(self.sweeps):
-            # each scheduler group gets it's own subdir
-            # TODO: support alternate template for dirs?
-            group_name = group.name
-            group_output_dir = os.path.join(output_dir, group_name)
-            launcher = machine_launchers.get_launcher(self.machine,
-                                                      group_output_dir,
-                                                      len(self.codes))
-            group_runs = []
-            for repeat_index in range(0, group.run_repetitions+1):
-                group_run_offset = 0
-                for sweep in group.parameter_groups:
-                    # node layout is map of machine names to layout for each
-                    # machine. If unspecified, or certain machine is
-                    # unspecified, use default.
-                    if sweep.node_layout is None:
-                        node_layout = None
-                    else:
-                        node_layout = sweep.node_layout.get(self.machine.name)
-                    if node_layout is None:
-                        node_layout = NodeLayout.default_no_share_layout(
-                                            self.machine.processes_per_node,
-                                            self.codes.keys())
-                    else:
-                        node_layout = NodeLayout(node_layout)
-
-                    # TODO: validate node layout against machine model
-
-                    # Summit override. Don't support MPMD yet.
-                    if self.machine.name.lower() == "summit":
-                        if group.launch_mode:
-                            if group.launch_mode.lower() == 'mpmd':
-                                print("MPMD not supported on Summit yet."
-                                      "Changing to default launch mode.")
-                                group.launch_mode = 'default'
-
-                    sweep_runs = [Run(inst, self.codes, self.app_dir,
-                                      os.path.join(
-                                          group_output_dir,
-                                          'run-{}.iteration-{}'.format(
-                                              group_run_offset + i,
-                                              repeat_index)),
-                                      self.inputs,
-                                      self.machine,
-                                      node_layout,
-                                      sweep.rc_dependency,
-                                      group.component_subdirs,
-                                      group.sosflow_profiling,
-                                      group.sosflow_analysis,
-                                      group.component_inputs)
-                                  for i, inst in enumerate(
-                            sweep.get_instances())]
-                    group_runs.extend(sweep_runs)
-                    group_run_offset += len(sweep_runs)
-            self.runs.extend(group_runs)
-
-            if group.max_procs is None:
-                max_procs = max([r.get_total_nprocs() for r in group_runs])
-            else:
-                procs_per_run = max([r.get_total_nprocs() for r in group_runs])
-                if group.max_procs < procs_per_run:
-                    # TODO: improve error message, specifying which
-                    # group and by how much it's off etc
-                    raise exc.CheetahException("max_procs for group is too low")
-                max_procs = group.max_procs
-
-            if group.per_run_timeout:
-                per_run_seconds = parse_timedelta_seconds(group.per_run_timeout)
-                walltime_guess = (per_run_seconds * len(group_runs)) + 60
-                walltime_group = parse_timedelta_seconds(group.walltime)
-                if walltime_group < walltime_guess:
-                    warnings.warn('group "%s" walltime %d is less than '
-                                  '(per_run_timeout * nruns) + 60 = %d, '
-                                  'it is recommended to set it higher to '
-                                  'avoid problems with the workflow '
-                                  'engine being killed before it can write '
-                                  'all status information'
-                                % (group.name, walltime_group, walltime_guess))
-
-            # TODO: refactor so we can just pass the campaign and group
-            # objects, i.e. add methods so launcher can get all info it needs
-            # and simplify this loop.
-            group.nodes = launcher.create_group_directory(
-                self.name, self.app_dir, group_name,
-                group_runs,
-                max_procs,
-                nodes=group.nodes,
-                launch_mode=group.launch_mode,
-                component_subdirs=group.component_subdirs,
-                walltime=group.walltime,
-                timeout=group.per_run_timeout,
-                node_exclusive=self.machine.node_exclusive,
-                tau_config=self.tau_config,
-                machine=self.machine,
-                sosd_path=self.sosd_path,
-                sos_analysis_path=self.sos_analysis_path,
-                kill_on_partial_failure=self.kill_on_partial_failure,
-                run_post_process_script=self.run_post_process_script,
-                run_post_process_stop_on_failure=
-                    self.run_post_process_stop_group_on_failure,
-                scheduler_options=self.machine_scheduler_options,
-                run_dir_setup_script=self.run_dir_setup_script)
-
+        # Runs are generated one at a time and written as they are
+        # produced, so large sweeps are not held in memory. The app params
+        # of each run are written to params.json once its directory is
+        # created.
         # TODO: track directories and ids and add to this file
         all_params_json_path = os.path.join(output_dir, "params.json")
-        with open(all_params_json_path, "w") as f:
-            json.dump([run.get_app_param_dict()
-                       for run in self.runs], f, indent=2)
+        # ADIOS XML files are parsed once for all groups
+        adios_xml_templates = ADIOSXMLTemplates()
+        with JSONListWriter(all_params_json_path, indent=2) as params_writer:
+            # Traverse through sweep groups
+            for group_i, group in enumerate(self.sweeps):
+                self._make_group_dir(output_dir, group, params_writer,
+                                     adios_xml_templates, workers)
+
+    def _make_group_dir(self, output_dir, group, params_writer,
+                        adios_xml_templates, workers):
+        # each scheduler group gets it's own subdir
+        # TODO: support alternate template for dirs?
+        group_name = group.name
+        group_output_dir = os.path.join(output_dir, group_name)
+        launcher = machine_launchers.get_launcher(self.machine,
+                                                  group_output_dir,
+                                                  len(self.codes))
+
+        # Summit override. Don't support MPMD yet. Must be done before
+        # the launch mode is passed to the launcher below.
+        if self.machine.name.lower() == "summit":
+            if group.launch_mode:
+                if group.launch_mode.lower() == 'mpmd':
+                    print("MPMD not supported on Summit yet."
+                          "Changing to default launch mode.")
+                    group.launch_mode = 'default'
+
+        # TODO: refactor so we can just pass the campaign and group
+        # objects, i.e. add methods so launcher can get all info it needs
+        # and simplify this loop.
+        group.nodes = launcher.create_group_directory(
+            self.name, self.app_dir, group_name,
+            self._iter_group_runs(group, group_output_dir),
+            group.max_procs,
+            nodes=group.nodes,
+            launch_mode=group.launch_mode,
+            component_subdirs=group.component_subdirs,
+            walltime=group.walltime,
+            timeout=group.per_run_timeout,
+            runtime_estimate=group.runtime_estimate,
+            node_exclusive=self.machine.node_exclusive,
+            tau_config=self.tau_config,
+            machine=self.machine,
+            sosd_path=self.sosd_path,
+            sos_analysis_path=self.sos_analysis_path,
+            kill_on_partial_failure=self.kill_on_partial_failure,
+            run_post_process_script=self.run_post_process_script,
+            run_post_process_stop_on_failure=
+                self.run_post_process_stop_group_on_failure,
+            run_post_process_timeout=self.run_post_process_timeout,
+            scheduler_options=self.machine_scheduler_options,
+            run_dir_setup_script=self.run_dir_setup_script,
+            fobs_format=self.fobs_format,
+            workflow_output=self.workflow_output,
+            workers=workers,
+            adios_xml_templates=adios_xml_templates,
+            params_writer=params_writer)
+
+    def _iter_group_runs(self, group, group_output_dir):
+        """Generate the Run objects of a sweep group."""
+        for repeat_index in range(0, group.run_repetitions+1):
+            group_run_offset = 0
+            for sweep in group.parameter_groups:
+                # node layout is map of machine names to layout for each
+                # machine. If unspecified, or certain machine is
+                # unspecified, use default.
+                if sweep.node_layout is None:
+                    node_layout = None
+                else:
+                    node_layout = sweep.node_layout.get(self.machine.name)
+                if node_layout is None:
+                    node_layout = NodeLayout.default_no_share_layout(
+                                        self.machine.processes_per_node,
+                                        self.codes.keys())
+                else:
+                    node_layout = NodeLayout(node_layout)
+
+                # TODO: validate node layout against machine model
+
+                for inst in sweep.iter_instances():
+                    run = Run(inst, self.codes, self.app_dir,
+                              os.path.join(
+                                  group_output_dir,
+                                  'run-{}.iteration-{}'.format(
+                                      group_run_offset, repeat_index)),
+                              self.inputs,
+                              self.machine,
+                              node_layout,
+                              sweep.rc_dependency,
+                              group.component_subdirs,
+                              group.sosflow_profiling,
+                              group.sosflow_analysis,
+                              group.component_inputs)
+                    group_run_offset += 1
+                    yield run
 
     def _check_code_paths(self):
         if not os.path.isdir(self.app_dir):
@@ -450,6 +492,7 @@ class Run(object):
         for (target, argv) in codes_argv.items():
             exe_path = self.codes[target]['exe']
             sleep_after = self.codes[target].get('sleep_after', 0)
+            kill_wait = self.codes[target].get('kill_wait')
             runner_override = self.codes[target].get('runner_override', False)
             assert type(runner_override) == bool, \
                 "The runner_override property for the " + target + " codes " \
@@ -498,7 +541,8 @@ class Run(object):
                                 linked_with_sosflow=linked_with_sosflow,
                                 adios_xml_file=adios_xml_file,
                                 hostfile=self.instance.get_hostfile(target),
-                                runner_override=runner_override)
+                                runner_override=runner_override,
+                                kill_wait=kill_wait)
             comps.append(comp)
         return comps
 
@@ -627,7 +671,7 @@ class Run(object):
         (does not include nprocs or exe paths)."""
         return self.instance.as_dict()
 
-    def add_dataspaces_support(self, machine):
+    def add_dataspaces_support(self, machine, adios_xml_trees=None):
         """
         Add support for dataspaces.
         Check RC Adios xml files to see if any transport methods are marked
@@ -635,6 +679,9 @@ class Run(object):
         For stage_write, check command line args to see if DATASPACES/DIMES
         is specified.
         :param machine: The current machine. I dont like this here.
+        :param adios_xml_trees: Optional dict mapping RC name to the parsed
+        adios xml file of the RC, used instead of parsing the file in the
+        working dir.
         :return:
         """
 
@@ -642,18 +689,23 @@ class Run(object):
         # Search in all RC's adios xml file if any transport is set for
         # coupling with DATASPACES/DIMES
         # This is case sensitive
+        if adios_xml_trees is None:
+            adios_xml_trees = {}
         for rc in self.run_components:
             if rc.adios_xml_file:
-                f_xml = os.path.join(rc.working_dir, os.path.basename(
-                    rc.adios_xml_file))
+                tree = adios_xml_trees.get(rc.name)
+                if tree is None:
+                    f_xml = os.path.join(rc.working_dir, os.path.basename(
+                        rc.adios_xml_file))
+                    tree = ET.parse(f_xml)
 
                 # The xml file may have both dataspaces and dimes in
                 # different groups. If any group has dataspaces
                 # enabled, this rc should be marked as a dataspaces client
                 # Order is important here. First search for dataspaces.
-                if xml_has_transport(f_xml, "DATASPACES"):
+                if tree_has_transport(tree, "DATASPACES"):
                     rcs_for_coupling['dataspaces'].add(rc)
-                if xml_has_transport(f_xml, "DIMES"):
+                if tree_has_transport(tree, "DIMES"):
                     rcs_for_coupling['dimes'].add(rc)
 
         # Special handling for stage_write
@@ -871,7 +923,8 @@ class RunComponent(object):
     def __init__(self, name, exe, args, sched_args, nprocs, working_dir,
                  component_inputs=None, sleep_after=None,
                  linked_with_sosflow=False, adios_xml_file=None,
-                 env=None, timeout=None, hostfile=None, runner_override=False):
+                 env=None, timeout=None, hostfile=None, runner_override=False,
+                 kill_wait=None):
         self.name = name
         self.exe = exe
         self.args = args
@@ -887,6 +940,7 @@ class RunComponent(object):
         self.hostfile = hostfile
         self.after_rc_done = None
         self.runner_override = runner_override
+        self.kill_wait = kill_wait
 
     def as_fob_data(self):
         data = dict(name=self.name,
@@ -905,6 +959,8 @@ class RunComponent(object):
             data['env'] = self.env
         if self.timeout:
             data['timeout'] = self.timeout
+        if self.kill_wait is not None:
+            data['kill_wait'] = self.kill_wait
         if self.hostfile:
             data['hostfile'] = self.working_dir + "/" + self.hostfile
         if self.after_rc_done:
@@ -2,11 +2,22 @@
 Module containing classes for specifying paramter value sets and groupings
 of parameters. Used in the Experiment specification in the 'runs' variable.
 """
+import random
 import itertools
+from array import array
 from collections import defaultdict
 
 from codar.cheetah.exc import CheetahException
 
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+
+# Rows per SweepTable when iterating over the instances of a sweep
+TABLE_SIZE = 1024
+
 
 class SweepGroup(object):
     """
@@ -23,7 +34,7 @@ class SweepGroup(object):
                  component_inputs=None, walltime=3600, max_procs=None,
                  per_run_timeout=None, sosflow_profiling=False,
                  sosflow_analysis=False, nodes=None, launch_mode=None,
-                 run_repetitions=0):
+                 run_repetitions=0, runtime_estimate=None):
         self.name = name
         self.nodes = nodes
         self.component_subdirs=component_subdirs
@@ -40,6 +51,9 @@ class SweepGroup(object):
                 raise CheetahException("launch mode must be None/default/mpmd")
         self.launch_mode = launch_mode
         self.run_repetitions = run_repetitions
+        # Optional expected runtime of each run, used by the backfill
+        # scheduling policies. Same format as per_run_timeout.
+        self.runtime_estimate = runtime_estimate
 
 
 class Sweep(object):
@@ -67,14 +81,253 @@ class Sweep(object):
         TODO: should have same signature as SweepGroup version OR a
         different name.
         """
-        inst_list = []
+        return list(self.iter_instances())
+
+    def iter_instances(self):
+        """
+        Generate the Instance objects of get_instances one at a time, in
+        the same order, so a large sweep does not have to be held in
+        memory.
+        """
+        for table in self.iter_tables():
+            for row in range(len(table)):
+                yield table.get_instance(row)
+
+    def iter_tables(self, size=TABLE_SIZE):
+        """
+        Generate the points of the sweep as SweepTable objects of up to
+        size rows, sharing the layout of the parameters.
+        """
+        layout = _InstanceLayout(self.parameters)
+        idx_sets = iter(self.iter_index_sets())
+        while True:
+            table = SweepTable(layout, itertools.islice(idx_sets, size))
+            if len(table) == 0:
+                return
+            yield table
+
+    def get_table(self):
+        """Get all the points of the sweep as a single SweepTable."""
+        return SweepTable(_InstanceLayout(self.parameters),
+                          self.iter_index_sets())
+
+    def iter_index_sets(self):
+        """
+        Generate a tuple for each point of the sweep, with the index of the
+        value of each parameter. Subclasses override this to produce
+        other designs than the dense cross product.
+        """
         indexes = [range(len(p)) for p in self.parameters]
-        for idx_set in itertools.product(*indexes):
-            inst = Instance()
-            for param_i, value_i in enumerate(idx_set):
-                inst.add_parameter(self.parameters[param_i], value_i)
-            inst_list.append(inst)
-        return inst_list
+        return itertools.product(*indexes)
+
+    def get_instance_count(self):
+        """Number of instances in the cross product, without creating
+        them."""
+        return _get_grid_size(self.parameters)
+
+
+class ConstrainedSweep(Sweep):
+    """
+    Cross product of the parameter values, restricted to the points for
+    which constraint(values) is true. values is a two level dict like
+    Instance.as_dict, with the values of the parameters that are not
+    derived, e.g.
+
+        lambda v: v['sim']['nprocs'] * v['sim']['threads'] <= 64
+
+    The grid is walked one parameter at a time, and the constraint is
+    tried as soon as each value is chosen. A KeyError means it needs a
+    value that is not chosen yet; any other result holds for every point
+    with those values, so a false result skips all of them without
+    visiting them. For this to be correct, the constraint must only read
+    values with values[target][name] (not get or in), and must not have
+    side effects.
+    """
+    def __init__(self, parameters, constraint, node_layout=None,
+                 rc_dependency=None):
+        Sweep.__init__(self, parameters, node_layout, rc_dependency)
+        self.constraint = constraint
+
+    def iter_index_sets(self):
+        values = {}
+        idx_set = [0] * len(self.parameters)
+        return self._visit(0, values, idx_set)
+
+    def _visit(self, param_i, values, idx_set):
+        if param_i == len(self.parameters):
+            # only reached if undecided, a KeyError now is an error
+            if self.constraint(values):
+                yield tuple(idx_set)
+            return
+        p = self.parameters[param_i]
+        target_values = values.setdefault(p.target, {})
+        for value_i, value in enumerate(p.values):
+            idx_set[param_i] = value_i
+            if callable(value):
+                # derived, not visible to the constraint
+                yield from self._visit(param_i + 1, values, idx_set)
+                continue
+            target_values[p.name] = value
+            try:
+                ok = self.constraint(values)
+            except KeyError:
+                yield from self._visit(param_i + 1, values, idx_set)
+            else:
+                if ok:
+                    yield from self._all_from(param_i + 1, idx_set)
+            finally:
+                del target_values[p.name]
+
+    def _all_from(self, param_i, idx_set):
+        """Every point with the first param_i values of idx_set, once the
+        constraint is known to hold for them."""
+        head = tuple(idx_set[:param_i])
+        indexes = [range(len(p)) for p in self.parameters[param_i:]]
+        for tail in itertools.product(*indexes):
+            yield head + tail
+
+    def get_instance_count(self):
+        """Number of points that satisfy the constraint. This walks the
+        grid like iter_index_sets, without creating instances."""
+        return sum(1 for idx_set in self.iter_index_sets())
+
+
+class LatinHypercubeSweep(Sweep):
+    """
+    Latin hypercube sample of samples points from the cross product of the
+    parameter values. The range of each parameter is split into samples
+    equal strata, and each stratum is used by exactly one point, so every
+    parameter is covered evenly whatever the number of parameters. When a
+    parameter has fewer values than samples, its values are repeated
+    evenly. The design is reproducible for a given seed.
+    """
+    def __init__(self, parameters, samples, seed=None, node_layout=None,
+                 rc_dependency=None):
+        Sweep.__init__(self, parameters, node_layout, rc_dependency)
+        self.samples = _check_samples(samples)
+        self.seed = seed
+
+    def iter_index_sets(self):
+        rng = random.Random(self.seed)
+        columns = []
+        for p in self.parameters:
+            strata = list(range(self.samples))
+            rng.shuffle(strata)
+            columns.append([int((stratum + rng.random()) * len(p)
+                                / self.samples)
+                            for stratum in strata])
+        return zip(*columns)
+
+    def get_instance_count(self):
+        return self.samples
+
+
+class RandomSweep(Sweep):
+    """
+    Uniform random sample of samples distinct points from the cross
+    product of the parameter values, in cross product order. The points
+    are drawn by their position in the grid, so the grid is never
+    enumerated. The design is reproducible for a given seed.
+    """
+    def __init__(self, parameters, samples, seed=None, node_layout=None,
+                 rc_dependency=None):
+        Sweep.__init__(self, parameters, node_layout, rc_dependency)
+        self.samples = _check_samples(samples)
+        self.seed = seed
+        grid_size = _get_grid_size(parameters)
+        if self.samples > grid_size:
+            raise CheetahException(
+                "samples %d is more than the %d points of the sweep"
+                % (self.samples, grid_size))
+
+    def iter_index_sets(self):
+        rng = random.Random(self.seed)
+        grid_size = _get_grid_size(self.parameters)
+        for position in sorted(rng.sample(range(grid_size), self.samples)):
+            idx_set = []
+            for p in reversed(self.parameters):
+                position, value_i = divmod(position, len(p))
+                idx_set.append(value_i)
+            yield tuple(reversed(idx_set))
+
+    def get_instance_count(self):
+        return self.samples
+
+
+class SobolSweep(Sweep):
+    """
+    Sample of samples points from the cross product of the parameter
+    values, taken from a scrambled Sobol' low discrepancy sequence, with
+    one dimension per parameter. Powers of 2 give the best balance. The
+    design is reproducible for a given seed. Requires scipy.
+    """
+    def __init__(self, parameters, samples, seed=None, node_layout=None,
+                 rc_dependency=None):
+        if qmc is None:
+            raise CheetahException("SobolSweep requires scipy")
+        Sweep.__init__(self, parameters, node_layout, rc_dependency)
+        self.samples = _check_samples(samples)
+        self.seed = seed
+
+    def iter_index_sets(self):
+        sampler = qmc.Sobol(d=len(self.parameters), scramble=True,
+                            seed=self.seed)
+        for point in sampler.random(self.samples):
+            yield tuple(min(int(x * len(p)), len(p) - 1)
+                        for x, p in zip(point, self.parameters))
+
+    def get_instance_count(self):
+        return self.samples
+
+
+class OneAtATimeSweep(Sweep):
+    """
+    One at a time design: the base point, then for each parameter in
+    turn, the points that differ from the base only by the value of that
+    parameter. base is a two level dict like Instance.as_dict with the
+    base value of some parameters, the others use their first value.
+    """
+    def __init__(self, parameters, base=None, node_layout=None,
+                 rc_dependency=None):
+        Sweep.__init__(self, parameters, node_layout, rc_dependency)
+        self.base = base or {}
+        self._base_idx = []
+        for p in parameters:
+            target_base = self.base.get(p.target, {})
+            if p.name not in target_base:
+                self._base_idx.append(0)
+            elif target_base[p.name] in p.values:
+                self._base_idx.append(p.values.index(target_base[p.name]))
+            else:
+                raise CheetahException(
+                    'base value %r is not a value of parameter "%s"'
+                    % (target_base[p.name], p.name))
+
+    def iter_index_sets(self):
+        yield tuple(self._base_idx)
+        for param_i, p in enumerate(self.parameters):
+            for value_i in range(len(p)):
+                if value_i == self._base_idx[param_i]:
+                    continue
+                idx_set = list(self._base_idx)
+                idx_set[param_i] = value_i
+                yield tuple(idx_set)
+
+    def get_instance_count(self):
+        return 1 + sum(len(p) - 1 for p in self.parameters)
+
+
+def _get_grid_size(parameters):
+    count = 1
+    for p in parameters:
+        count *= len(p)
+    return count
+
+
+def _check_samples(samples):
+    if not isinstance(samples, int) or samples < 1:
+        raise CheetahException("samples must be a positive integer")
+    return samples
 
 
 class ParameterValue(object):
@@ -85,19 +338,162 @@ class ParameterValue(object):
 
     TODO: this is kind of hacky, is there a better way?
     """
+    __slots__ = ('_parameter', 'value')
+
     def __init__(self, parameter, value_index):
         self._parameter = parameter
         self.value = parameter.values[value_index]
 
+    @classmethod
+    def with_value(cls, parameter, value):
+        """Create for a value that is already known, e.g. derived."""
+        pv = cls.__new__(cls)
+        pv._parameter = parameter
+        pv.value = value
+        return pv
+
     def __getattr__(self, name):
-        if hasattr(self._parameter, name):
-            return getattr(self._parameter, name)
-        raise AttributeError(name)
+        # only called for names that are not slots
+        if name == '_parameter':
+            raise AttributeError(name)
+        return getattr(self._parameter, name)
 
     def is_type(self, parameter_class):
         return isinstance(self._parameter, parameter_class)
 
 
+class _InstanceLayout(object):
+    """
+    Structure shared by all the instances of a list of parameters, so it
+    is computed once instead of for every instance: the positions of the
+    parameters of each target, simple before derived, the argv layout of
+    each code, the positions of the runner parameters, and an index of
+    positions by parameter type. Raises ValueError for parameter name and
+    argument position conflicts.
+    """
+    __slots__ = ('parameters', 'targets', 'derived', 'commands',
+                 'runner_params', '_by_type')
+
+    def __init__(self, parameters):
+        self.parameters = tuple(parameters)
+        simple = {}
+        derived = {}
+        for i, p in enumerate(self.parameters):
+            if any(callable(v) for v in p.values):
+                derived.setdefault(p.target, []).append(i)
+            else:
+                simple.setdefault(p.target, []).append(i)
+        self.derived = tuple(i for positions in derived.values()
+                             for i in positions)
+
+        self.targets = {}
+        self.commands = {}
+        for target in itertools.chain(simple, derived):
+            if target in self.targets:
+                continue
+            positions = simple.get(target, []) + derived.get(target, [])
+            self.targets[target] = tuple(positions)
+            self.commands[target] = self._get_command(positions)
+
+        self.runner_params = {}
+        for i, p in enumerate(self.parameters):
+            if p.name in ('nprocs', 'hostfile', 'sched_opts'):
+                self.runner_params[(p.target, p.name)] = i
+        self._by_type = {}
+
+    def _get_command(self, positions):
+        """Get the positions of the args, in argv order, and options of a
+        code, like CodeCommand.get_argv."""
+        names = set()
+        args = {}
+        options = []
+        for i in positions:
+            p = self.parameters[i]
+            if p.name in names:
+                raise ValueError('parameter name conflict: "%s"' % p.name)
+            names.add(p.name)
+            if isinstance(p, ParamCmdLineArg):
+                if not isinstance(p.position, int):
+                    raise ValueError('arg position must be an int')
+                if p.position in args:
+                    raise ValueError('arg already exists at position %d'
+                                     % p.position)
+                args[p.position] = i
+            elif isinstance(p, ParamCmdLineOption):
+                options.append(i)
+        arg_positions = []
+        for position in range(1, 101):
+            if position not in args:
+                break
+            arg_positions.append(args[position])
+        return tuple(arg_positions), tuple(options)
+
+    def get_positions_by_type(self, param_class):
+        positions = self._by_type.get(param_class)
+        if positions is None:
+            positions = tuple(i for target_positions in self.targets.values()
+                              for i in target_positions
+                              if isinstance(self.parameters[i], param_class))
+            self._by_type[param_class] = positions
+        return positions
+
+    def get_value_columns(self, index_columns, nrows):
+        """Get the value of every parameter for every row, as one list per
+        parameter. Derived values are calculated for all rows in one
+        pass."""
+        columns = [[p.values[value_i] for value_i in column]
+                   for p, column in zip(self.parameters, index_columns)]
+        if not self.derived:
+            return columns
+        for row in range(nrows):
+            # NB: not attempting to support deriving values from other
+            # derived values.
+            simple_value_map = {}
+            for target, positions in self.targets.items():
+                target_values = dict(
+                    (self.parameters[i].name, columns[i][row])
+                    for i in positions if not callable(columns[i][row]))
+                if target_values:
+                    simple_value_map[target] = target_values
+            for i in self.derived:
+                value = columns[i][row]
+                if callable(value):
+                    columns[i][row] = value(simple_value_map)
+        return columns
+
+
+class SweepTable(object):
+    """
+    Columnar table of points of a sweep, with one array of value indexes
+    per parameter, and the layout shared by all of them. The values are
+    calculated for the whole table the first time one is needed.
+    get_instance returns an Instance that is a view of a row.
+    """
+    __slots__ = ('layout', 'columns', 'nrows', '_value_columns')
+
+    def __init__(self, layout, idx_sets):
+        self.layout = layout
+        self.columns = [array('I') for p in layout.parameters]
+        self.nrows = 0
+        for idx_set in idx_sets:
+            for column, value_i in zip(self.columns, idx_set):
+                column.append(value_i)
+            self.nrows += 1
+        self._value_columns = None
+
+    def __len__(self):
+        return self.nrows
+
+    def get_value_columns(self):
+        if self._value_columns is None:
+            self._value_columns = self.layout.get_value_columns(
+                self.columns, self.nrows)
+        return self._value_columns
+
+    def get_instance(self, row):
+        return Instance._from_table(self, row)
+
+
 class Instance(object):
     """
     Represent an instance of an application with fixed parameters. An
@@ -109,92 +505,94 @@ class Instance(object):
     level indicates the target for a parameter (application code or
     middlewear), and the second level contains the parameter values for that
     target.
-    """
-    def __init__(self):
-        # abstract container with all param values in a hierarchy based on
-        # their target
-        self._parameter_values = defaultdict(dict)
 
-        # temporary containers for staging params so derived values can
-        # be calculated after all are added.
-        self._simple_pv_list = defaultdict(list)
-        self._derived_pv_list = defaultdict(list)
-
-        # subset of paramaters related to application codes that will
-        # need to be run
-        self._code_commands = dict()
+    Instances of a sweep are views of a row of a SweepTable. An instance
+    created directly collects its parameters with add_parameter, and
+    becomes a single row table on first use.
+    """
+    __slots__ = ('_table', '_row', '_pending', '_parameter_values')
 
-        self._values_calculated = False
+    def __init__(self):
+        self._table = None
+        self._row = 0
+        # (parameters, value indexes) until the first get
+        self._pending = ([], [])
+        self._parameter_values = None
+
+    @classmethod
+    def _from_table(cls, table, row):
+        inst = cls.__new__(cls)
+        inst._table = table
+        inst._row = row
+        inst._pending = None
+        inst._parameter_values = None
+        return inst
 
     def add_parameter(self, p, idx):
-        if self._values_calculated:
+        if self._table is not None:
             raise ValueError("new parameters can't be added after get")
-        pv = ParameterValue(p, idx)
-        if callable(pv.value):
-            self._derived_pv_list[pv.target].append(pv)
-        else:
-            self._simple_pv_list[pv.target].append(pv)
+        self._pending[0].append(p)
+        self._pending[1].append(idx)
+
+    def _get_table(self):
+        if self._table is None:
+            parameters, indexes = self._pending
+            self._table = SweepTable(_InstanceLayout(parameters), [indexes])
+            self._pending = None
+        return self._table
+
+    def _get_value(self, i):
+        return self._get_table().get_value_columns()[i][self._row]
 
     @property
     def parameter_values(self):
-        """Wrapper to allow delayed calculation of derived parameter values."""
-        if not self._values_calculated:
-            self._calculate_values()
+        """Two level dict mapping target and parameter name to the
+        ParameterValue."""
+        if self._parameter_values is None:
+            layout = self._get_table().layout
+            self._parameter_values = defaultdict(dict)
+            for target, positions in layout.targets.items():
+                self._parameter_values[target] = dict(
+                    (layout.parameters[i].name, ParameterValue.with_value(
+                        layout.parameters[i], self._get_value(i)))
+                    for i in positions)
         return self._parameter_values
 
     @property
     def code_commands(self):
-        """Wrapper to allow delayed calculation of derived parameter values."""
-        if not self._values_calculated:
-            self._calculate_values()
-        return self._code_commands
-
-    def _calculate_values(self):
-        # Do in two steps, to support derived params across codes / run
-        # components. First step builds a two level dict with top level
-        # keys being target/code name, next level being simple param
-        # values for that target.
-        simple_value_map = {} # passed to fn for derived params
-        for target, target_pv_list in self._simple_pv_list.items():
-            # NB: not attempting to support deriving values from other
-            # derived values.
-            simple_value_map[target] = dict((pv.name, pv.value)
-                                            for pv in target_pv_list)
-
-        targets = (set(self._simple_pv_list.keys())
-                 | set(self._derived_pv_list.keys()))
-        for target in targets:
-            target_p = self._parameter_values[target]
-
-            target_pv_list = self._simple_pv_list[target]
-
-            for derived_pv in self._derived_pv_list[target]:
-                derived_pv.value = derived_pv.value(simple_value_map)
-                target_pv_list.append(derived_pv)
-
-            for pv in target_pv_list:
-                # Add a command for any code that has at least one param
-                # of any type, even if no command line args or opts.
-                if target not in self._code_commands:
-                    self._code_commands[target] = CodeCommand(target)
-
-                # Custom handling for command line param types
-                if pv.is_type(ParamCmdLineArg):
-                    self._code_commands[target].add_arg(pv.position, pv.value)
-                elif pv.is_type(ParamCmdLineOption):
-                    self._code_commands[target].add_option(pv.option, pv.value)
-                if pv.name in target_p:
-                    raise ValueError('parameter name conflict: "%s"' % pv.name)
-                # Always save the value, regardless of param type.
-                target_p[pv.name] = pv
-        self._values_calculated = True
+        """CodeCommand for every code that has at least one param of any
+        type, even if no command line args or opts."""
+        layout = self._get_table().layout
+        code_commands = {}
+        for target, positions in layout.targets.items():
+            cc = CodeCommand(target)
+            for i in positions:
+                p = layout.parameters[i]
+                if isinstance(p, ParamCmdLineArg):
+                    cc.add_arg(p.position, self._get_value(i))
+                elif isinstance(p, ParamCmdLineOption):
+                    cc.add_option(p.option, self._get_value(i))
+            code_commands[target] = cc
+        return code_commands
 
     def get_codes_argv(self):
         """Get an _unordered_ dict mapping code name to list of args for
         that code. Higher levels of model are responsible for re-ordering
         as needed."""
-        return dict([(k, cc.get_argv())
-                     for (k, cc) in self.code_commands.items()])
+        table = self._get_table()
+        values = table.get_value_columns()
+        row = self._row
+        codes_argv = {}
+        for target, (args, options) in table.layout.commands.items():
+            argv = [str(values[i][row]) for i in args]
+            for i in options:
+                # TODO: handle separator between option and value, e.g. '',
+                # '=', or ' '?
+                argv.append(table.layout.parameters[i].option)
+                if values[i][row] is not None:
+                    argv.append(str(values[i][row]))
+            codes_argv[target] = argv
+        return codes_argv
 
     def as_string(self):
         """Get a command line like value for the instance. Note that this
@@ -216,30 +614,30 @@ class Instance(object):
         """
         Get a list of ParamaterValues of the specified type in the instance.
         """
-        pvs = []
-        for target, target_params in self.parameter_values.items():
-            for name, pv in target_params.items():
-                if pv.is_type(param_class):
-                    pvs.append(pv)
-        return pvs
+        table = self._get_table()
+        positions = table.layout.get_positions_by_type(param_class)
+        if not positions:
+            return []
+        values = table.get_value_columns()
+        return [ParameterValue.with_value(table.layout.parameters[i],
+                                          values[i][self._row])
+                for i in positions]
+
+    def _get_runner_value(self, target, name, default=None):
+        layout = self._get_table().layout
+        i = layout.runner_params.get((target, name))
+        if i is None:
+            return default
+        return self._get_value(i)
 
     def get_nprocs(self, target):
-        pv = self.parameter_values[target].get('nprocs')
-        if pv is None:
-            return 1
-        return pv.value
+        return self._get_runner_value(target, 'nprocs', 1)
 
     def get_hostfile(self, target):
-        pv = self.parameter_values[target].get('hostfile')
-        if pv:
-            return pv.value
-        return None
+        return self._get_runner_value(target, 'hostfile')
 
     def get_sched_opts(self, target):
-        pv = self.parameter_values[target].get('sched_opts')
-        if pv:
-            return pv.value
-        return None
+        return self._get_runner_value(target, 'sched_opts')
 
     def as_dict(self):
         """
@@ -247,8 +645,13 @@ class Instance(object):
         parameter names. This ignores the type of the param, it's just the
         name value pairs.
         """
-        return dict((target, dict((pv.name, pv.value) for pv in d.values()))
-                    for target, d in self.parameter_values.items())
+        table = self._get_table()
+        values = table.get_value_columns()
+        parameters = table.layout.parameters
+        row = self._row
+        return dict((target, dict((parameters[i].name, values[i][row])
+                                  for i in positions))
+                    for target, positions in table.layout.targets.items())
 
 
 class CodeCommand(object):
@@ -17,6 +17,9 @@ import subprocess
 from codar.cheetah.sos_flow_analysis import sos_flow_analysis
 from codar.cheetah.helpers import get_immediate_subdirs, \
                                   require_campaign_directory
+from codar.savanna.status import load_workflow_status, status_exists
+from codar.savanna.model import RESULT_NAME
+from codar.savanna.supervisor import USAGE_KEYS
 
 
 class _RunParser:
@@ -119,10 +122,37 @@ class _RunParser:
                                     walltime_fname)
             if Path(filepath).is_file():
                 with open(filepath) as f:
-                    line = f.readline()
-                walltime_str = str(round(float(line), 2))
-                self.serialized_run_params[rc_name + "__time"] = walltime_str
-                self.serialized_run_params['timer_type'] = 'cheetah'
+                    walltime = float(f.readline())
+            else:
+                # segments output mode has no walltime files
+                walltime = self._get_result_run(rc_name).get('walltime')
+                if walltime is None:
+                    continue
+            walltime_str = str(round(walltime, 2))
+            self.serialized_run_params[rc_name + "__time"] = walltime_str
+            self.serialized_run_params['timer_type'] = 'cheetah'
+
+    def _get_result_run(self, rc_name):
+        """Get the result of a run component from the pipeline result
+        file, or an empty dict."""
+        result_path = os.path.join(self.run_dir, RESULT_NAME)
+        if not Path(result_path).is_file():
+            return {}
+        with open(result_path) as f:
+            runs = json.load(f).get('runs', {})
+        return runs.get(rc_name) or {}
+
+    def read_resource_usage(self):
+        """Add a column for each resource usage value recorded by Savanna
+        in the pipeline result file, e.g. 'xgc__maxrss_kb'."""
+        for rc_name in self.rc_names:
+            usage = self._get_result_run(rc_name).get('usage')
+            if usage is None:
+                continue
+            for key in USAGE_KEYS:
+                if usage.get(key) is not None:
+                    self.serialized_run_params[rc_name + "__" + key] = \
+                        usage[key]
 
     def read_adios_output_file_sizes(self):
         """
@@ -187,18 +217,21 @@ class _RunParser:
         for rc in self.rc_names:
             return_code_file = os.path.join(self.rc_working_dir[rc],
                                             "codar.workflow.return." + rc)
-            if not Path(return_code_file).is_file():
+            if Path(return_code_file).is_file():
+                with open(return_code_file) as f:
+                    ret_code = int(f.readline().strip())
+            else:
+                # segments output mode has no return code files
+                ret_code = self._get_result_run(rc).get('returncode')
+            if ret_code is None:
                 print("WARN: Could not find file " + return_code_file +
                       ". Skipping run directory.")
                 return False
-            with open(return_code_file) as f:
-                line = f.readline()
-                ret_code = int(line.strip())
-                if ret_code != 0:
-                    print("WARN: Run component " + rc +
-                          " in " + self.run_dir + " did not exit cleanly. " 
-                                                  "Skipping run directory.")
-                    return False
+            if ret_code != 0:
+                print("WARN: Run component " + rc +
+                      " in " + self.run_dir + " did not exit cleanly. "
+                                              "Skipping run directory.")
+                return False
         return True
 
     def serialize_params_nested_dict(self, nested_run_params_dict):
@@ -313,8 +346,9 @@ class _ReportGenerator:
 
         # Read status file
         try:
-            with open(status_file, 'r') as f:
-                status_json = json.load(f)
+            if not status_exists(status_file):
+                raise IOError(status_file)
+            status_json = load_workflow_status(status_file)
         except:
             print("ERROR: Could not read status file " + status_file)
             return
@@ -368,6 +402,10 @@ class _ReportGenerator:
             if not rp.read_sos_perf_data():
                 rp.get_cheetah_perf_data()
 
+            # Add the CPU time, max RSS, context switches and I/O of each
+            # run component, recorded by Savanna when it was reaped.
+            rp.read_resource_usage()
+
             # Get the sizes of the output adios files.
             # The sizes were calculated by the post-processing function
             # after the run finished.
@@ -10,6 +10,10 @@ import glob
 
 from codar.cheetah.helpers import get_immediate_subdirs, \
                                   require_campaign_directory
+from codar.savanna.status import load_workflow_status, status_exists
+from codar.savanna.producer import iter_pipeline_data
+from codar.savanna.metrics import load_summary
+from codar.savanna.logsink import load_output_index, read_output
 
 
 def print_campaign_status(campaign_directory, filter_user=None,
@@ -49,7 +53,9 @@ def print_campaign_status(campaign_directory, filter_user=None,
                                             'codar.workflow.status.json')
             walltime_file_path = os.path.join(group_dir,
                                               'codar.cheetah.walltime.txt')
-            if os.path.exists(status_file_path):
+            metrics_file_path = os.path.join(group_dir,
+                                             'codar.workflow.metrics.jsonl')
+            if status_exists(status_file_path):
                 status_data, state_counts, reason_counts, rc_counts = \
                                     get_workflow_status(status_file_path)
                 total = len(status_data)
@@ -60,6 +66,7 @@ def print_campaign_status(campaign_directory, filter_user=None,
                               total-ok, '/', total, 'failed')
                     else:
                         print(user_group, ':', 'DONE')
+                    _print_utilization_summary(metrics_file_path, indent=2)
                 else:
                     in_progress = (state_counts['running']
                                    + state_counts['not_started'])
@@ -86,11 +93,31 @@ def print_campaign_status(campaign_directory, filter_user=None,
                 print(user_group, ':', 'NOT STARTED')
 
 
+def _print_utilization_summary(metrics_file_path, indent=0):
+    """Print node utilization and scheduler latencies from the summary
+    written by the workflow when it finished, if available."""
+    summary = load_summary(metrics_file_path)
+    if summary is None:
+        return
+    prefix = " " * indent
+    utilization = summary.get('utilization')
+    if utilization is not None:
+        print('%sutilization %.1f%%, node-seconds busy %d, idle %d'
+              % (prefix, 100 * utilization, summary['node_seconds_busy'],
+                 summary['node_seconds_idle']))
+    for key in ['queue_wait', 'launch_latency', 'teardown',
+                'post_process_wait', 'post_process_runtime']:
+        stat = summary.get(key) or {}
+        if stat.get('count'):
+            print('%s%s mean %.2fs, max %.2fs'
+                  % (prefix, key.replace('_', ' '), stat['mean'],
+                     stat['max']))
+
+
 def _get_group_code_names(fob_file_path):
     """Extract code names from first run in fobs file."""
-    with open(fob_file_path) as f:
-        data = json.load(f)[0]
-        return [r['name'] for r in data['runs']]
+    data = next(iter_pipeline_data(fob_file_path))
+    return [r['name'] for r in data['runs']]
 
 
 def _print_fobrun_log(log_file_path, log_level, filter_run=None):
@@ -115,12 +142,38 @@ def _print_fobrun_log(log_file_path, log_level, filter_run=None):
 
 
 def _print_group_code_output(group_dir, filter_run=None, filter_code=None):
+    # output captured in segments output mode, by run directory
+    segment_outputs = defaultdict(list)
+    for (working_dir, code), entry in load_output_index(group_dir).items():
+        working_dir = os.path.abspath(working_dir)
+        segment_outputs[working_dir].append(entry)
+        # experiments using component subdirs
+        segment_outputs[os.path.dirname(working_dir)].append(entry)
+
     run_dirs = get_immediate_subdirs(group_dir)
     for run_name in run_dirs:
         if filter_run and run_name not in filter_run:
             continue
         run_dir = os.path.join(group_dir, run_name)
         _print_run_code_output(run_name, run_dir, filter_code)
+        entries = segment_outputs.get(os.path.abspath(run_dir), [])
+        _print_run_segment_output(run_name, group_dir, entries, filter_code)
+
+
+def _print_run_segment_output(run_name, group_dir, entries,
+                              filter_code=None):
+    for entry in sorted(entries, key=lambda e: e['name']):
+        code = entry['name']
+        if filter_code and code not in filter_code:
+            continue
+        for k in ['out', 'err']:
+            data = read_output(group_dir, entry, 'std' + k)
+            print('>>>', run_name, code, 'std' + k,
+                  '(%d bytes)' % len(data))
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+            print()
 
 
 def _print_run_code_output(run_name, run_dir, filter_code=None):
@@ -185,8 +238,7 @@ def get_workflow_status(status_file_path, print_counts=False, indent=0,
                         print_parameters=False,
                         filter_code=None, run_summary=False,
                         code_names=None):
-    with open(status_file_path) as f:
-        status_data = json.load(f)
+    status_data = load_workflow_status(status_file_path)
 
     group_path = os.path.dirname(status_file_path)
 
@@ -13,6 +13,9 @@ export CODAR_CHEETAH_APP_CONFIG="{app_config}"
 export CODAR_WORKFLOW_SCRIPT="{workflow_script_path}"
 export CODAR_WORKFLOW_RUNNER="{workflow_runner}"
 export CODAR_CHEETAH_WORKFLOW_LOG_LEVEL="{workflow_debug_level}"
+export CODAR_WORKFLOW_SCHEDULER_POLICY="{workflow_scheduler_policy}"
+export CODAR_WORKFLOW_OUTPUT="{workflow_output}"
+export CODAR_WORKFLOW_MAX_POST_PROCESSES="{workflow_max_post_processes}"
 export CODAR_CHEETAH_UMASK="{umask}"
 export CODAR_PYTHON="{codar_python}"
 """
@@ -2,14 +2,21 @@
 specified total process limit."""
 
 import threading
-import os
-import json
+import asyncio
+import time
+import heapq
 import logging
-from queue import Queue
 
-from codar.cheetah.helpers import get_file_size
 from codar.savanna import status
-from codar.savanna.scheduler import JobList
+from codar.savanna.scheduler import JobList, GreedyPolicy, NodePool
+from codar.savanna.supervisor import ProcessSupervisor, AsyncioSupervisor
+from codar.savanna.taskfarm import TaskFarm
+from codar.savanna.sampler import ProcessSampler
+from codar.savanna.metrics import SchedulerMetrics
+from codar.savanna.trace import TraceWriter
+from codar.savanna.logsink import OutputSink, SEGMENT_SIZE
+from codar.savanna.inventory import OutputInventory
+from codar.savanna.postprocess import PostProcessQueue
 
 
 _log = logging.getLogger('codar.savanna.consumer')
@@ -22,31 +29,98 @@ class PipelineRunner(object):
 
     Threading model: assumes there could be multiple producer threads calling
     add_pipeline, e.g. if using a dynamic job submission model based on
-    results of previous jobs. Pipelines and each Run in a pipeline are all
-    executed in separate threads, so their notification callbacks execute in
-    separate threads, and their threads must be joined before exiting. The
+    results of previous jobs. The processes of all Runs are watched by a
+    single supervisor thread owned by the runner, and the Pipeline and Run
+    notification callbacks execute in that thread. Pipeline post processing
+    runs in separate threads. Pipelines must be joined before exiting. The
     stop and kill_all methods could be called from any of the producer,
-    Pipeline or Run threads."""
+    supervisor or post processing threads."""
 
     def __init__(self, runner, max_nodes, machine_name, processes_per_node,
-                 status_file=None):
+                 status_file=None, scheduler_policy=None, deadline=None,
+                 max_queued=None, metrics_file=None, trace_file=None,
+                 max_post_processes=None):
         self.max_nodes = max_nodes
         self.machine_name = machine_name
         self.ppn = processes_per_node
         self.runner = runner
 
+        self.supervisor = self._create_supervisor()
+
+        # If set, runs that fit on a single node are started by long lived
+        # workers instead of the runner, see start_task_farm
+        self.task_farm = None
+
+        # If set, the process groups of running runs are sampled, see
+        # start_sampler
+        self.sampler = None
+
+        # If set, the output of runs is captured in a few segment files
+        # instead of files in each run directory, see start_output_sink
+        self.output_sink = None
+
+        # Writes the ADIOS output inventory of finished pipelines, after
+        # their nodes are released
+        self.inventory = OutputInventory()
+
         if status_file is not None:
             self._status = status.WorkflowStatus(status_file)
         else:
             self._status = None
 
+        if metrics_file is not None:
+            self.metrics = SchedulerMetrics(metrics_file, max_nodes)
+        else:
+            self.metrics = None
+
+        if trace_file is not None:
+            self.tracer = TraceWriter(trace_file)
+        else:
+            self.tracer = None
+
+        # Post process scripts of finished pipelines wait here if
+        # max_post_processes are already running, default is the number
+        # of CPUs
+        self.post_process_queue = PostProcessQueue(max_post_processes,
+                                                   self.metrics)
+
         self.job_list_cv = threading.Condition()
         costfn = lambda pipe_or_run: pipe_or_run.get_nodes_used()
         self.job_list = JobList(costfn)
-
+        self.scheduler_policy = scheduler_policy or GreedyPolicy()
+
+        # If set, producers should not add more pipelines while this many
+        # are waiting in the job list, see wait_for_space. Notified when
+        # pipelines are removed from the job list, or no more pipelines
+        # are allowed.
+        self.max_queued = max_queued
+        self.space_cv = threading.Condition()
+
+        # If set, time.time() value when the allocation ends. Pipelines that
+        # are not expected to finish by then are not started.
+        self.deadline = deadline
+
+        # Max heap of (-estimate, seq, pipeline) for the queued pipelines,
+        # used to find the ones that can't finish before the deadline
+        # without checking the whole job list, see _remove_late_pipelines.
+        # An entry is stale if seq is not the one in _estimate_seqs for the
+        # pipeline id. Protected by free_cv.
+        self._estimate_heap = []
+        self._estimate_seqs = {}
+        self._estimate_count = 0
+
+        # runtime of finished pipelines by iteration key, used to estimate
+        # the runtime of other iterations of the same run
+        self._runtime_history = {}
+
+        # Relative names of free nodes, starting with 1, for creating ERF
+        # files on Summit. Protected by free_cv.
         self.free_cv = threading.Condition()
-        self.free_nodes = max_nodes
+        self.node_pool = NodePool(max_nodes)
 
+        # Lock order: free_cv is taken first, and pipelines_lock,
+        # job_list_cv and space_cv may be taken while holding it, never the
+        # other way around.
         self.pipelines_lock = threading.Lock()
         self.pipelines = []
         self._pipeline_ids = set()
@@ -56,22 +130,47 @@ class PipelineRunner(object):
         self._allow_new_pipelines = True
         self._killed = False
 
-        # a queue of allocated nodes
-        self.allocated_nodes = self._get_node_list(machine_name, max_nodes)
-
-    def _get_node_list(self, machine_name, max_nodes):
-        """Get a list of hostnames in this allocation.
-        Currently supported for Summit only. Hostnames start with 'host1'"""
-
-        q = Queue()
-        # if machine_name.lower() == 'summit':
-        "add relative node names starting with 1 for creating ERF files"
-        for i in range(max_nodes):
-            q.put('{}'.format(i+1))
-        return q
+    def _create_supervisor(self):
+        supervisor = ProcessSupervisor()
+        supervisor.start()
+        return supervisor
+
+    def start_task_farm(self, task_runner=None, working_dir=None):
+        """Start a task farm worker on each node. Must be called before
+        adding pipelines. The worker logs go in working_dir, default is the
+        current directory. See codar.savanna.taskfarm."""
+        self.task_farm = TaskFarm(self.supervisor, self.runner,
+                                  self.max_nodes, task_runner, working_dir)
+        self.task_farm.start_workers()
+
+    def start_sampler(self, interval):
+        """Sample the CPU, RSS and threads of each run's process group every
+        interval seconds. Must be called before adding pipelines. See
+        codar.savanna.sampler."""
+        self.sampler = ProcessSampler(interval)
+        self.sampler.start()
+
+    def start_output_sink(self, dir_path, segment_size=SEGMENT_SIZE):
+        """Capture the stdout and stderr of runs, and their return code and
+        walltime, in segment files and an index in dir_path, instead of
+        files in each run directory. Must be called before adding
+        pipelines. See codar.savanna.logsink."""
+        self.output_sink = OutputSink(dir_path, segment_size)
+        self.output_sink.start()
+
+    @property
+    def free_nodes(self):
+        return self.node_pool.free
 
     def add_pipeline(self, p):
+        """Queue a pipeline. Returns False without queueing it if the
+        consumer was killed, which can happen at any time from a signal
+        handler, so producers must check the result. Raises ValueError if
+        called after stop, or for a duplicate pipeline id."""
         with self.pipelines_lock:
+            if self._killed:
+                _log.debug("pipeline '%s' not added, consumer killed", p.id)
+                return False
             if not self._allow_new_pipelines:
                 raise ValueError(
                     "new pipelines are not allowed after stop or kill")
@@ -94,13 +193,49 @@ class PipelineRunner(object):
                     state = p.get_state()
                     state.reason = status.REASON_NOFIT
                     self._status.set_state(state)
-                return
+                return True
             elif self._status is not None:
                 self._status.set_state(p.get_state())
 
-        with self.job_list_cv:
-            self.job_list.add_job(p)
-            self.job_list_cv.notify()
+            if self.output_sink is not None:
+                # needed before start, for walltimes of previous attempts
+                for run in p.runs:
+                    run.output_sink = self.output_sink
+
+        # free_cv is held while queueing, so _pop_job never sees the
+        # pipeline in the job list without its deadline heap entry
+        with self.free_cv:
+            with self.job_list_cv:
+                self.job_list.add_job(p)
+                if self.metrics is not None:
+                    self.metrics.pipeline_queued(p, len(self.job_list))
+                if self.tracer is not None:
+                    self.tracer.pipeline_queued(p)
+                self.job_list_cv.notify()
+            if self.deadline is not None:
+                self._push_estimate(p, self.get_runtime_estimate(p))
+
+            # the new pipeline may fit in the free nodes
+            self.free_cv.notify()
+        return True
+
+    def wait_for_space(self):
+        """Block until the job list has room for another pipeline, so
+        producers can avoid creating Pipeline objects long before they can
+        be started. Returns False if new pipelines are no longer allowed,
+        e.g. after kill_all."""
+        with self.space_cv:
+            while self._allow_new_pipelines and self._job_list_full():
+                self.space_cv.wait()
+            return self._allow_new_pipelines
+
+    def _job_list_full(self):
+        return (self.max_queued is not None
+                and len(self.job_list) >= self.max_queued)
+
+    def _notify_space(self):
+        with self.space_cv:
+            self.space_cv.notify_all()
 
     def stop(self):
         """Signal to stop when all pipelines are finished. Don't allow adding
@@ -110,6 +245,7 @@ class PipelineRunner(object):
         # signal main thread to wake up and check state
         with self.job_list_cv:
             self.job_list_cv.notify()
+        self._notify_space()
 
     def kill_all(self):
         """Kill all running processes spawned by this consumer and don't
@@ -130,62 +266,82 @@ class PipelineRunner(object):
         with self.job_list_cv:
             self.job_list_cv.notify()
 
+        self._notify_space()
+
+        self.post_process_queue.cancel_pending()
+
+        # Signal every pipeline before doing anything else, so their
+        # grace periods run in parallel. force_kill_all does not block,
+        # the signals are sent by the supervisor.
+        for pipe in still_running:
+            pipe.force_kill_all()
+
         for pipe in still_running:
             # Release allocated nodes. Don't really need to do this as all
             # pipelines are being killed.
-            # Return nodes used by the pipeline
-            while not pipe.nodes_assigned.empty():
-                pipe_node = pipe.nodes_assigned.get()
-                self.allocated_nodes.put(pipe_node)
-
-            pipe.force_kill_all()
-            _log.debug("killed pipeline {}, free nodes {} -> {}".format(
-                pipe.id, self.free_nodes, self.free_nodes + pipe.total_nodes))
+            with self.free_cv:
+                nodes = pipe.release_all_nodes()
+                _log.debug("killed pipeline {}, free nodes {} -> {}".format(
+                    pipe.id, self.free_nodes, self.free_nodes + len(nodes)))
+                self.node_pool.release(nodes)
+                self._nodes_changed(nodes)
         # NB: the run_pipelines methods will block waiting for the
         # pipelines, so we don't need to do that here. Callers that want
         # to block can call join on the consumer thread.
 
-    def run_finished(self, run):
-        """TO BE DEPRECATED.
-        Monitor thread(s) should call this as runs
-        complete. To be deprecated, as the functionality fails when
-        node_layout is set to node-sharing.
-
-        This means that for node_exclusive, resources held by a run are not
-        released when the run terminates. For kill_on_partial_failure=False,
-        this could lead to unused resources, which is ok."""
-        # with self.free_cv:
-        #     _log.debug("finished run, free nodes %d -> %d",
-        #                self.free_nodes, self.free_nodes + run.get_nodes_used())
-        #     self.free_nodes += run.get_nodes_used()
-        #     self.free_cv.notify()
-        pass
+    def nodes_released(self, pipeline, nodes):
+        """Pipelines call this when all the runs using some of their nodes
+        have finished, before the pipeline itself is finished. The runs
+        sharing nodes, or depending on each other, are tracked by the
+        pipeline, see Pipeline._set_node_groups."""
+        with self.free_cv:
+            _log.debug("pipeline {} released nodes {}, free nodes {} -> {}"
+                       .format(pipeline.id, nodes, self.free_nodes,
+                               self.free_nodes + len(nodes)))
+            self.node_pool.release(nodes)
+            self._nodes_changed(nodes)
+            self.free_cv.notify()
+
+    def _nodes_changed(self, released=None):
+        """Record the nodes in use in the metrics, and the released nodes
+        in the trace. Must be called with free_cv acquired!"""
+        if self.metrics is not None:
+            self.metrics.nodes_changed(self.max_nodes - self.free_nodes)
+        if self.tracer is not None and released:
+            self.tracer.nodes_released(released)
 
     def pipeline_finished(self, pipeline):
         """Monitor thread(s) should call this as pipelines complete."""
 
-        # Get the sizes of all output adios files
-        self._get_adios_file_sizes(pipeline)
+        state = pipeline.get_state()
+        if state.reason == status.REASON_SUCCEEDED:
+            self._runtime_history[pipeline.iteration_key] = \
+                time.time() - pipeline.start_time
 
         # Free resources used by the pipeline
         with self.free_cv:
-            # Return nodes used by the pipeline
-            while not pipeline.nodes_assigned.empty():
-                pipe_node = pipeline.nodes_assigned.get()
-                self.allocated_nodes.put(pipe_node)
-
+            # Return nodes still held by the pipeline
+            nodes = pipeline.release_all_nodes()
             _log.debug("finished pipeline {}, free nodes {} -> {}".format(
-                pipeline.id, self.free_nodes, self.free_nodes +
-                                              pipeline.total_nodes))
-            self.free_nodes += pipeline.total_nodes
+                pipeline.id, self.free_nodes, self.free_nodes + len(nodes)))
+            self.node_pool.release(nodes)
+            self._nodes_changed(nodes)
 
             self.free_cv.notify()
 
+        # Get the sizes of all output adios files
+        self.inventory.submit(pipeline.working_dir)
+
+        if self.metrics is not None:
+            self.metrics.pipeline_finished(pipeline)
+        if self.tracer is not None:
+            self.tracer.pipeline_finished(pipeline)
+
         # Remove pipeline from list of running pipelines
         with self.pipelines_lock:
             self._running_pipelines.remove(pipeline)
             if self._status is not None:
-                self._status.set_state(pipeline.get_state())
+                self._status.set_state(state)
 
     def pipeline_fatal(self, pipeline):
         _log.error("fatal error in pipeline '%s'" % pipeline.id)
@@ -196,7 +352,6 @@ class PipelineRunner(object):
         threads are complete."""
         while True:
             # wait until a job is available or end has been signaled
-            nodes_assigned = []
             no_more_pipelines = False
             with self.job_list_cv:
                 while len(self.job_list) == 0:
@@ -206,42 +361,196 @@ class PipelineRunner(object):
                     self.job_list_cv.wait()
 
             if no_more_pipelines:
-                self._join_running_pipelines()
+                self._finish()
                 return
 
             # wait until nodes are available or quit has been signaled
             with self.free_cv:
-                pipeline = self.job_list.pop_job(self.free_nodes)
+                pipeline = self._pop_job()
                 while pipeline is None:
                     if not self._process_pipelines:
                         break
+                    if len(self.job_list) == 0:
+                        # all remaining pipelines were past the deadline
+                        break
                     self.free_cv.wait()
-                    pipeline = self.job_list.pop_job(self.free_nodes)
-
-                if self._process_pipelines:
-                    _log.debug("starting pipeline %s, free nodes %d -> %d",
-                               pipeline.id, self.free_nodes,
-                               self.free_nodes - pipeline.get_nodes_used())
-                    self.free_nodes -= pipeline.get_nodes_used()
+                    pipeline = self._pop_job()
 
-                    # Get a list of node names from the allocated nodes and
-                    # assign it to the pipeline
-                    for i in range(pipeline.total_nodes):
-                        nodes_assigned.append(self.allocated_nodes.get())
-                    _log.debug("pipeline {0} allocated nodes {1}".format(
-                        pipeline.id, nodes_assigned))
+                if self._process_pipelines and pipeline is not None:
+                    nodes_assigned = self._allocate_nodes(pipeline)
 
             if not self._process_pipelines:
-                self._join_running_pipelines()
+                self._finish()
                 return
 
-            with self.pipelines_lock:
-                pipeline.start(self, nodes_assigned, self.runner)
-                self._running_pipelines.add(pipeline)
-                if self._status is not None:
-                    self._status.set_state(pipeline.get_state())
+            if pipeline is None:
+                continue
+
+            self._start_pipeline(pipeline, nodes_assigned)
+
+        self._finish()
+
+    def get_pipeline_status(self, pipe_id):
+        """Get the status data of a pipeline, as saved in the status file,
+        or None if the pipeline is unknown or there is no status file."""
+        if self._status is None:
+            return None
+        return self._status.get_state(pipe_id)
+
+    def get_runtime_estimate(self, pipeline):
+        return pipeline.get_runtime_estimate(self._runtime_history)
+
+    def _pop_job(self):
+        """Use the scheduling policy to remove the next pipeline to start
+        from the job list, or return None if none can be started now. Must
+        be called with free_cv acquired!"""
+        now = self._now()
+        if self.deadline is not None:
+            self._remove_late_pipelines(now)
+        running = []
+        if self.scheduler_policy.uses_running:
+            running = self._get_running_estimates()
+        while len(self.job_list) > 0:
+            pipeline = self.scheduler_policy.pop_job(
+                                    self.job_list, self.free_nodes, running,
+                                    now, self.get_runtime_estimate)
+            if pipeline is None:
+                return None
+            self._notify_space()
+            if self.deadline is None:
+                return pipeline
+            self._estimate_seqs.pop(pipeline.id, None)
+            # the heap only has the estimate at the time it was pushed, and
+            # the runtime history may have raised it since
+            estimate = self.get_runtime_estimate(pipeline)
+            if not self._is_late(estimate, now):
+                return pipeline
+            self._drop_late_pipeline(pipeline, estimate, now)
+        return None
+
+    def _get_running_estimates(self):
+        """Get the (nodes, end_time) pairs of the running pipelines passed
+        to the scheduling policy, with end_time None if the runtime is not
+        known. Must be called with free_cv acquired, which is taken before
+        pipelines_lock."""
+        running = []
+        with self.pipelines_lock:
+            for p in self._running_pipelines:
+                estimate = self.get_runtime_estimate(p)
+                end_time = None
+                if estimate is not None:
+                    end_time = p.start_time + estimate
+                running.append((p.get_nodes_held(), end_time))
+        return running
+
+    def _now(self):
+        """Current time for scheduling decisions, overridden by the
+        simulator's virtual clock."""
+        return time.time()
+
+    def _push_estimate(self, pipeline, estimate):
+        """Track a queued pipeline in the deadline heap, replacing any
+        previous entry. Pipelines without a runtime estimate are not
+        tracked. Must be called with free_cv acquired!"""
+        if estimate is None:
+            self._estimate_seqs.pop(pipeline.id, None)
+            return
+        self._estimate_count += 1
+        self._estimate_seqs[pipeline.id] = self._estimate_count
+        heapq.heappush(self._estimate_heap,
+                       (-estimate, self._estimate_count, pipeline))
+
+    def _is_late(self, estimate, now):
+        return estimate is not None and estimate > self.deadline - now
+
+    def _remove_late_pipelines(self, now):
+        """Remove pipelines that are not expected to finish before the
+        deadline from the job list. They are left in the not_started state,
+        so they will be run by the next submission of the group. Pipelines
+        without a runtime estimate are kept.
+
+        Only the heap entries with an estimate over the remaining time are
+        looked at. An estimate that changed since it was pushed is pushed
+        again with the new value, and estimates that went up are caught
+        when the pipeline is popped, see _pop_job. Must be called with
+        free_cv acquired!"""
+        heap = self._estimate_heap
+        while heap and self._is_late(-heap[0][0], now):
+            neg_estimate, seq, p = heapq.heappop(heap)
+            if self._estimate_seqs.get(p.id) != seq:
+                # started, dropped or pushed again
+                continue
+            estimate = self.get_runtime_estimate(p)
+            if estimate != -neg_estimate:
+                self._push_estimate(p, estimate)
+                continue
+            del self._estimate_seqs[p.id]
+            self.job_list.remove_job(p)
+            self._notify_space()
+            self._drop_late_pipeline(p, estimate, now)
+
+    def _drop_late_pipeline(self, p, estimate, now):
+        """Record that a pipeline removed from the job list won't be
+        started because of the deadline."""
+        remaining = self.deadline - now
+        if self.metrics is not None:
+            self.metrics.pipeline_dropped(p, len(self.job_list))
+        if self.tracer is not None:
+            self.tracer.pipeline_dropped(p, status.REASON_NOTIME)
+        _log.info("pipeline '%s' estimated runtime %d > remaining %d, "
+                  "not starting", p.id, estimate, remaining)
+        if self._status is not None:
+            state = p.get_state()
+            state.reason = status.REASON_NOTIME
+            self._status.set_state(state)
+
+    def _allocate_nodes(self, pipeline):
+        """Take nodes for pipeline from the free pool and return a list of
+        their names. Must be called with free_cv acquired!"""
+        _log.debug("starting pipeline %s, free nodes %d -> %d",
+                   pipeline.id, self.free_nodes,
+                   self.free_nodes - pipeline.get_nodes_used())
+
+        # Get a list of node names from the allocated nodes and
+        # assign it to the pipeline
+        nodes_assigned = self.node_pool.take(pipeline.get_nodes_used())
+        self._nodes_changed()
+        if self.tracer is not None:
+            self.tracer.nodes_taken(pipeline, nodes_assigned)
+        _log.debug("pipeline {0} allocated nodes {1}".format(
+            pipeline.id, nodes_assigned))
+        return nodes_assigned
+
+    def _start_pipeline(self, pipeline, nodes_assigned):
+        with self.pipelines_lock:
+            pipeline.start(self, nodes_assigned, self.runner)
+            self._running_pipelines.add(pipeline)
+            if self.metrics is not None:
+                self.metrics.pipeline_started(pipeline, len(self.job_list))
+            if self._status is not None:
+                self._status.set_state(pipeline.get_state())
 
+    def _finish(self):
+        """Wait for running pipelines, stop the supervisor and write the
+        final status snapshot."""
         self._join_running_pipelines()
+        self.post_process_queue.join()
+        if self.task_farm is not None:
+            self.task_farm.stop()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.supervisor.stop()
+        self.supervisor.join()
+        self.inventory.close()
+        if self.output_sink is not None:
+            self.output_sink.stop()
+            self.output_sink.join()
+        if self._status is not None:
+            self._status.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.tracer is not None:
+            self.tracer.close()
 
     def _join_running_pipelines(self):
         """Wait for any pipelines that are still running to complete. Use
@@ -250,31 +559,105 @@ class PipelineRunner(object):
         harmless).
 
         This must be called without any locks held, since the Pipeline and
-        Run threads may need to acquire them in the callback functions set
-        by the consumer."""
+        Run callbacks on the supervisor thread may need to acquire them in
+        the callback functions set by the consumer."""
         still_running = list(self._running_pipelines)
         for pipeline in still_running:
             pipeline.join_all()
 
-    def _get_adios_file_sizes(self, pipeline):
-        """
-        Record the size of all adios files in the run dir.
-        """
-
-        def _adios_file_sizes_recursive(path):
-            fname_size = {}
-            for entry in os.scandir(path):
-                if entry.name.endswith(".bp") or entry.name.endswith(".bp.dir"):
-                    size = get_file_size(entry)
-                    relative_path = entry.path.split(path+"/", 1).pop()
-                    fname_size[relative_path] = size
-                elif entry.is_dir():
-                    _adios_file_sizes_recursive(entry.path)
-            return fname_size
-
-        d_fname_size =_adios_file_sizes_recursive(pipeline.working_dir)
-        # Write dict to file
-        out_fname = os.path.join(pipeline.working_dir,
-                                 ".codar.adios_file_sizes.out.json")
-        with open(out_fname, 'w') as f:
-            f.write(json.dumps(d_fname_size))
+
+class AsyncPipelineRunner(PipelineRunner):
+    """Runner for the asyncio engine. The scheduling loop is a coroutine
+    that shares an event loop with the producer and with process
+    supervision (AsyncioSupervisor), so all Pipeline and Run callbacks are
+    executed on the loop thread. The locks and condition variables of the
+    base class are never held across an await, so they are never contended;
+    the scheduling loop waits on an asyncio.Event that is set whenever the
+    condition variables would be notified."""
+
+    def __init__(self, loop, runner, max_nodes, machine_name,
+                 processes_per_node, status_file=None, scheduler_policy=None,
+                 deadline=None, max_queued=None, metrics_file=None,
+                 trace_file=None, max_post_processes=None):
+        self.loop = loop
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        PipelineRunner.__init__(self, runner, max_nodes, machine_name,
+                                processes_per_node, status_file,
+                                scheduler_policy, deadline, max_queued,
+                                metrics_file, trace_file,
+                                max_post_processes)
+
+    def _create_supervisor(self):
+        return AsyncioSupervisor(self.loop)
+
+    def add_pipeline(self, p):
+        if not PipelineRunner.add_pipeline(self, p):
+            return False
+        self._wakeup.set()
+        return True
+
+    async def wait_for_space(self):
+        """Coroutine version of PipelineRunner.wait_for_space."""
+        while self._allow_new_pipelines and self._job_list_full():
+            self._space.clear()
+            await self._space.wait()
+        return self._allow_new_pipelines
+
+    def _notify_space(self):
+        self._space.set()
+
+    def stop(self):
+        PipelineRunner.stop(self)
+        self._wakeup.set()
+
+    def kill_all(self):
+        PipelineRunner.kill_all(self)
+        self._wakeup.set()
+
+    def nodes_released(self, pipeline, nodes):
+        PipelineRunner.nodes_released(self, pipeline, nodes)
+        self._wakeup.set()
+
+    def pipeline_finished(self, pipeline):
+        PipelineRunner.pipeline_finished(self, pipeline)
+        self._wakeup.set()
+
+    async def run_pipelines(self):
+        """Main scheduling coroutine. Does not return until all pipelines
+        and the processes they started are complete."""
+        while self._process_pipelines:
+            self._wakeup.clear()
+            pipeline = None
+            if len(self.job_list) > 0:
+                pipeline = self._pop_job()
+                if len(self.job_list) == 0 and pipeline is None:
+                    # all remaining pipelines were past the deadline
+                    continue
+            elif not self._allow_new_pipelines:
+                break
+            if pipeline is None:
+                await self._wakeup.wait()
+                continue
+            nodes_assigned = self._allocate_nodes(pipeline)
+            self._start_pipeline(pipeline, nodes_assigned)
+
+        # Pipeline.join_all blocks on events set by callbacks on this loop,
+        # so it must be called from another thread.
+        await self.loop.run_in_executor(None, self._join_running_pipelines)
+        await self.loop.run_in_executor(None, self.post_process_queue.join)
+        if self.task_farm is not None:
+            self.task_farm.stop()
+        if self.sampler is not None:
+            self.sampler.stop()
+        await self.supervisor.wait_closed()
+        await self.loop.run_in_executor(None, self.inventory.close)
+        if self.output_sink is not None:
+            self.output_sink.stop()
+            await self.loop.run_in_executor(None, self.output_sink.join)
+        if self._status is not None:
+            self._status.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        if self.tracer is not None:
+            self.tracer.close()
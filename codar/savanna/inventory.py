@@ -0,0 +1,118 @@
+"""
+Inventory of the ADIOS output of finished pipelines, written to
+.codar.adios_file_sizes.out.json in the pipeline working directory for the
+report generator. Maps the path of every .bp file or .bp.dir directory,
+relative to the working directory, to its size in bytes, which for
+directories is the total size of the files they contain.
+
+Walking a large run directory can take minutes on a parallel file system,
+so it is done after the nodes of the pipeline are released, by a bounded
+pool of inventory threads. Each inventory walks its tree one level at a
+time, listing the directories of a level in parallel on a separate pool of
+scan threads. Every entry is stat'ed at most once, using the type from the
+directory listing to tell files from directories, and symlinks are not
+followed.
+"""
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+INVENTORY_NAME = '.codar.adios_file_sizes.out.json'
+ADIOS_SUFFIXES = ('.bp', '.bp.dir')
+
+# Pipelines inventoried at the same time, and directories listed at the
+# same time over all of them
+INVENTORY_WORKERS = 4
+SCAN_WORKERS = 16
+
+_log = logging.getLogger('codar.savanna.inventory')
+
+
+def _scan_dir(path):
+    """List a directory. Returns a list of (path, name, size) for files
+    and a list of (path, name) for subdirectories."""
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append((entry.path, entry.name))
+                    else:
+                        size = entry.stat(follow_symlinks=False).st_size
+                        files.append((entry.path, entry.name, size))
+                except OSError:
+                    # removed while listing
+                    continue
+    except OSError as e:
+        _log.warning('inventory could not list %s: %s', path, e)
+    return files, dirs
+
+
+def get_adios_file_sizes(root, map_fn=map):
+    """Get a dict mapping the path relative to root of every ADIOS file or
+    directory under root to its size. Directories of each level are listed
+    with map_fn(_scan_dir, paths), e.g. the map of an executor."""
+    sizes = {}
+    # directories to list, with the key of the ADIOS directory they are
+    # part of, or None
+    level = [(root, None)]
+    while level:
+        results = map_fn(_scan_dir, [path for path, owner in level])
+        next_level = []
+        for (path, owner), (files, dirs) in zip(level, results):
+            for file_path, name, size in files:
+                if owner is not None:
+                    sizes[owner] += size
+                elif name.endswith(ADIOS_SUFFIXES):
+                    sizes[os.path.relpath(file_path, root)] = size
+            for dir_path, name in dirs:
+                dir_owner = owner
+                if owner is None and name.endswith(ADIOS_SUFFIXES):
+                    dir_owner = os.path.relpath(dir_path, root)
+                    sizes[dir_owner] = 0
+                next_level.append((dir_path, dir_owner))
+        level = next_level
+    return sizes
+
+
+class OutputInventory(object):
+    """Write the ADIOS output inventory of pipelines in the background.
+    submit is thread safe."""
+
+    def __init__(self, max_workers=INVENTORY_WORKERS,
+                 scan_workers=SCAN_WORKERS):
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._scan_pool = ThreadPoolExecutor(max_workers=scan_workers)
+        self._closed = False
+
+    def submit(self, working_dir):
+        """Write the inventory of working_dir once a worker is free."""
+        with self._lock:
+            if self._closed:
+                _log.warning('inventory closed, skipping %s', working_dir)
+                return
+            self._pool.submit(self._write_inventory, working_dir)
+
+    def close(self):
+        """Wait for the submitted inventories to be written. Safe to call
+        more than once."""
+        with self._lock:
+            self._closed = True
+        self._pool.shutdown(wait=True)
+        self._scan_pool.shutdown(wait=True)
+
+    def _write_inventory(self, working_dir):
+        try:
+            sizes = get_adios_file_sizes(working_dir, self._scan_pool.map)
+            out_path = os.path.join(working_dir, INVENTORY_NAME)
+            with open(out_path, 'w') as f:
+                json.dump(sizes, f)
+        except Exception:
+            _log.exception('inventory of %s failed', working_dir)
@@ -0,0 +1,339 @@
+"""
+Aggregated output for runs, so a group with many runs does not create
+several small files per run on a parallel file system.
+
+In the segments output mode, the stdout and stderr of every Run are
+captured through pipes by a single OutputSink thread, and appended as
+framed records to a few large segment files in the group directory,
+codar.workflow.output.<n>. A new segment is started when the current one
+reaches segment_size bytes, and by every submission of the group. Each
+record is a header followed by the data:
+
+    magic b'CWO1', run key (uint32), stream (uint8, 1 stdout, 2 stderr),
+    data length (uint32), little endian
+
+When a run is done and both of its pipes are closed, a line is appended to
+the index, codar.workflow.output.index.jsonl:
+
+    {"key": 3, "name": "sim", "working_dir": "/.../run-0.iteration-0",
+     "returncode": 0, "walltime": 12.5,
+     "stdout": [[segment, offset, length], ...], "stderr": [...]}
+
+The return code and walltime replace the per-run return and walltime
+files. offset is the position of the data in the segment, after the
+record header. Runs that still have a pipe open when the sink is stopped
+are indexed with what was captured. Use load_output_index and read_output
+to read the output back.
+"""
+
+import os
+import re
+import json
+import struct
+import itertools
+import threading
+import selectors
+import logging
+import time
+
+
+SEGMENT_NAME = 'codar.workflow.output'
+INDEX_NAME = 'codar.workflow.output.index.jsonl'
+SEGMENT_SIZE = 1024 * 1024 * 1024
+READ_SIZE = 65536
+
+# Seconds to keep reading pipes after stop, in case a process that
+# outlived its run is still holding one open.
+STOP_TIMEOUT = 5
+
+MAGIC = b'CWO1'
+HEADER = struct.Struct('<4sIBI')
+STDOUT = 1
+STDERR = 2
+STREAM_NAMES = {STDOUT: 'stdout', STDERR: 'stderr'}
+
+_log = logging.getLogger('codar.savanna.logsink')
+
+
+def get_segment_path(dir_path, segment):
+    return os.path.join(dir_path, '%s.%d' % (SEGMENT_NAME, segment))
+
+
+def load_output_index(dir_path):
+    """Get a dict mapping (working_dir, name) to the index entry of each
+    run with output in dir_path. If a run was started by more than one
+    submission of the group, the last entry is used. Returns an empty
+    dict if there is no index."""
+    entries = {}
+    try:
+        with open(os.path.join(dir_path, INDEX_NAME)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # truncated last line
+                    continue
+                entries[(entry['working_dir'], entry['name'])] = entry
+    except IOError:
+        pass
+    return entries
+
+
+def read_output(dir_path, entry, stream_name):
+    """Get the captured 'stdout' or 'stderr' of an index entry as bytes."""
+    chunks = []
+    files = {}
+    try:
+        for segment, offset, length in entry.get(stream_name, []):
+            f = files.get(segment)
+            if f is None:
+                f = open(get_segment_path(dir_path, segment), 'rb')
+                files[segment] = f
+            f.seek(offset)
+            chunks.append(f.read(length))
+    finally:
+        for f in files.values():
+            f.close()
+    return b''.join(chunks)
+
+
+def _next_segment(dir_path):
+    pattern = re.compile(re.escape(SEGMENT_NAME) + r'\.(\d+)$')
+    last = -1
+    for name in os.listdir(dir_path):
+        m = pattern.match(name)
+        if m:
+            last = max(last, int(m.group(1)))
+    return last + 1
+
+
+class _RunOutput(object):
+    """Extents of the output captured for a run, and its result."""
+    def __init__(self, key, run):
+        self.key = key
+        self.name = run.name
+        self.working_dir = run.working_dir
+        self.extents = {STDOUT: [], STDERR: []}
+        self.open_streams = 2
+        self.finished = False
+        self.returncode = None
+        self.walltime = None
+
+    def as_data(self):
+        return dict(key=self.key, name=self.name,
+                    working_dir=self.working_dir,
+                    returncode=self.returncode, walltime=self.walltime,
+                    stdout=self.extents[STDOUT],
+                    stderr=self.extents[STDERR])
+
+
+class OutputSink(threading.Thread):
+    """Capture the output of runs into segment files in dir_path. open_run
+    and run_finished are thread safe, all file writes happen on the sink
+    thread."""
+
+    def __init__(self, dir_path, segment_size=SEGMENT_SIZE):
+        threading.Thread.__init__(self, name='Thread-output-0')
+        self.daemon = True
+        self.dir_path = dir_path
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._keys = itertools.count()
+        self._outputs = {}
+        self._opened = []
+        self._finished = []
+        self._stop_time = None
+        self._closed = False
+        self._previous_walltimes = None
+
+        self._segment = _next_segment(dir_path)
+        self._segment_file = None
+        self._segment_offset = 0
+        self._index_file = open(os.path.join(dir_path, INDEX_NAME), 'a')
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def open_run(self, run):
+        """Create pipes for the output of run, which is about to be
+        spawned. Returns the write ends for stdout and stderr, which the
+        supervisor closes once the process has been created."""
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        with self._lock:
+            output = _RunOutput(next(self._keys), run)
+            self._outputs[run] = output
+            self._opened.append((out_r, output, STDOUT))
+            self._opened.append((err_r, output, STDERR))
+        self._wakeup()
+        return out_w, err_w
+
+    def run_finished(self, run, returncode, walltime):
+        """Record the result of run. Its index entry is written once its
+        pipes are closed. Does nothing if output was not opened for run."""
+        with self._lock:
+            output = self._outputs.pop(run, None)
+            if output is None:
+                return
+            self._finished.append((output, returncode, walltime))
+        self._wakeup()
+
+    def get_previous_walltime(self, run):
+        """Walltime of run from an index entry written by a previous
+        submission of the group, or None. Entries of runs that did not exit
+        with 0 are ignored, see Run.get_previous_walltime."""
+        with self._lock:
+            if self._previous_walltimes is None:
+                self._previous_walltimes = dict(
+                    (key, entry.get('walltime')) for key, entry
+                    in load_output_index(self.dir_path).items()
+                    if entry.get('returncode') == 0)
+            return self._previous_walltimes.get((run.working_dir,
+                                                 run.name))
+
+    def stop(self):
+        """Exit once all pipes are closed, or after STOP_TIMEOUT
+        seconds."""
+        with self._lock:
+            self._stop_time = time.monotonic() + STOP_TIMEOUT
+        self._wakeup()
+
+    def run(self):
+        try:
+            self._loop()
+        finally:
+            self._close()
+
+    def _loop(self):
+        pending = set()
+        while True:
+            with self._lock:
+                opened = self._opened
+                self._opened = []
+                finished = self._finished
+                self._finished = []
+                stop_time = self._stop_time
+            for fd, output, stream in opened:
+                self._selector.register(fd, selectors.EVENT_READ,
+                                        (output, stream))
+            for output, returncode, walltime in finished:
+                output.finished = True
+                output.returncode = returncode
+                output.walltime = walltime
+                pending.add(output)
+            for output in list(pending):
+                if output.open_streams == 0:
+                    pending.remove(output)
+                    self._write_index(output)
+
+            timeout = None
+            if stop_time is not None:
+                if len(self._selector.get_map()) == 1:
+                    return
+                timeout = stop_time - time.monotonic()
+                if timeout <= 0:
+                    _log.warning('output pipes still open after stop')
+                    return
+            for key, mask in self._selector.select(timeout):
+                if key.fd == self._wake_r:
+                    self._drain_wakeup()
+                    continue
+                output, stream = key.data
+                try:
+                    data = os.read(key.fd, READ_SIZE)
+                except OSError:
+                    data = b''
+                if data:
+                    self._append(output, stream, data)
+                    continue
+                self._selector.unregister(key.fd)
+                os.close(key.fd)
+                output.open_streams -= 1
+                if output.open_streams == 0 and output.finished:
+                    pending.discard(output)
+                    self._write_index(output)
+            if self._segment_file is not None:
+                self._segment_file.flush()
+
+    def _append(self, output, stream, data):
+        size = HEADER.size + len(data)
+        if (self._segment_file is None
+                or (self._segment_offset > 0
+                    and self._segment_offset + size > self.segment_size)):
+            self._new_segment()
+        self._segment_file.write(HEADER.pack(MAGIC, output.key, stream,
+                                             len(data)))
+        self._segment_file.write(data)
+        output.extents[stream].append(
+            [self._segment, self._segment_offset + HEADER.size, len(data)])
+        self._segment_offset += size
+
+    def _new_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment += 1
+        self._segment_file = open(get_segment_path(self.dir_path,
+                                                   self._segment), 'wb')
+        self._segment_offset = 0
+
+    def _write_index(self, output):
+        # the index must not refer to data that is not written yet
+        if self._segment_file is not None:
+            self._segment_file.flush()
+        self._index_file.write(json.dumps(output.as_data(),
+                                          separators=(',', ':')))
+        self._index_file.write('\n')
+        self._index_file.flush()
+
+    def _close(self):
+        """Index the runs that still had pipes open or were not finished,
+        and close everything."""
+        outputs = set()
+        for key in list(self._selector.get_map().values()):
+            if key.fd == self._wake_r:
+                continue
+            outputs.add(key.data[0])
+            self._selector.unregister(key.fd)
+            os.close(key.fd)
+        with self._lock:
+            for fd, output, stream in self._opened:
+                os.close(fd)
+                outputs.add(output)
+            for output, returncode, walltime in self._finished:
+                output.returncode = returncode
+                output.walltime = walltime
+            outputs.update(output for output, rc, w in self._finished)
+            outputs.update(self._outputs.values())
+            self._opened = []
+            self._finished = []
+            self._outputs = {}
+            self._closed = True
+        for output in sorted(outputs, key=lambda o: o.key):
+            self._write_index(output)
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._index_file.close()
+        self._selector.close()
+        with self._lock:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def _wakeup(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                os.write(self._wake_w, b'\0')
+            except BlockingIOError:
+                # pipe is full, so a wakeup is already pending
+                pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
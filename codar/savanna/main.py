@@ -3,17 +3,26 @@ runners."""
 
 import argparse
 import threading
+import asyncio
 import logging
 import signal
+import time
 import os
 
-from codar.savanna.producer import JSONFilePipelineReader
-from codar.savanna.consumer import PipelineRunner
+from codar.savanna.producer import (get_pipeline_reader,
+                                   SocketPipelineProducer)
+from codar.savanna.consumer import PipelineRunner, AsyncPipelineRunner
 from codar.savanna.runners import mpiexec, aprun, srun, jsrun
+from codar.savanna.supervisor import new_event_loop
+from codar.savanna.scheduler import POLICY_NAMES, get_policy
+from codar.savanna.logsink import SEGMENT_SIZE
 
 
 consumer = None
 
+# as early as possible, the allocation walltime is counted from here
+_start_time = time.time()
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='HPC Worflow script')
@@ -22,17 +31,94 @@ def parse_args():
     parser.add_argument('--runner', choices=['mpiexec', 'aprun', 'srun',
                                              'jsrun','none'],
                         required=True)
-    parser.add_argument('--producer', choices=['file'], default='file')
+    parser.add_argument('--producer', choices=['file', 'socket'],
+                        default='file',
+                        help='socket accepts pipelines from other processes '
+                             'on a UNIX domain socket until a stop request, '
+                             'after reading the input file if specified')
     parser.add_argument('--producer-input-file')
+    parser.add_argument('--producer-socket', default='codar.workflow.sock',
+                        help='Path of the socket for the socket producer '
+                             '(default: %(default)s)')
     parser.add_argument('--log-file')
     parser.add_argument('--log-level',
                         choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'],
                         default='INFO')
     parser.add_argument('--status-file')
+    parser.add_argument('--metrics-file',
+                        help='Append scheduler utilization metrics to this '
+                             'file as JSON lines')
+    parser.add_argument('--trace-file',
+                        help='Write a timeline of the pipelines and runs on '
+                             'each node to this file, in Chrome trace event '
+                             'format, for chrome://tracing or Perfetto')
     parser.add_argument('--machine-name')
+    parser.add_argument('--engine', choices=['thread', 'asyncio'],
+                        default='thread',
+                        help='Run the scheduler and producer in threads, or '
+                             'as coroutines on a single asyncio event loop')
+    parser.add_argument('--scheduler-policy',
+                        choices=POLICY_NAMES,
+                        default='greedy',
+                        help='greedy starts the biggest pipeline that fits, '
+                             'easy and conservative use runtime estimates to '
+                             'backfill smaller pipelines without delaying '
+                             'the biggest queued pipeline (easy) or the '
+                             '100 biggest queued pipelines (conservative)')
+    parser.add_argument('--walltime', type=int,
+                        help='Seconds until the allocation ends, counting '
+                             'from when this script starts. Pipelines that '
+                             'are not expected to finish in time are not '
+                             'started, and are left for the next submission')
+    parser.add_argument('--walltime-margin', type=int, default=60,
+                        help='Seconds at the end of the allocation to keep '
+                             'free of pipelines, for writing final status '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-queued-pipelines', type=int, default=10000,
+                        help='Stop reading the producer input while this '
+                             'many pipelines are waiting for nodes, to '
+                             'bound memory use for big groups, or 0 for no '
+                             'limit (default: %(default)s)')
+    parser.add_argument('--task-farm', action='store_true',
+                        help='Start a worker on each node with a single '
+                             'runner invocation, and start runs that fit '
+                             'on one node on the workers, instead of with '
+                             'the runner. For groups with many small runs')
+    parser.add_argument('--task-farm-runner', choices=['mpiexec', 'none'],
+                        default='none',
+                        help='How task farm workers start runs: none runs '
+                             'the executable directly, so only single '
+                             'process runs use the task farm, mpiexec uses '
+                             'a node local mpiexec (default: %(default)s)')
+    parser.add_argument('--sample-interval', type=float, default=0,
+                        help='Seconds between samples of the CPU, RSS and '
+                             'thread count of each running run, written to '
+                             'codar.workflow.samples.<name>, or 0 to '
+                             'disable (default: %(default)s)')
+    parser.add_argument('--max-post-processes', type=int, default=0,
+                        help='Maximum number of pipeline post process '
+                             'scripts running at once, others wait in a '
+                             'queue, or 0 for the number of CPUs (default: '
+                             '%(default)s)')
+    parser.add_argument('--output-mode', choices=['files', 'segments'],
+                        default='files',
+                        help='files writes the stdout, stderr, return code '
+                             'and walltime of each run to files in its run '
+                             'directory, segments appends them to a few '
+                             'large codar.workflow.output.* files in the '
+                             'current directory, for groups with many runs '
+                             '(default: %(default)s)')
+    parser.add_argument('--output-segment-size', type=int,
+                        default=SEGMENT_SIZE,
+                        help='Bytes per segment file in segments output '
+                             'mode (default: %(default)s)')
 
     args = parser.parse_args()
 
+    if args.task_farm and args.machine_name \
+            and args.machine_name.lower() == 'summit':
+        parser.error('--task-farm is not supported on summit')
+
     return args
 
 
@@ -67,32 +153,73 @@ def main():
 
     logger.info('starting savanna job %s', get_job_id())
 
+    deadline = None
+    if args.walltime:
+        deadline = _start_time + args.walltime - args.walltime_margin
+
+    policy = get_policy(args.scheduler_policy)
+
+    if args.engine == 'asyncio':
+        run_asyncio_engine(args, runner, policy, deadline)
+        return
+
     consumer = PipelineRunner(runner=runner,
                               max_nodes=args.max_nodes,
                               machine_name=args.machine_name,
                               processes_per_node=args.processes_per_node,
-                              status_file=args.status_file)
+                              status_file=args.status_file,
+                              scheduler_policy=policy,
+                              deadline=deadline,
+                              max_queued=args.max_queued_pipelines or None,
+                              metrics_file=args.metrics_file,
+                              trace_file=args.trace_file,
+                              max_post_processes=(args.max_post_processes
+                                                  or None))
+    if args.task_farm:
+        consumer.start_task_farm(get_task_runner(args))
+    if args.sample_interval > 0:
+        consumer.start_sampler(args.sample_interval)
+    if args.output_mode == 'segments':
+        consumer.start_output_sink(os.getcwd(), args.output_segment_size)
 
-    producer = JSONFilePipelineReader(args.producer_input_file)
+    producer, socket_producer = get_producers(args, consumer)
+
+    def kill_all():
+        consumer.kill_all()
+        if socket_producer is not None:
+            socket_producer.close()
+
+    # set up signal handlers for graceful exit. The producer may be
+    # reading pipelines until the end of the job, so this must be done
+    # first. The handler runs in this main thread, which may be holding
+    # consumer locks in add_pipeline, so kill from another thread.
+    def handle_signal_kill_consumer(signum, frame):
+        threading.Thread(target=kill_all).start()
+
+    signal.signal(signal.SIGTERM, handle_signal_kill_consumer)
+    signal.signal(signal.SIGINT,  handle_signal_kill_consumer)
 
     t_consumer = threading.Thread(target=consumer.run_pipelines)
     t_consumer.start()
 
-    # producer runs in this main thread
-    for pipeline in producer.read_pipelines():
-        consumer.add_pipeline(pipeline)
+    # producer runs in this main thread, and only reads the next pipeline
+    # when the consumer has room for it. A kill from the signal handler
+    # can happen between wait_for_space and add_pipeline.
+    accepting = True
+    if producer is not None:
+        for pipeline in producer.read_pipelines():
+            if (not consumer.add_pipeline(pipeline)
+                    or not consumer.wait_for_space()):
+                accepting = False
+                break
+
+    if socket_producer is not None and accepting:
+        socket_producer.serve()
 
     # signal that there are no more pipelines and thread should exit
     # when reached
     consumer.stop()
 
-    # set up signal handlers for graceful exit
-    def handle_signal_kill_consumer(signum, frame):
-        consumer.kill_all()
-
-    signal.signal(signal.SIGTERM, handle_signal_kill_consumer)
-    signal.signal(signal.SIGINT,  handle_signal_kill_consumer)
-
     # All threads created for workflow are non-daemon, so the
     # interpreter will not exit until all threads exit. Doing an
     # explicit join on the consumer thread is not necessary, and
@@ -101,6 +228,90 @@ def main():
     # (pthread_join).
 
 
+def run_asyncio_engine(args, runner, policy, deadline):
+    """Run the producer and consumer as coroutines on an event loop in the
+    main thread. Input and status output are the same as for the threaded
+    engine."""
+    global consumer
+
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    consumer = AsyncPipelineRunner(loop=loop, runner=runner,
+                                   max_nodes=args.max_nodes,
+                                   machine_name=args.machine_name,
+                                   processes_per_node=args.processes_per_node,
+                                   status_file=args.status_file,
+                                   scheduler_policy=policy,
+                                   deadline=deadline,
+                                   max_queued=(args.max_queued_pipelines
+                                               or None),
+                                   metrics_file=args.metrics_file,
+                                   trace_file=args.trace_file,
+                                   max_post_processes=(
+                                       args.max_post_processes or None))
+    if args.task_farm:
+        consumer.start_task_farm(get_task_runner(args))
+    if args.sample_interval > 0:
+        consumer.start_sampler(args.sample_interval)
+    if args.output_mode == 'segments':
+        consumer.start_output_sink(os.getcwd(), args.output_segment_size)
+
+    producer, socket_producer = get_producers(args, consumer)
+
+    async def produce():
+        accepting = True
+        if producer is not None:
+            for pipeline in producer.read_pipelines():
+                if not consumer.add_pipeline(pipeline):
+                    # killed while reading
+                    accepting = False
+                    break
+                # let the consumer start pipelines while reading the rest
+                await asyncio.sleep(0)
+                if not await consumer.wait_for_space():
+                    accepting = False
+                    break
+        if socket_producer is not None and accepting:
+            await socket_producer.serve_async()
+        consumer.stop()
+
+    def kill_all():
+        consumer.kill_all()
+        if socket_producer is not None:
+            socket_producer.close()
+
+    # signal handlers run on the loop, like all other callbacks
+    loop.add_signal_handler(signal.SIGTERM, kill_all)
+    loop.add_signal_handler(signal.SIGINT, kill_all)
+
+    try:
+        loop.run_until_complete(asyncio.gather(consumer.run_pipelines(),
+                                               produce()))
+    finally:
+        loop.close()
+
+
+def get_task_runner(args):
+    if args.task_farm_runner == 'mpiexec':
+        return mpiexec
+    return None
+
+
+def get_producers(args, consumer):
+    """Get the file reader and socket producer to use, either may be
+    None."""
+    producer = None
+    if args.producer_input_file:
+        producer = get_pipeline_reader(args.producer_input_file,
+                                       args.status_file)
+    socket_producer = None
+    if args.producer == 'socket':
+        socket_producer = SocketPipelineProducer(consumer,
+                                                 args.producer_socket)
+    return producer, socket_producer
+
+
 def get_job_id():
     scheduler_vars = dict(
         SLURM='SLURM_JOB_ID',
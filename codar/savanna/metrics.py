@@ -0,0 +1,246 @@
+"""
+Scheduler utilization metrics for a workflow.
+
+SchedulerMetrics appends JSON records, one per line, to a metrics file in
+the group directory:
+
+ - sample: busy and free nodes, job list depth and running pipelines,
+   written when they change, at most once every sample_interval seconds
+ - pipeline: for each finished pipeline, the nodes it used, queue wait
+   (from add_pipeline to start), runtime, and the launch latency (from
+   spawn to process creation) and teardown time (from the exit of the
+   group leader until the rest of the process group is gone) of each run
+ - summary: written when the workflow finishes, with busy and idle
+   node-seconds over the whole job and queue wait, launch latency and
+   teardown statistics, see load_summary. Also has the wait in the post
+   process queue (see codar.savanna.postprocess) and the runtime of post
+   process scripts, and the number that timed out.
+
+Node-seconds are integrated every time nodes are taken or released, so
+they are exact regardless of the sample interval.
+"""
+
+import json
+import time
+import threading
+
+
+SAMPLE_INTERVAL = 10
+
+
+def load_summary(file_path):
+    """Get the last summary record in a metrics file, or None if there is
+    none, e.g. if the workflow is still running or was killed."""
+    summary = None
+    try:
+        with open(file_path) as f:
+            for line in f:
+                if '"summary"' not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # truncated last line
+                    continue
+                if record.get('type') == 'summary':
+                    summary = record
+    except IOError:
+        return None
+    return summary
+
+
+class _Stat(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def as_data(self):
+        mean = self.total / self.count if self.count else None
+        return dict(count=self.count, mean=mean, max=self.max)
+
+
+class SchedulerMetrics(object):
+    """Collect metrics from the consumer. All methods are thread safe."""
+
+    def __init__(self, file_path, total_nodes,
+                 sample_interval=SAMPLE_INTERVAL):
+        self.file_path = file_path
+        self.total_nodes = total_nodes
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._file = open(file_path, 'a')
+        self._start = time.time()
+        self._last_change = self._start
+        self._last_sample = None
+        self._busy = 0
+        self._busy_node_seconds = 0.0
+        self._queue_depth = 0
+        self._max_queue_depth = 0
+        self._running = 0
+        self._queued = {}
+        self._queue_waits = {}
+        self._started = 0
+        self._finished = 0
+        self._queue_wait = _Stat()
+        self._launch_latency = _Stat()
+        self._teardown = _Stat()
+        self._post_queue_depth = 0
+        self._max_post_queue_depth = 0
+        self._post_running = 0
+        self._post_wait = _Stat()
+        self._post_runtime = _Stat()
+        self._post_timed_out = 0
+
+    def pipeline_queued(self, pipeline, queue_depth):
+        with self._lock:
+            self._queued[pipeline.id] = time.time()
+            self._set_queue_depth(queue_depth)
+
+    def pipeline_started(self, pipeline, queue_depth):
+        with self._lock:
+            queued = self._queued.pop(pipeline.id, None)
+            if queued is not None:
+                wait = pipeline.start_time - queued
+                self._queue_waits[pipeline.id] = wait
+                self._queue_wait.add(wait)
+            self._started += 1
+            self._running += 1
+            self._set_queue_depth(queue_depth)
+            self._maybe_sample()
+
+    def pipeline_dropped(self, pipeline, queue_depth):
+        """Pipeline removed from the job list without being started."""
+        with self._lock:
+            self._queued.pop(pipeline.id, None)
+            self._set_queue_depth(queue_depth)
+
+    def nodes_changed(self, busy_nodes):
+        """Called with the number of nodes in use every time nodes are
+        taken or released."""
+        with self._lock:
+            self._set_busy(busy_nodes)
+            self._maybe_sample()
+
+    def pipeline_finished(self, pipeline):
+        now = time.time()
+        runs = {}
+        for run in pipeline.runs:
+            result = run.get_result()
+            runs[run.name] = dict(
+                launch_latency=result['launch_latency'],
+                teardown=result['teardown'])
+        runtime = None
+        if pipeline.start_time is not None:
+            runtime = now - pipeline.start_time
+        with self._lock:
+            record = dict(type='pipeline', time=now, id=pipeline.id,
+                          nodes=pipeline.get_nodes_used(),
+                          queue_wait=self._queue_waits.pop(pipeline.id,
+                                                           None),
+                          runtime=runtime, runs=runs)
+            self._finished += 1
+            self._running -= 1
+            for run_data in runs.values():
+                self._launch_latency.add(run_data['launch_latency'])
+                self._teardown.add(run_data['teardown'])
+            self._write(record)
+            self._maybe_sample()
+
+    def post_process_queued(self, queue_depth):
+        with self._lock:
+            self._set_post_queue_depth(queue_depth)
+
+    def post_process_started(self, wait, queue_depth):
+        """Post process script started after waiting wait seconds in the
+        post process queue."""
+        with self._lock:
+            self._post_wait.add(wait)
+            self._post_running += 1
+            self._set_post_queue_depth(queue_depth)
+
+    def post_process_finished(self, runtime, timed_out):
+        with self._lock:
+            self._post_runtime.add(runtime)
+            self._post_running -= 1
+            if timed_out:
+                self._post_timed_out += 1
+
+    def close(self):
+        """Write the summary record. Safe to call more than once."""
+        with self._lock:
+            if self._file is None:
+                return
+            now = time.time()
+            self._set_busy(self._busy, now)
+            elapsed = now - self._start
+            node_seconds = self.total_nodes * elapsed
+            busy = self._busy_node_seconds
+            summary = dict(type='summary', time=now, elapsed=elapsed,
+                           total_nodes=self.total_nodes,
+                           node_seconds_busy=busy,
+                           node_seconds_idle=node_seconds - busy,
+                           utilization=(busy / node_seconds
+                                        if node_seconds > 0 else None),
+                           pipelines_started=self._started,
+                           pipelines_finished=self._finished,
+                           max_queue_depth=self._max_queue_depth,
+                           queue_wait=self._queue_wait.as_data(),
+                           launch_latency=self._launch_latency.as_data(),
+                           teardown=self._teardown.as_data(),
+                           max_post_process_queue_depth=(
+                               self._max_post_queue_depth),
+                           post_process_wait=self._post_wait.as_data(),
+                           post_process_runtime=self._post_runtime.as_data(),
+                           post_processes_timed_out=self._post_timed_out)
+            self._write(summary)
+            self._file.close()
+            self._file = None
+
+    def _set_busy(self, busy_nodes, now=None):
+        """Must be called with lock acquired!"""
+        if now is None:
+            now = time.time()
+        self._busy_node_seconds += self._busy * (now - self._last_change)
+        self._last_change = now
+        self._busy = busy_nodes
+
+    def _set_queue_depth(self, queue_depth):
+        """Must be called with lock acquired!"""
+        self._queue_depth = queue_depth
+        self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+
+    def _set_post_queue_depth(self, queue_depth):
+        """Must be called with lock acquired!"""
+        self._post_queue_depth = queue_depth
+        self._max_post_queue_depth = max(self._max_post_queue_depth,
+                                         queue_depth)
+
+    def _maybe_sample(self):
+        """Must be called with lock acquired!"""
+        now = time.time()
+        if (self._last_sample is not None
+                and now - self._last_sample < self.sample_interval):
+            return
+        self._last_sample = now
+        self._write(dict(type='sample', time=now, busy_nodes=self._busy,
+                         free_nodes=self.total_nodes - self._busy,
+                         queue_depth=self._queue_depth,
+                         running=self._running,
+                         post_process_queue_depth=self._post_queue_depth,
+                         post_process_running=self._post_running))
+
+    def _write(self, record):
+        """Must be called with lock acquired!"""
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, separators=(',', ':')))
+        self._file.write('\n')
+        self._file.flush()
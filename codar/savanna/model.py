@@ -1,6 +1,7 @@
 """
-Classes for tracking pipelines and the runs within each pipeline in separate
-monitor threads that synchronize state.
+Classes for tracking pipelines and the runs within each pipeline. Processes
+are watched by a single ProcessSupervisor thread, which also executes all the
+run and pipeline callbacks.
 
 Note that there is state tracked in these classes which is not available just
 by looking at the return code. In particular, a run my be killed for several
@@ -13,7 +14,6 @@ running again when the workflow is restarted, or if it's failure was more
 permanent and not subject to outside forces like the job walltime expiring.
 """
 import time
-import subprocess
 import os
 import math
 import threading
@@ -22,21 +22,27 @@ import logging
 from queue import Queue
 import copy
 import json
+import re
 import pdb
 
 from codar.savanna import status, machines, summit_helper
 from codar.savanna.exc import SavannaException
 from codar.savanna.node_layout import NodeLayout
+from codar.savanna.supervisor import GroupWait
 
 
 STDOUT_NAME = 'codar.workflow.stdout'
 STDERR_NAME = 'codar.workflow.stderr'
 RETURN_NAME = 'codar.workflow.return'
 WALLTIME_NAME = 'codar.workflow.walltime'
+RESULT_NAME = 'codar.workflow.result.json'
 
+# Default seconds from SIGTERM to SIGKILL when killing a run, and from the
+# group leader's exit to SIGKILL for the rest of its process group. Can be
+# set per code with kill_wait.
 KILL_WAIT = 30
-WAIT_DELAY_KILL = 30
 WAIT_DELAY_GIVE_UP = 120
+POST_PROCESS_TIMEOUT = 120
 
 
 _log = logging.getLogger('codar.savanna.model')
@@ -61,18 +67,39 @@ class NodeConfig:
         self.gpu = []
 
 
-class Run(threading.Thread):
+class ResourceSet:
+    def __init__(self, rs_per_host, tasks_per_rs=1, cpus_per_rs=1,
+                 gpus_per_rs=0, nrs=None):
+        """jsrun resource set definition, used on Summit for runs that
+        don't share nodes. nrs is the total no. of resource sets."""
+        self.rs_per_host = rs_per_host
+        self.tasks_per_rs = tasks_per_rs
+        self.cpus_per_rs = cpus_per_rs
+        self.gpus_per_rs = gpus_per_rs
+        self.nrs = nrs
+
+    @classmethod
+    def from_data(cls, data):
+        return ResourceSet(rs_per_host=data['rs_per_host'],
+                           tasks_per_rs=data.get('tasks_per_rs', 1),
+                           cpus_per_rs=data.get('cpus_per_rs', 1),
+                           gpus_per_rs=data.get('gpus_per_rs', 0),
+                           nrs=data.get('nrs'))
+
+
+class Run(object):
     """Manage running a single executable within a pipeline. When start is
-    called, it will launch the process with Popen and call wait in the new
-    thread with a timeout, killing if the process does not finish in time."""
+    called, the process is launched by the pipeline's supervisor, which
+    calls back into the run when the process exits or the timeout expires,
+    killing the process group if it does not finish in time. All state
+    transitions happen on the supervisor thread."""
     def __init__(self, name, exe, args, sched_args, env, working_dir,
                  timeout=None, nprocs=1, res_set=None,
                  stdout_path=None, stderr_path=None,
                  return_path=None, walltime_path=None,
                  log_prefix=None, sleep_after=None,
                  depends_on_runs=None, hostfile=None,
-                 runner_override=False):
-        threading.Thread.__init__(self, name="Thread-Run-" + name)
+                 runner_override=False, kill_wait=None):
         self.name = name
         self.exe = exe
         self.args = args
@@ -80,6 +107,7 @@ class Run(threading.Thread):
         self.env = env or {}
         self.working_dir = working_dir
         self.timeout = timeout
+        self.kill_wait = KILL_WAIT if kill_wait is None else kill_wait
         self.nprocs = nprocs
 
         # res_set, nrs, and rs_per_host represent resource_set definition,
@@ -98,9 +126,15 @@ class Run(threading.Thread):
         self.sleep_after = sleep_after
         self._p = None
         self._pgid = None
-        self._open_files = []
+        self._args = None
 
         self._start_time = None
+        # launch began (after dependencies), process created, first kill
+        # signal and group leader reaped, for metrics and tracing
+        self._launch_time = None
+        self._started_time = None
+        self._kill_time = None
+        self._exit_time = None
 
         self._state_lock = threading.Lock()
         self._end_time = None # if set, run is done
@@ -115,7 +149,13 @@ class Run(threading.Thread):
         self.runner = None
         self.callbacks = set()
 
-        self._kill_thread = None
+        # Set by pipeline before the run is started
+        self.supervisor = None
+        self.sampler = None
+        self.output_sink = None
+        self._done = threading.Event()
+        self._timeout_timer = None
+        self._kill_timer = None
 
         # calculated by Pipeline based on node layout
         self.nodes = None
@@ -149,13 +189,16 @@ class Run(threading.Thread):
         other keys are optional and have the same names as the constructor
         args. Raises KeyError if a required key is missing."""
         # TODO: deeper validation
+        res_set = data.get('res_set')
+        if res_set is not None:
+            res_set = ResourceSet.from_data(res_set)
         r = Run(name=data['name'], exe=data['exe'], args=data['args'],
                 sched_args=data['sched_args'],
                 env=data.get('env'),  # dictionary of varname/varvalue
                 working_dir=data['working_dir'],
                 timeout=data.get('timeout'),
                 nprocs=data.get('nprocs', 1),
-                res_set=data.get('res_set'),
+                res_set=res_set,
                 stdout_path=data.get('stdout_path'),
                 stderr_path=data.get('stderr_path'),
                 return_path=data.get('return_path'),
@@ -163,7 +206,8 @@ class Run(threading.Thread):
                 sleep_after=data.get('sleep_after'),
                 depends_on_runs=data.get('after_rc_done'),
                 hostfile=data.get('hostfile'),
-                runner_override=data.get('runner_override'))
+                runner_override=data.get('runner_override'),
+                kill_wait=data.get('kill_wait'))
 
         return r
 
@@ -234,30 +278,42 @@ class Run(threading.Thread):
     def remove_callback(self, fn):
         self.callbacks.remove(fn)
 
-    def run(self):
+    def start(self):
+        """Launch the process. If the run depends on another run, launching
+        is deferred until that run is done. Does not block, use join to wait
+        for the run to complete. Must be called on the supervisor thread."""
+        dep = self.depends_on_runs
+        if dep is not None and not dep.done:
+            # Note: callbacks of the dependency are executed before its done
+            # flag is set, so there is no window where this could be missed
+            dep.add_callback(lambda dep_run: self._launch())
+            return
+        self._launch()
+
+    def _launch(self):
+        self._launch_time = time.time()
         try:
-            self._run()
-        except:
-            # Treat this as a special type of failure, in case it's
-            # something specific to this run or pipeline. If it affects
-            # all pipelines, then they should all eventually fail.
-            # We could force a workflow kill in this case, but this less
-            # drastic approach may provide extra information and won't
-            # take much longer.
-            self._exception = True # Note: state lock not required
-            _log.exception('exception in Run thread')
-            # attempt to execute callbacks, so more threads could be run
-            try:
-                self._run_callbacks()
-            except:
-                _log.exception(
-                       'exception in Run callbacks after Run thread exception')
-
-    def _run(self):
-        # Wait for runs that self depends on to finish
-        if self.depends_on_runs is not None:
-            threading.Thread.join(self.depends_on_runs)
+            self._launch_process()
+        except Exception as e:
+            self._launch_failed(e)
+
+    def _launch_failed(self, exc):
+        # Treat this as a special type of failure, in case it's
+        # something specific to this run or pipeline. If it affects
+        # all pipelines, then they should all eventually fail.
+        # We could force a workflow kill in this case, but this less
+        # drastic approach may provide extra information and won't
+        # take much longer.
+        self._exception = True # Note: state lock not required
+        _log.error('%s exception in Run launch', self.log_prefix,
+                   exc_info=exc)
+        with self._state_lock:
+            if self._end_time is None:
+                self._end_time = time.time()
+        # attempt to execute callbacks, so more runs could be started
+        self._finish()
 
+    def _launch_process(self):
         if self.machine.name.lower() == 'summit':
             self.erf_file = self.working_dir + "/" + self.name + ".erf_input"
             summit_helper.create_erf_file(self)
@@ -272,55 +328,120 @@ class Run(threading.Thread):
         else:
             args = [self.exe] + self.args
 
+        # NOTE: it's important to maintain the calling environment,
+        # which can contain LD_LIBRARY_PATH and other variables that are
+        # required for modules and normal HPC operation (e.g aprun).
+        # TODO: should this do a smart merge per variable, so you could
+        # e.g. extend PATH or LD_LIBRARY_PATH rather tha replace it?
+        env = os.environ.copy()
+        env.update(self.env)
+        _log.debug('%s LD_LIBRARY_PATH=%s', self.log_prefix,
+                   env.get('LD_LIBRARY_PATH', ''))
+
         self._start_time = time.time()
+        self._args = args
         with self._state_lock:
-            if self._killed:
+            killed = self._killed
+            if killed:
                 _log.info('%s not starting, killed before start',
                           self.log_prefix)
                 self._end_time = time.time()
-            else:
-                self._popen(args)
-        if self._p is None:
-            self._run_callbacks()
+        if killed:
+            self._finish()
             return
+        stdout, stderr = self.stdout_path, self.stderr_path
+        if self.output_sink is not None:
+            stdout, stderr = self.output_sink.open_run(self)
+        self.supervisor.spawn(args, env, self.working_dir, stdout, stderr,
+                              self._started, self._exited,
+                              self._launch_failed)
+
+    def _started(self, proc):
+        self._started_time = time.time()
+        with self._state_lock:
+            self._p = proc
+            # the process is the leader of its own group, see spawn
+            self._pgid = proc.pid
+            killed = self._killed
         _log.info('%s start pid=%d pgid=%d args=%r',
-                  self.log_prefix, self._p.pid, self._pgid, args)
-        try:
-            self._p.wait(self.timeout)
-        except subprocess.TimeoutExpired:
-            _log.warn('%s killing (timeout %d)', self.log_prefix, self.timeout)
-            with self._state_lock:
-                self._timeout_pending = True
-            if not self._killed:
-                self._term_kill()
-                self._p.wait()
-                with self._state_lock:
-                    if self._p.returncode != 0:
-                        # check return code in case it completes while handling
-                        # the exception before kill.
-                        self._timed_out = True
-                    self._timeout_pending = False
-                    # TODO will this call the release_nodes callback?
-
-        self._pgroup_wait()
+                  self.log_prefix, self._p.pid, self._pgid, self._args)
+        if self.sampler is not None:
+            self.sampler.add(self)
+        if self.timeout:
+            self._timeout_timer = self.supervisor.call_later(
+                                                self.timeout, self._on_timeout)
+        if killed:
+            # kill was called while the process was being created, and
+            # could not signal it
+            self.supervisor.call_soon(self._term_kill)
+
+    def _on_timeout(self):
+        self._timeout_timer = None
+        with self._state_lock:
+            if self._killed or self._p.returncode is not None:
+                return
+            self._timeout_pending = True
+        _log.warn('%s killing (timeout %d)', self.log_prefix, self.timeout)
+        self._term_kill()
+
+    def _exited(self, proc):
+        """Called by the supervisor when the group leader has been reaped.
+        Waits for the rest of the process group before finishing."""
+        self._exit_time = time.time()
+        if self._timeout_timer is not None:
+            self.supervisor.cancel(self._timeout_timer)
+            self._timeout_timer = None
+        with self._state_lock:
+            if self._timeout_pending:
+                if proc.returncode != 0:
+                    # check return code in case it completes while handling
+                    # the timeout before kill.
+                    self._timed_out = True
+                self._timeout_pending = False
+        _log.debug('%s waiting for pgroup, max delay %d'
+                   % (self.log_prefix, WAIT_DELAY_GIVE_UP))
+        GroupWait(self.supervisor, proc, lambda gone: self._finish(),
+                  self.kill_wait, WAIT_DELAY_GIVE_UP,
+                  self.log_prefix).start()
+
+    def _finish(self):
         with self._state_lock:
-            self._end_time = time.time()
-        _log.info('%s done %d %d', self.log_prefix, self._p.pid,
-                         self._p.returncode)
-        self._save_walltime(self._end_time - self._start_time)
-        self._save_returncode(self._p.returncode)
-        self._run_callbacks()
+            if self._end_time is None:
+                self._end_time = time.time()
+        if self._kill_timer is not None:
+            self.supervisor.cancel(self._kill_timer)
+            self._kill_timer = None
+        if self.sampler is not None:
+            self.sampler.remove(self)
+        try:
+            if self._p is not None and not self._exception:
+                _log.info('%s done %d %d', self.log_prefix, self._p.pid,
+                          self._p.returncode)
+                walltime = self._end_time - self._start_time
+                if self.output_sink is not None:
+                    self.output_sink.run_finished(self, self._p.returncode,
+                                                  walltime)
+                else:
+                    self._save_walltime(walltime)
+                    self._save_returncode(self._p.returncode)
+            elif self.output_sink is not None:
+                self.output_sink.run_finished(self, None, None)
+            self._run_callbacks()
+        except:
+            _log.exception('exception in Run callbacks')
+        finally:
+            self._done.set()
 
     def _run_callbacks(self):
         _log.debug('%s _run_callbacks', self.log_prefix)
-        for callback in self.callbacks:
+        for callback in list(self.callbacks):
             callback(self)
 
     def kill(self):
-        """Kill process and cause run thread to complete after the wait
-        returns. If the run is already done, does nothing. If the process is
-        killed, it will mark the state as killed so it can be re-run on
-        workflow restart. Thread safe."""
+        """Kill process and cause the run to complete after the process
+        group exits. If the run is already done, does nothing. If the
+        process is killed, it will mark the state as killed so it can be
+        re-run on workflow restart. Thread safe."""
         with self._state_lock:
             if self._killed:
                 # avoid double kill - there is a delay between this
@@ -333,74 +454,31 @@ class Run(threading.Thread):
                 # already finished naturally
                 return
             self._killed = True
+            started = self._p is not None
 
-        if self._p is not None:
+        if started:
             _log.warn('%s kill requested', self.log_prefix)
-            self._kill_thread = threading.Thread(target=self._term_kill)
-            self._kill_thread.start()
+            self.supervisor.call_soon(self._term_kill)
 
     def _term_kill(self):
         """Issue signals to entire process group. First give processes a
         chance to exit cleanly with CONT+TERM, then attempt to KILL after
-        a delay."""
+        kill_wait seconds, unless the group is gone before that."""
         _log.debug('%s _term_kill', self.log_prefix)
-        os.killpg(self._pgid, signal.SIGCONT)
-        os.killpg(self._pgid, signal.SIGTERM)
-        time.sleep(KILL_WAIT)
-        try:
-            os.killpg(self._pgid, signal.SIGKILL)
-        except ProcessLookupError:
-            # this happens if all processes in the pgroup have already
-            # exited and the group no longer exists, which is what should
-            # happen in most cases
-            pass
-
-    def _pgroup_wait(self):
-        """Wait until the process group lead by this run no longer exists.
-        Assumes that it should already be exiting normally (e.g. the parent
-        has already exited). If WAIT_DELAY_KILL is reached in expontential
-        back off and the group still exists, SIGKILL is sent to the group.
-        If WAIT_DELAY_GIVE_UP is reached, an error is logged and the function
-        will return. Inspired by proctrack_pgid plugin from slurm."""
-        _log.debug('%s _pgroup_wait max delay %d'
-                   % (self.log_prefix, WAIT_DELAY_GIVE_UP))
-        delay = 1
-        signum = 0 # 0 is the null signal, does error checking only
-        while True:
-            try:
-                os.killpg(self._pgid, signum)
-            except ProcessLookupError:
-                # pgroup no longer exists, we are done waiting
-                break
-            # else pgroup still exists
-            time.sleep(delay)
-            delay *= 2
-            if delay > WAIT_DELAY_KILL:
-                signum = signal.SIGKILL
-                _log.warn(
-                        '%s pgroup still exists, sending KILL, next delay=%d',
-                        self.log_prefix, delay)
-            if delay > WAIT_DELAY_GIVE_UP:
-                _log.error('%s pgroup did not exit', self.log_prefix)
-                break
-
-    def _popen(self, args):
-        out = open(self.stdout_path, 'w')
-        err = open(self.stderr_path, 'w')
-        self._open_files = [out, err]
-        # NOTE: it's important to maintain the calling environment,
-        # which can contain LD_LIBRARY_PATH and other variables that are
-        # required for modules and normal HPC operation (e.g aprun).
-        # TODO: should this do a smart merge per variable, so you could
-        # e.g. extend PATH or LD_LIBRARY_PATH rather tha replace it?
-        env = os.environ.copy()
-        env.update(self.env)
-        _log.debug('%s LD_LIBRARY_PATH=%s', self.log_prefix,
-                   env.get('LD_LIBRARY_PATH', ''))
-        self._p = subprocess.Popen(args, env=env, cwd=self.working_dir,
-                                   stdout=out, stderr=err,
-                                   preexec_fn=os.setpgrp)
-        self._pgid = os.getpgid(self._p.pid)
+        if self._end_time is not None:
+            return
+        if self._kill_time is None:
+            self._kill_time = time.time()
+        self.supervisor.signal_group(self._p, signal.SIGCONT)
+        self.supervisor.signal_group(self._p, signal.SIGTERM)
+        self._kill_timer = self.supervisor.call_later(self.kill_wait,
+                                                      self._kill_group)
+
+    def _kill_group(self):
+        # The group no longer existing is what should happen in most cases,
+        # signal_group ignores that.
+        self._kill_timer = None
+        self.supervisor.signal_group(self._p, signal.SIGKILL)
 
     def _save_returncode(self, rcode):
         assert rcode is not None
@@ -418,20 +496,91 @@ class Run(threading.Thread):
             return None
         return self._p.returncode
 
+    def get_walltime(self):
+        """Get the walltime in seconds of the run, or None if it has not
+        finished or was never started."""
+        if self._p is None or self._end_time is None:
+            return None
+        return self._end_time - self._start_time
+
+    def get_launch_latency(self):
+        """Seconds from spawning the process until it was created, or None
+        if it was not started."""
+        if self._started_time is None:
+            return None
+        return self._started_time - self._start_time
+
+    def get_teardown_time(self):
+        """Seconds from the exit of the process until the rest of its
+        process group was gone, or None if it has not finished."""
+        if self._exit_time is None or self._end_time is None:
+            return None
+        return self._end_time - self._exit_time
+
+    def get_phase_times(self):
+        """Get the time.time() values when the run's launch began (after
+        any dependency), the process was spawned (after preparing the ERF
+        file and runner arguments), the process was created, the first kill
+        signal was sent, the group leader exited, and the run was done.
+        Values that don't apply are None."""
+        return dict(launch=self._launch_time, spawn=self._start_time,
+                    started=self._started_time,
+                    kill=self._kill_time, exited=self._exit_time,
+                    end=self._end_time)
+
+    def get_usage(self):
+        """Get the resource usage recorded by the supervisor when the
+        process was reaped, see supervisor.USAGE_KEYS, or None if not
+        available."""
+        return getattr(self._p, 'usage', None)
+
+    def get_result(self):
+        """Get a dict describing the outcome of a finished run, for the
+        pipeline result file."""
+        return dict(returncode=self.get_returncode(),
+                    walltime=self.get_walltime(),
+                    succeeded=self.succeeded,
+                    killed=self.killed,
+                    timed_out=self.timed_out,
+                    exception=self.exception,
+                    launch_latency=self.get_launch_latency(),
+                    teardown=self.get_teardown_time(),
+                    usage=self.get_usage())
+
+    def get_previous_walltime(self):
+        """Get the walltime in seconds saved by a previous attempt of this
+        run, or None if there is no walltime file or output index entry.
+        Walltimes are saved for attempts that were killed or timed out
+        too, which would give an estimate that is too small, so only an
+        attempt that exited with 0 counts."""
+        try:
+            with open(self.return_path) as f:
+                returncode = int(f.read().strip())
+            with open(self.walltime_path) as f:
+                walltime = float(f.read().strip())
+        except (IOError, ValueError):
+            pass
+        else:
+            return walltime if returncode == 0 else None
+        if self.output_sink is not None:
+            return self.output_sink.get_previous_walltime(self)
+        return None
+
     def get_pid(self):
         if self._p is None:
             raise ValueError('not running')
         return self._p.pid
 
-    def close(self):
-        for f in self._open_files:
-            f.close()
-        self._open_files = []
+    @property
+    def done(self):
+        """True once the run is complete and all callbacks have been
+        executed."""
+        return self._done.is_set()
 
     def join(self):
-        threading.Thread.join(self)
-        if self._kill_thread is not None:
-            self._kill_thread.join()
+        """Wait until the run is complete and all callbacks have been
+        executed. Must not be called on the supervisor thread."""
+        self._done.wait()
 
     def get_nodes_used(self):
         """Get number of nodes needed to run this app. Requires that the
@@ -452,7 +601,9 @@ class Pipeline(object):
                  post_process_script=None,
                  post_process_args=None,
                  post_process_stop_on_failure=False,
-                 node_layout=None, launch_mode=None):
+                 post_process_timeout=None,
+                 node_layout=None, launch_mode=None,
+                 runtime_estimate=None):
         self.id = pipe_id
         self.runs = runs
         self.working_dir = working_dir
@@ -460,16 +611,32 @@ class Pipeline(object):
         self.post_process_script = post_process_script
         self.post_process_args = post_process_args
         self.post_process_stop_on_failure = post_process_stop_on_failure
+        self.post_process_timeout = post_process_timeout or \
+            POST_PROCESS_TIMEOUT
         self.node_layout = node_layout
         self.machine_name = machine_name
+        self.runtime_estimate = runtime_estimate
+        self.start_time = None
+        self._estimates_loaded = False
+        self._fixed_estimate = None
+        self._timeout_estimate = None
 
         self._state_lock = threading.Lock()
         self._running = False
         self._force_killed = False
         self._active_runs = set()
 
-        self._pipe_thread = None
-        self._post_thread = None
+        self.supervisor = None
+        self._post_done = None
+        self._post_timer = None
+        self._post_start_time = None
+        self._post_end_time = None
+
+        # Set by the consumer in start, to trace the post process script
+        # and limit how many run at once
+        self.tracer = None
+        self.post_process_queue = None
+        self._post_timed_out = False
         self.done_callbacks = set()
         self.fatal_callbacks = set()
         self.total_procs = 0
@@ -482,9 +649,20 @@ class Pipeline(object):
         self.total_nodes = total_nodes
         self.launch_mode = launch_mode
 
-        # List of node IDs assigned to this pipeline. Get initialized in
-        # start()
-        self.nodes_assigned = Queue()
+        # List of node IDs assigned to this pipeline and not yet released.
+        # Get initialized in start()
+        self.nodes_assigned = []
+
+        # Runs that hold nodes together, and release them when all the runs
+        # in the group are done. Each entry is a (set of runs not yet done,
+        # list of node names) tuple. See _set_node_groups.
+        self._node_groups = []
+        self._run_node_group = {}
+        self._nodes_released_callback = None
+
+        # Names of codes that share nodes, from the node layout. Set by
+        # set_ppn.
+        self._code_groups = None
 
         # Keep a copy of the nodes assigned. Pop nodes from this queue to
         # assign to Runs. When a Run is done, it can push the node back into
@@ -533,36 +711,40 @@ class Pipeline(object):
         if not isinstance(post_process_args, list):
             raise ValueError("'post_process_args' must be a list")
         post_process_stop_on_failure = data.get("post_process_stop_on_failure")
+        post_process_timeout = data.get("post_process_timeout")
         node_layout = data.get("node_layout")
         total_nodes = data.get("total_nodes")
         machine_name = data.get("machine_name")
+        runtime_estimate = data.get("runtime_estimate")
         return Pipeline(pipe_id, runs=runs, working_dir=working_dir,
                         kill_on_partial_failure=kill_on_partial_failure,
                         post_process_script=post_process_script,
                         post_process_args=post_process_args,
                         post_process_stop_on_failure=
                         post_process_stop_on_failure,
+                        post_process_timeout=post_process_timeout,
                         node_layout=node_layout,
                         launch_mode=launch_mode,
                         total_nodes=total_nodes,
-                        machine_name=machine_name)
+                        machine_name=machine_name,
+                        runtime_estimate=runtime_estimate)
 
     def start(self, consumer, nodes_assigned, runner=None):
         # Mark all runs as active before they are actually started
-        # in a separate thread, so other methods know the state.
+        # by the supervisor, so other methods know the state.
 
-        for node_name in nodes_assigned:
-            self.nodes_assigned.put(node_name)
-            machine = machines.get_by_name(self.machine_name)
-            # self.nodes_assigned.put(machine.node_class(node_name))
+        self.nodes_assigned = list(nodes_assigned)
 
-        # Make a copy of the nodes_assigned. copy.deepcopy does not work
-        # self._nodes_assigned = copy.deepcopy(self.nodes_assigned)
-        for node in list(self.nodes_assigned.queue):
+        # Make a copy of the nodes_assigned, to assign to runs
+        for node in nodes_assigned:
             self._nodes_assigned.put(node)
 
+        self._nodes_released_callback = consumer.nodes_released
+        self.tracer = consumer.tracer
+        self.post_process_queue = consumer.post_process_queue
         self.add_done_callback(consumer.pipeline_finished)
         self.add_fatal_callback(consumer.pipeline_fatal)
+        self.supervisor = consumer.supervisor
 
         with self._state_lock:
             for run in self.runs:
@@ -574,44 +756,54 @@ class Pipeline(object):
                     self.runs = [mpmd_run]
             for run in self.runs:
                 run.set_runner(runner)
-
-                # Commenting out the callback to consumer.run_finished that
-                # releases the nodes held by a run.
-                # Now this is called when the pipeline finishes
-
-                # run.add_callback(consumer.run_finished)
-
+                run.supervisor = self.supervisor
+                run.sampler = consumer.sampler
+                run.output_sink = consumer.output_sink
                 run.add_callback(self.run_finished)
                 self._active_runs.add(run)
             self._running = True
+            self.start_time = time.time()
 
             # Parse the node layout and set the run information.
             # This requires self.nodes_assigned .
             # Only for Summit right now.
-            self._parse_node_layouts()
-
-            # Next start pipeline runs in separate thread and return
-            # immediately, so we can inject a wait time between starting runs.
-            self._pipe_thread = threading.Thread(target=self._start)
-            self._pipe_thread.start()
-
-    def _start(self):
-        """Start all runs in the pipeline, along with threads that monitor
-        their progress and signal consumer when finished. Use join_all to
-        wait until they are all finished."""
-
-        _log.debug("Pipeline {} launching run components".format(self.id))
-        for run in self.runs:
+            layout_groups = self._parse_node_layouts()
+            self._set_node_groups(layout_groups)
+
+            # Runs that fit on one of the pipeline's nodes can be started
+            # by the task farm worker on that node, instead of the runner.
+            if consumer.task_farm is not None:
+                for run in self.runs:
+                    consumer.task_farm.assign(run)
+
+            # Next start pipeline runs on the supervisor thread and return
+            # immediately. The caller may be holding locks that the run
+            # callbacks need.
+            self.supervisor.call_soon(self._start)
+
+    def _start(self, index=0):
+        """Start the runs in the pipeline from index onwards, on the
+        supervisor thread. A run's sleep_after is implemented by scheduling
+        the rest of the runs with a timer. Use join_all to wait until they
+        are all finished."""
+        if index == 0:
+            _log.debug("Pipeline {} launching run components".format(self.id))
+        while index < len(self.runs):
+            run = self.runs[index]
             run.start()
-            if run.sleep_after:
-                time.sleep(run.sleep_after)
+            index += 1
+            if run.sleep_after and index < len(self.runs):
+                self.supervisor.call_later(run.sleep_after, self._start, index)
+                return
 
     def _parse_node_layouts(self):
-        """Only for Summit right now."""
+        """Only for Summit right now. Returns a list of (runs, node names)
+        tuples, for each group of runs that share nodes, or None if not
+        on Summit."""
 
         # Return if not on Summit
         if self.machine_name.lower() not in 'summit':
-            return
+            return None
 
         # for layout in self.node_layout:
         #     self._parse_node_layout(layout)
@@ -633,6 +825,7 @@ class Pipeline(object):
                                 l.remove(code)
 
         # Get num nodes required to run this layout
+        layout_groups = []
         for l in codes_on_node:
             if len(l) == 0:
                 continue
@@ -654,6 +847,80 @@ class Pipeline(object):
             # Assign nodes to runs
             for run in l:
                 run.nodes_assigned = nodes_assigned_to_layout
+            layout_groups.append((l, nodes_assigned_to_layout))
+
+        return layout_groups
+
+    def _set_node_groups(self, layout_groups=None):
+        """Partition the assigned nodes between groups of runs that hold
+        them together, so each group can release its nodes as soon as all
+        of its runs are done. Runs that share nodes in the node layout are
+        in the same group, and so are runs that depend on another run, since
+        they are started on its nodes after it finishes. Nodes not needed by
+        any group are held until the pipeline is done. layout_groups is the
+        grouping from _parse_node_layouts, if available. Must be called with
+        lock acquired!"""
+        if layout_groups is None:
+            layout_groups = []
+            groups = self._group_runs_by_node()
+            group_nodes = [max(run.nodes or 0 for run in runs)
+                           for runs in groups]
+            if (any(run.nodes is None for run in self.runs)
+                    or sum(group_nodes) > len(self.nodes_assigned)):
+                # Can't tell which runs use which nodes, hold all nodes
+                # until the pipeline is done.
+                groups = [self.runs]
+                group_nodes = [len(self.nodes_assigned)]
+            i = 0
+            for runs, nodes in zip(groups, group_nodes):
+                names = self.nodes_assigned[i:i+nodes]
+                i += nodes
+                for run in runs:
+                    run.nodes_assigned = names
+                layout_groups.append((runs, names))
+
+        for runs, names in layout_groups:
+            group = (set(runs), list(names))
+            self._node_groups.append(group)
+            for run in runs:
+                self._run_node_group[run] = group
+
+    def _group_runs_by_node(self):
+        """Group runs that share nodes according to the node layout, and
+        runs with the runs they depend on."""
+        if len(self.runs) == 1:
+            # includes the MPMD case, where all runs are merged into one
+            return [list(self.runs)]
+        code_groups = self._code_groups
+        if code_groups is None:
+            code_groups = [[run.name] for run in self.runs]
+        groups = []
+        grouped = set()
+        for code_group in code_groups:
+            runs = [self._get_run_by_name(name) for name in code_group]
+            runs = [run for run in runs if run is not None]
+            if runs:
+                groups.append(runs)
+                grouped.update(runs)
+        for run in self.runs:
+            if run not in grouped:
+                groups.append([run])
+
+        for run in self.runs:
+            if run.depends_on_runs is None:
+                continue
+            run_group = self._find_group(groups, run)
+            dep_group = self._find_group(groups, run.depends_on_runs)
+            if run_group is not dep_group:
+                dep_group.extend(run_group)
+                groups.remove(run_group)
+        return groups
+
+    @staticmethod
+    def _find_group(groups, run):
+        for group in groups:
+            if run in group:
+                return group
 
     def _extract_codes_on_node(self, layout_info):
 
@@ -682,7 +949,11 @@ class Pipeline(object):
             assert run_name is not None, "Could not get run in node_layout"
 
             run = self._get_run_by_name(run_name)
-            run.nodes = math.ceil(run.nprocs / int(layout_info[run_name]))
+            ranks_per_node = int(layout_info[run_name])
+            run.nodes = math.ceil(run.nprocs / ranks_per_node)
+            if run.res_set is None:
+                # one core per rank, as with the jsrun defaults
+                run.res_set = ResourceSet(rs_per_host=ranks_per_node)
             codes_on_node.add(run)
 
         # if node-sharing
@@ -745,12 +1016,8 @@ class Pipeline(object):
         assert self._running
         run_done_callbacks = False
 
-        # release_nodes doesn't do anything at this time. Runs do not
-        # release nodes back to the pipeline, as it is non-trivial to
-        # release nodes to the pipeline when Runs share nodes.
-        self._release_nodes(run.nodes_assigned)
-
         with self._state_lock:
+            released_nodes = self._release_nodes(run)
             self._active_runs.remove(run)
             if not self._active_runs:
                 self.run_post_process_script()
@@ -766,18 +1033,50 @@ class Pipeline(object):
 
         # Note: must be done without lock, since callbacks may call
         # get_state or other methods that acquire lock.
+        if released_nodes:
+            self._nodes_released_callback(self, released_nodes)
         if run_done_callbacks:
+            self._save_result()
             self._execute_done_callbacks()
 
+    def _save_result(self):
+        """Write the returncode, walltime and resource usage of every run
+        to a single JSON file in the pipeline working dir."""
+        result = dict(id=self.id,
+                      runs=dict((run.name, run.get_result())
+                                for run in self.runs))
+        result_path = os.path.join(self.working_dir, RESULT_NAME)
+        try:
+            with open(result_path, 'w') as f:
+                json.dump(result, f, indent=2)
+                f.write('\n')
+        except IOError as e:
+            _log.error('%s failed to write result file: %s',
+                       self.log_prefix, str(e))
+
     def run_post_process_script(self):
+        """Launch the post process script through the supervisor, or queue
+        it if post_process_queue is set. Does not block, use join_all to
+        wait for it to complete."""
         if self.post_process_script is None:
             return None
         if self._force_killed:
             return None
-        self._post_thread = threading.Thread(target=self._post_process_thread)
-        self._post_thread.start()
+        self._post_done = threading.Event()
+        if self.post_process_queue is not None:
+            self.post_process_queue.submit(self)
+        else:
+            self.start_post_process()
 
-    def _post_process_thread(self):
+    def start_post_process(self):
+        """Spawn the post process script. Called by the post process queue
+        when it is the pipeline's turn."""
+        if self._force_killed:
+            self.skip_post_process()
+            if self.post_process_queue is not None:
+                # started by the queue, so it must be told it is done
+                self.post_process_queue.done(self, 0)
+            return
         args = [self.post_process_script] + self.post_process_args
         # TODO: make sure this doesn't conflict with other names
         name = 'post-process'
@@ -785,35 +1084,70 @@ class Pipeline(object):
                                 STDOUT_NAME + "." + name, None)
         stderr_path = _get_path(self.working_dir,
                                 STDERR_NAME + "." + name, None)
+        self._post_start_time = time.time()
+        self.supervisor.spawn(args, None, self.working_dir,
+                              stdout_path, stderr_path,
+                              self._post_process_started,
+                              self._post_process_exited,
+                              self._post_process_error)
+
+    def skip_post_process(self):
+        """Mark the post process as done without running it, e.g. if the
+        pipeline was killed while its post process was queued."""
+        self._post_done.set()
+
+    def _post_process_started(self, proc):
+        self._post_timer = self.supervisor.call_later(
+                    self.post_process_timeout, self._post_process_timeout,
+                    proc)
+
+    def _post_process_timeout(self, proc):
+        self._post_timer = None
+        self._post_timed_out = True
+        _log.warn("pipe '%s' failed to run post process script: "
+                  "timed out after %d seconds", self.id,
+                  self.post_process_timeout)
+        self.supervisor.signal_group(proc, signal.SIGKILL)
+
+    def _post_process_exited(self, proc):
+        if self._post_timer is not None:
+            self.supervisor.cancel(self._post_timer)
+            self._post_timer = None
+        if self._post_timed_out:
+            self._post_process_finished(None)
+        else:
+            self._post_process_finished(proc.returncode)
+
+    def _post_process_error(self, exc):
+        _log.warn("pipe '%s' failed to run post process script: %s",
+                  self.id, str(exc))
+        self._post_process_finished(None)
+
+    def _post_process_finished(self, rval):
+        name = 'post-process'
         return_path = _get_path(self.working_dir,
                                 RETURN_NAME + "." + name, None)
         walltime_path = _get_path(self.working_dir,
                                   WALLTIME_NAME + "." + name, None)
-
-        outf = errf = None
-        start_time = time.time()
+        end_time = time.time()
+        self._post_end_time = end_time
+        if self.tracer is not None:
+            self.tracer.post_process_finished(self, self._post_start_time,
+                                              end_time)
         try:
-            outf = open(stdout_path, 'w')
-            errf = open(stderr_path, 'w')
-            rval = subprocess.call(args, stdout=outf, stderr=errf,
-                                   cwd=self.working_dir, timeout=120)
-        except subprocess.SubprocessError as e:
-            _log.warn("pipe '%s' failed to run post process script: %s",
-                      self.id, str(e))
-            rval = None
-        finally:
-            end_time = time.time()
-            if outf is not None:
-                outf.close()
-            if errf is not None:
-                errf.close()
             with open(return_path, 'w') as rf:
                 rf.write(str(rval))
                 rf.write('\n')
             with open(walltime_path, 'w') as wf:
-                wf.write(str(end_time - start_time) + '\n')
-        if rval != 0 and self.post_process_stop_on_failure:
-            self._execute_fatal_callbacks()
+                wf.write(str(end_time - self._post_start_time) + '\n')
+            if rval != 0 and self.post_process_stop_on_failure:
+                self._execute_fatal_callbacks()
+        finally:
+            self._post_done.set()
+            if self.post_process_queue is not None:
+                self.post_process_queue.done(self,
+                                             end_time - self._post_start_time,
+                                             self._post_timed_out)
 
     def add_done_callback(self, fn):
         self.done_callbacks.add(fn)
@@ -839,14 +1173,101 @@ class Pipeline(object):
         for cb in self.fatal_callbacks:
             cb(self)
 
-    def _release_nodes(self, nodes_assigned_to_run):
-        pass
+    def _release_nodes(self, run):
+        """Mark run as done in its node group. If it was the last run in
+        the group, return the names of the group's nodes, which are no
+        longer held by the pipeline. Otherwise return an empty list. Must be
+        called with lock acquired!"""
+        group = self._run_node_group.get(run)
+        if group is None:
+            return []
+        runs, names = group
+        runs.discard(run)
+        if runs:
+            return []
+        released = list(names)
+        del names[:]
+        for name in released:
+            self.nodes_assigned.remove(name)
+        return released
+
+    def release_all_nodes(self):
+        """Remove and return the names of all nodes still held by the
+        pipeline."""
+        with self._state_lock:
+            for runs, names in self._node_groups:
+                del names[:]
+            released = self.nodes_assigned
+            self.nodes_assigned = []
+            return released
+
+    def get_nodes_held(self):
+        """Number of assigned nodes that have not been released yet."""
+        return len(self.nodes_assigned)
 
     def _get_run_by_name(self, run_name):
         for run in self.runs:
             if run.name == run_name:
                 return run
 
+    @property
+    def iteration_key(self):
+        """Pipeline id without the cheetah '.iteration-N' suffix, which is
+        the same for all repetitions of a run."""
+        return re.sub(r'\.iteration-\d+$', '', self.id)
+
+    def get_runtime_estimate(self, history=None):
+        """Estimated runtime of the pipeline in seconds, or None if there
+        is no way to tell. In order of preference, uses the runtime_estimate
+        from the fob, the walltime files saved by a previous attempt of the
+        pipeline, the runtime of another iteration of the same run recorded
+        in history (a dict mapping iteration_key to seconds), or the sum of
+        the run timeouts along the longest dependency chain, which is an
+        upper bound."""
+        if not self._estimates_loaded:
+            self._fixed_estimate = self.runtime_estimate
+            if self._fixed_estimate is None:
+                self._fixed_estimate = self.get_previous_runtime()
+            self._timeout_estimate = self._chain_estimate(
+                                            lambda run: run.timeout)
+            self._estimates_loaded = True
+        if self._fixed_estimate is not None:
+            return self._fixed_estimate
+        if history:
+            estimate = history.get(self.iteration_key)
+            if estimate is not None:
+                return estimate
+        return self._timeout_estimate
+
+    def get_previous_runtime(self):
+        """Runtime of a previous attempt of the pipeline, from the walltime
+        files of its runs along the longest dependency chain, or None if
+        any run has no walltime file or did not succeed."""
+        return self._chain_estimate(Run.get_previous_walltime)
+
+    def _chain_estimate(self, runtimefn):
+        """Get the longest path through the run dependencies, using
+        runtimefn(run) as the runtime of each run. Returns None if runtimefn
+        returns None for any run."""
+        totals = {}
+
+        def total(run):
+            if run not in totals:
+                t = runtimefn(run)
+                if t is not None and run.depends_on_runs is not None:
+                    dep_total = total(run.depends_on_runs)
+                    t = None if dep_total is None else t + dep_total
+                totals[run] = t
+            return totals[run]
+
+        estimate = 0
+        for run in self.runs:
+            t = total(run)
+            if t is None:
+                return None
+            estimate = max(estimate, t)
+        return estimate
+
     def get_nodes_used(self):
         if self.total_nodes is None:
             raise ValueError("set_ppn must be called before getting node usage")
@@ -862,6 +1283,8 @@ class Pipeline(object):
             node_layout = NodeLayout.default_no_share_layout(ppn, run_names)
         else:
             node_layout = NodeLayout(self.node_layout)
+        self._code_groups = [list(code_group) for code_group
+                             in node_layout.group_codes_by_node()]
 
         for run in self.runs:
             run_node = node_layout.get_node_containing_code(run.name)
@@ -911,33 +1334,31 @@ class Pipeline(object):
 
     def force_kill_all(self):
         """
-        Kill all runs and don't run post processing. Note that this call may
-        block waiting for all runs to be started, to avoid confusing races.
-        If the pipeline is already done, this does nothing. If one or more
-        runs are still active, or have not yet been marked as finished, then
-        it will mark the entire pipeline as killed so it can be re-run from
-        scratch on a restart if desired.
+        Kill all runs and don't run post processing. Does not block, runs
+        that have not been launched yet are marked as killed and will not
+        start. If the pipeline is already done, this does nothing. If one or
+        more runs are still active, or have not yet been marked as finished,
+        then it will mark the entire pipeline as killed so it can be re-run
+        from scratch on a restart if desired.
         """
         assert self._running
-        # Make sure _active_runs is fully populated by start thread.
-        self._pipe_thread.join()
         with self._state_lock:
             if not self._active_runs:
                 # already complete, don't kill
                 return
             self._force_killed = True
+            active_runs = list(self._active_runs)
 
-        for run in self._active_runs:
+        for run in active_runs:
             run.kill()
 
     def join_all(self):
         assert self._running
-        self._pipe_thread.join()
         for run in self.runs:
             run.join()
-        # Note: the _post_thread is set in the last run_finished
-        # callback, which will be executed in one of the run threads
-        # joined above, so this is guarenteed to be set if post process
+        # Note: the _post_done event is set in the last run_finished
+        # callback, which is executed before the run joined above is
+        # marked done, so this is guarenteed to be set if post process
         # has been configured and force kill was not called.
-        if self._post_thread is not None:
-            self._post_thread.join()
+        if self._post_done is not None:
+            self._post_done.wait()
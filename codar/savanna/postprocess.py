@@ -0,0 +1,96 @@
+"""
+Limit on the number of pipeline post process scripts running at once.
+
+When many pipelines finish close together, starting all of their post
+process scripts at once overloads the node running the workflow script,
+and slows down both the scripts and the launch of new pipelines. Pipelines
+submit their post process to a PostProcessQueue when their last run is
+done, and it is started once fewer than max_running are running. The nodes
+of the pipeline are released and new pipelines are started regardless of
+the queue.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+
+_log = logging.getLogger('codar.savanna.postprocess')
+
+
+def default_max_running():
+    """Default concurrency limit, the number of CPUs of this node."""
+    return os.cpu_count() or 1
+
+
+class PostProcessQueue(object):
+    """FIFO of pipelines waiting to run their post process script. submit,
+    done and cancel_pending are thread safe, and are called by Pipeline on
+    the supervisor thread. If metrics is set, the queue depth, wait and
+    runtime of each post process are recorded."""
+
+    def __init__(self, max_running=None, metrics=None):
+        self.max_running = max_running or default_max_running()
+        self.metrics = metrics
+        self._cv = threading.Condition()
+        self._pending = deque()
+        self._queued_time = {}
+        self._running = set()
+
+    def submit(self, pipeline):
+        """Start the post process of pipeline with
+        pipeline.start_post_process, now or once another one is done."""
+        with self._cv:
+            self._pending.append(pipeline)
+            self._queued_time[pipeline] = time.time()
+            if self.metrics is not None:
+                self.metrics.post_process_queued(len(self._pending))
+        self._start_ready()
+
+    def done(self, pipeline, runtime, timed_out=False):
+        """Called when the post process of pipeline is finished, after
+        runtime seconds."""
+        with self._cv:
+            self._running.discard(pipeline)
+            self._cv.notify_all()
+        if self.metrics is not None:
+            self.metrics.post_process_finished(runtime, timed_out)
+        self._start_ready()
+
+    def cancel_pending(self):
+        """Skip the post process of pipelines that have not started it,
+        when the workflow is killed."""
+        with self._cv:
+            pending = list(self._pending)
+            self._pending.clear()
+            self._queued_time.clear()
+            self._cv.notify_all()
+        for pipeline in pending:
+            _log.info("pipe '%s' post process skipped, workflow killed",
+                      pipeline.id)
+            pipeline.skip_post_process()
+
+    def join(self):
+        """Wait until no post process is queued or running. Must not be
+        called on the supervisor thread."""
+        with self._cv:
+            while self._pending or self._running:
+                self._cv.wait()
+
+    def _start_ready(self):
+        while True:
+            with self._cv:
+                if (not self._pending
+                        or len(self._running) >= self.max_running):
+                    return
+                pipeline = self._pending.popleft()
+                wait = time.time() - self._queued_time.pop(pipeline)
+                self._running.add(pipeline)
+                if self.metrics is not None:
+                    self.metrics.post_process_started(wait,
+                                                      len(self._pending))
+            # started without the lock, done may be called right away if
+            # the script fails to launch
+            pipeline.start_post_process()
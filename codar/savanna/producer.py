@@ -1,33 +1,88 @@
-"""Classes for producing pipelines."""
+"""Classes for producing pipelines.
+
+Two fobs file formats are supported. The original format is a single JSON
+list of pipeline documents, which must be parsed in full before the first
+pipeline can be started. The streaming (NDJSON) format has one pipeline
+document per line, so pipelines can be parsed one at a time as the consumer
+needs them. A streaming fobs file can have an index file next to it, with
+the byte offset and id of each pipeline, which allows pipelines that are
+already done to be skipped on restart without reading or parsing them.
+
+SocketPipelineProducer accepts pipelines from other processes while the
+workflow is running, over a UNIX domain socket."""
 
 import json
 import os
 import logging
+import socket
+import socketserver
+import asyncio
+import threading
 from codar.savanna.model import Pipeline
-from codar.savanna.status import DONE, NOT_STARTED
+from codar.savanna.status import DONE, NOT_STARTED, load_workflow_status
 
 _log = logging.getLogger('codar.savanna.producer')
 
 
+STATUS_FILE_NAME = 'codar.workflow.status.json'
+INDEX_SUFFIX = '.idx'
+
+
+def index_path(file_path):
+    return file_path + INDEX_SUFFIX
+
+
+def is_ndjson_file(file_path):
+    """True if file_path is in the streaming format, i.e. the first
+    document is an object rather than a list of objects."""
+    with open(file_path) as f:
+        while True:
+            c = f.read(1)
+            if not c or not c.isspace():
+                break
+    return c == '{'
+
+
+def iter_pipeline_data(file_path):
+    """Iterate over the pipeline documents in a fobs file of either format,
+    without creating Pipeline objects. Streaming files are read one line
+    at a time."""
+    if not is_ndjson_file(file_path):
+        with open(file_path) as f:
+            yield from json.load(f)
+        return
+    with open(file_path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_pipeline_reader(file_path, status_file=None):
+    """Get a reader for file_path with the appropriate class for its
+    format."""
+    if is_ndjson_file(file_path):
+        return NDJSONPipelineReader(file_path, status_file)
+    return JSONFilePipelineReader(file_path, status_file)
+
+
 class JSONFilePipelineReader(object):
-    """Load pipelines from a file formatted as a new line separated list of
-    JSON documents. Each JSON document must be a list containing dictionaries,
-    each dictionary discribing a code to run as part of the pipeline."""
+    """Load pipelines from a file containing a JSON list. Each element of
+    the list is a JSON object describing a pipeline, with a list of
+    dictionaries under 'runs', each describing a code to run as part of
+    the pipeline."""
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, status_file=None):
         self.file_path = file_path
+        if status_file is None:
+            status_file = os.path.join(os.path.dirname(file_path),
+                                       STATUS_FILE_NAME)
+        self.status_file = status_file
 
     def read_pipelines(self):
 
         # If the group has been run before, open status file and get the
         # status of all runs
-        status_file = os.path.join(os.path.dirname(self.file_path),
-                                   'codar.workflow.status.json')
-        try:
-            with open(status_file, 'r') as sf:
-                pipelines_status = json.load(sf)
-        except:
-            pipelines_status = {}
+        pipelines_status = self._load_status()
 
         with open(self.file_path) as f:
             all_pipelines = json.load(f)
@@ -35,13 +90,327 @@ class JSONFilePipelineReader(object):
         for pipeline_data in all_pipelines:
             # Check if this pipeline has already been run
             pipe_id = pipeline_data['id']
-            status_d = pipelines_status.get(pipe_id, {})
-            status = status_d.get('state', NOT_STARTED)
-
-            # Add pipeline if not done
-            if status == DONE:
+            if self._is_done(pipelines_status, pipe_id):
                 _log.info("pipeline %s already done, skipping", pipe_id)
             else:
                 pipeline = Pipeline.from_data(pipeline_data)
                 _log.debug("adding pipeline %s to run queue", pipe_id)
                 yield pipeline
+
+    def _load_status(self):
+        try:
+            return load_workflow_status(self.status_file)
+        except:
+            return {}
+
+    @staticmethod
+    def _is_done(pipelines_status, pipe_id):
+        status_d = pipelines_status.get(pipe_id, {})
+        return status_d.get('state', NOT_STARTED) == DONE
+
+
+class NDJSONPipelineReader(JSONFilePipelineReader):
+    """Load pipelines from a file with one JSON pipeline object per line
+    (see JSONFilePipelineReader for the object format). Pipelines are
+    parsed lazily, so when the consumer limits the number of queued
+    pipelines only that many Pipeline objects are kept in memory.
+
+    If an index file written by NDJSONPipelineWriter exists and is not
+    older than the fobs file, it is used to skip pipelines that are already
+    done without reading their lines."""
+
+    def read_pipelines(self):
+        pipelines_status = self._load_status()
+        if self._index_is_current():
+            lines = self._read_indexed_lines(pipelines_status)
+        else:
+            lines = self._read_lines()
+
+        for line in lines:
+            pipeline_data = json.loads(line)
+            pipe_id = pipeline_data['id']
+            if self._is_done(pipelines_status, pipe_id):
+                _log.info("pipeline %s already done, skipping", pipe_id)
+                continue
+            pipeline = Pipeline.from_data(pipeline_data)
+            _log.debug("adding pipeline %s to run queue", pipe_id)
+            yield pipeline
+
+    def _index_is_current(self):
+        ipath = index_path(self.file_path)
+        return (os.path.isfile(ipath) and os.path.getmtime(ipath)
+                >= os.path.getmtime(self.file_path))
+
+    def _read_lines(self):
+        with open(self.file_path) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def _read_indexed_lines(self, pipelines_status):
+        with open(index_path(self.file_path)) as index, \
+                open(self.file_path, 'rb') as f:
+            for entry in index:
+                offset, pipe_id = entry.rstrip('\n').split('\t', 1)
+                if self._is_done(pipelines_status, pipe_id):
+                    _log.info("pipeline %s already done, skipping", pipe_id)
+                    continue
+                f.seek(int(offset))
+                yield f.readline().decode('utf-8')
+
+
+class NDJSONPipelineWriter(object):
+    """Write pipeline documents to a streaming fobs file and its index,
+    one at a time. Use as a context manager, or call close when done. The
+    context manager calls abort instead if the block raises."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        # binary mode, so tell() is a byte offset
+        self._f = open(file_path, 'wb')
+        self._index = open(index_path(file_path), 'w')
+
+    def write(self, pipeline_data):
+        self._index.write('%d\t%s\n' % (self._f.tell(), pipeline_data['id']))
+        line = json.dumps(pipeline_data, sort_keys=True) + '\n'
+        self._f.write(line.encode('utf-8'))
+
+    def close(self):
+        self._f.close()
+        # written last, so it is never older than the fobs file
+        self._index.close()
+
+    def abort(self):
+        """Close and remove the fobs file and its index, so a partial
+        workflow is never left looking like a complete one."""
+        self._f.close()
+        self._index.close()
+        os.remove(self.file_path)
+        os.remove(index_path(self.file_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SocketPipelineProducer(object):
+    """Accept pipelines from other processes on a UNIX domain socket, for
+    drivers that decide what to run next based on results of previous
+    pipelines. Requests and responses are JSON objects, one per line, and
+    each request gets exactly one response, in order. Supported requests:
+
+        {"op": "add", "pipeline": {...}}  add a pipeline, in the same format
+                                          as the fobs file
+        {"op": "status", "id": "..."}     get the state of a pipeline
+        {"op": "stop"}                    stop accepting pipelines, the
+                                          workflow exits when all pipelines
+                                          are done
+
+    Responses have "ok" set to true or false, and an "error" message when
+    false. The add request is not answered until the consumer has room for
+    the pipeline, see PipelineRunner.wait_for_space.
+
+    Use serve for the thread engine, or serve_async for the asyncio engine.
+    Both return after a stop request or close."""
+
+    def __init__(self, consumer, socket_path):
+        self.consumer = consumer
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._server = None
+        # set by serve_async
+        self._closed = None
+        self._writers = set()
+
+    def serve(self):
+        with self._lock:
+            if self._stopping:
+                return
+            self._remove_socket()
+            self._server = _ThreadingUnixServer(self.socket_path,
+                                                _StreamHandler)
+        self._server.producer = self
+        # only the user running the workflow can submit pipelines
+        os.chmod(self.socket_path, 0o600)
+        _log.info("accepting pipelines on %s", self.socket_path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._remove_socket()
+
+    async def serve_async(self):
+        if self._stopping:
+            return
+        self._remove_socket()
+        self._closed = asyncio.Event()
+        self._server = await asyncio.start_unix_server(self._handle_client,
+                                                       path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        _log.info("accepting pipelines on %s", self.socket_path)
+        try:
+            await self._closed.wait()
+        finally:
+            self._server.close()
+            # wait_closed also waits for open connections on python 3.12
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._remove_socket()
+
+    def close(self):
+        """Stop accepting connections and requests, and make serve return.
+        If serve has not been called yet, it will return immediately. With
+        serve, must not be called from the thread running serve. With
+        serve_async, must be called on the loop thread."""
+        with self._lock:
+            self._stopping = True
+            server = self._server
+        if server is None:
+            return
+        if self._closed is not None:
+            self._closed.set()
+        else:
+            server.shutdown()
+
+    def handle_request(self, request):
+        if request.get('op') == 'add':
+            if not self.consumer.wait_for_space():
+                return _error('workflow is not accepting pipelines')
+            return self._add(request)
+        return self._handle_other(request)
+
+    async def handle_request_async(self, request):
+        if request.get('op') == 'add':
+            if not await self.consumer.wait_for_space():
+                return _error('workflow is not accepting pipelines')
+            return self._add(request)
+        return self._handle_other(request)
+
+    def _add(self, request):
+        try:
+            pipeline = Pipeline.from_data(request['pipeline'])
+            added = self.consumer.add_pipeline(pipeline)
+        except Exception as e:
+            return _error('%s: %s' % (type(e).__name__, e))
+        if added is False:
+            return _error('workflow killed, pipeline not added')
+        _log.debug("adding pipeline %s from socket", pipeline.id)
+        return dict(ok=True, id=pipeline.id)
+
+    def _handle_other(self, request):
+        op = request.get('op')
+        if op == 'status':
+            pipe_id = request.get('id')
+            data = self.consumer.get_pipeline_status(pipe_id)
+            if data is None:
+                return _error('unknown pipeline: %s' % pipe_id)
+            response = dict(ok=True, id=pipe_id)
+            response.update(data)
+            return response
+        elif op == 'stop':
+            _log.info("stop requested on %s", self.socket_path)
+            self.close()
+            return dict(ok=True)
+        elif op is None:
+            return _error(request.get('error') or 'missing op')
+        return _error('unknown op: %s' % op)
+
+    async def _handle_client(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while not self._closed.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle_request_async(
+                                                    _parse_request(line))
+                writer.write(_encode_response(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _remove_socket(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def _error(message):
+    return dict(ok=False, error=message)
+
+
+def _parse_request(line):
+    try:
+        request = json.loads(line.decode('utf-8'))
+    except ValueError as e:
+        return dict(op=None, error='invalid JSON: %s' % e)
+    if not isinstance(request, dict):
+        return dict(op=None, error='request must be a JSON object')
+    return request
+
+
+def _encode_response(response):
+    return (json.dumps(response) + '\n').encode('utf-8')
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        producer = self.server.producer
+        for line in self.rfile:
+            response = producer.handle_request(_parse_request(line))
+            try:
+                self.wfile.write(_encode_response(response))
+                self.wfile.flush()
+            except ConnectionError:
+                break
+
+
+class SocketPipelineClient(object):
+    """Client for SocketPipelineProducer."""
+
+    def __init__(self, socket_path, timeout=None):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile('rwb')
+
+    def request(self, **request):
+        self._file.write(_encode_response(request))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('connection closed by workflow')
+        return json.loads(line.decode('utf-8'))
+
+    def add_pipeline(self, pipeline_data):
+        return self.request(op='add', pipeline=pipeline_data)
+
+    def get_status(self, pipe_id):
+        return self.request(op='status', id=pipe_id)
+
+    def stop(self):
+        return self.request(op='stop')
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,5 +1,6 @@
 import shutil
 import math
+import subprocess
 from codar.savanna import machines
 
 
@@ -7,17 +8,29 @@ class Runner(object):
     def wrap(self, run, sched_args):
         raise NotImplemented()
 
+    def wrap_per_node(self, exe, args, nodes):
+        """Get the command to start exe with args once on each of nodes
+        nodes, e.g. for the task farm workers. Raises ValueError if the
+        runner can't place one process per node."""
+        raise ValueError('%s can not start one process per node'
+                         % type(self).__name__)
+
 
 class MPIRunner(Runner):
     def __init__(self, exe, nprocs_arg, nodes_arg=None,
-                 tasks_per_node_arg=None, hostfile=None):
+                 tasks_per_node_arg=None, hostfile=None,
+                 per_node_args=None):
         self.exe = exe
         self.nprocs_arg = nprocs_arg
         self.nodes_arg = nodes_arg
         self.tasks_per_node_arg = tasks_per_node_arg
         self.hostfile = hostfile
+        # function of the runner path returning extra args that place one
+        # process per node, for runners that don't have a nodes or tasks
+        # per node arg
+        self.per_node_args = per_node_args
 
-    def wrap(self, run, sched_args, find_in_path=True):
+    def _find_exe(self, find_in_path):
         if find_in_path:
             exe_path = shutil.which(self.exe)
         else:
@@ -25,6 +38,10 @@ class MPIRunner(Runner):
             exe_path = self.exe
         if exe_path is None:
             raise ValueError('Could not find "%s" in path' % self.exe)
+        return exe_path
+
+    def wrap(self, run, sched_args, find_in_path=True):
+        exe_path = self._find_exe(find_in_path)
 
         runner_args = [exe_path, self.nprocs_arg, str(run.nprocs)]
 
@@ -40,6 +57,20 @@ class MPIRunner(Runner):
             runner_args += [self.hostfile, str(run.hostfile)]
         return runner_args + [run.exe] + run.args
 
+    def wrap_per_node(self, exe, args, nodes, find_in_path=True):
+        if not (self.nodes_arg or self.tasks_per_node_arg
+                or self.per_node_args):
+            return Runner.wrap_per_node(self, exe, args, nodes)
+        exe_path = self._find_exe(find_in_path)
+        runner_args = [exe_path, self.nprocs_arg, str(nodes)]
+        if self.nodes_arg:
+            runner_args += [self.nodes_arg, str(nodes)]
+        if self.tasks_per_node_arg:
+            runner_args += [self.tasks_per_node_arg, '1']
+        if self.per_node_args:
+            runner_args += self.per_node_args(exe_path)
+        return runner_args + [exe] + args
+
 
 class SummitRunner(Runner):
     def __init__(self):
@@ -57,6 +88,17 @@ class SummitRunner(Runner):
         runner_args = ['jsrun', '--erf_input', run.erf_file]
         return runner_args
 
+    def wrap_per_node(self, exe, args, nodes):
+        # One resource set per host, with all its cores and GPUs and no
+        # binding, so the processes started by exe can use the whole node.
+        runner_args = [self.exe, self.nrs_arg, str(nodes),
+                       self.rs_per_host_arg, '1',
+                       self.tasks_per_rs_arg, '1',
+                       self.cpus_per_rs_arg, 'ALL_CPUS',
+                       self.gpus_per_rs_arg, 'ALL_GPUS',
+                       self.bind_arg, 'none']
+        return runner_args + [exe] + args
+
     def wrap_deprecated(self, run, jsrun_opts, find_in_path=True):
         """This function is deprecated in favor of the above that uses erf
         files"""
@@ -90,7 +132,27 @@ class SummitRunner(Runner):
         return runner_args + [run.exe] + run.args
 
 
-mpiexec = MPIRunner('mpiexec', '-n', hostfile='--hostfile')
+def mpiexec_per_node_args(exe_path):
+    """Args placing one process per node for the MPI implementation of
+    mpiexec, which have different syntax. Raises ValueError if it is not
+    Open MPI or MPICH/Hydra."""
+    try:
+        out = subprocess.run([exe_path, '--version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        raise ValueError('Could not get the version of "%s": %s'
+                         % (exe_path, e))
+    out = out.decode('utf-8', 'replace')
+    if 'Open MPI' in out or 'OpenRTE' in out:
+        return ['--map-by', 'ppr:1:node']
+    if 'HYDRA' in out:
+        return ['-ppn', '1']
+    raise ValueError('"%s" is not Open MPI or MPICH/Hydra, can not start '
+                     'one process per node' % exe_path)
+
+
+mpiexec = MPIRunner('mpiexec', '-n', hostfile='--hostfile',
+                    per_node_args=mpiexec_per_node_args)
 aprun = MPIRunner('aprun', '-n', tasks_per_node_arg='-N', hostfile='-L')
 srun = MPIRunner('srun', '-n', nodes_arg='-N', hostfile='-w')
 jsrun = SummitRunner()
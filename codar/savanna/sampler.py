@@ -0,0 +1,160 @@
+"""
+Time series sampling of the process groups of running Runs.
+
+A single ProcessSampler thread covers all active runs. Every interval
+seconds it reads /proc/<pid>/stat once for each process on the node,
+groups the processes by process group, and appends a line to the samples
+file of each registered run, codar.workflow.samples.<name> next to its
+walltime file:
+
+    time,nprocs,cpu_percent,rss_kb,threads
+
+time is seconds since the epoch, cpu_percent is the CPU time used by the
+group since the previous sample as a percent of one core (so it can be
+more than 100), rss_kb and threads are summed over the group.
+
+Only processes on the node running the workflow are visible, so for runs
+started through a job launcher on other nodes, the sampler sees the
+launcher process. Requires Linux /proc, and does nothing elsewhere.
+"""
+
+import os
+import time
+import threading
+import logging
+
+
+SAMPLES_NAME = 'codar.workflow.samples'
+SAMPLES_HEADER = 'time,nprocs,cpu_percent,rss_kb,threads\n'
+
+_log = logging.getLogger('codar.savanna.sampler')
+
+try:
+    _CLK_TCK = os.sysconf('SC_CLK_TCK')
+    _PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = _PAGE_KB = None
+
+
+def read_proc_stats():
+    """Get a dict mapping pgid to a list of (pid, cpu ticks, rss pages,
+    threads) for every process in /proc."""
+    groups = {}
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return groups
+    for pid in pids:
+        try:
+            with open('/proc/%s/stat' % pid, 'rb') as f:
+                data = f.read()
+        except OSError:
+            # exited since listdir
+            continue
+        # comm may contain spaces and parens, fields start after the last
+        # ')', with state (field 3) at index 0.
+        fields = data[data.rfind(b')') + 2:].split()
+        try:
+            pgid = int(fields[2])
+            ticks = int(fields[11]) + int(fields[12])
+            threads = int(fields[17])
+            rss = int(fields[21])
+        except (IndexError, ValueError):
+            continue
+        groups.setdefault(pgid, []).append((int(pid), ticks, rss, threads))
+    return groups
+
+
+class _RunSamples(object):
+    """Samples file and previous cpu ticks of each process for one run."""
+    def __init__(self, run, path):
+        self.run = run
+        self.pgid = run._pgid
+        self.path = path
+        self.ticks = {}
+        self.last_time = None
+        self.file = None
+
+
+class ProcessSampler(threading.Thread):
+    """Sample the process group of every added run each interval seconds.
+    add and remove are thread safe, and are called by the Run on the
+    supervisor thread when the process starts and when it is done."""
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self, name='Thread-sampler-0')
+        # Samples are flushed after every line, nothing to clean up.
+        self.daemon = True
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._removed = []
+        self._stop_event = threading.Event()
+
+    def add(self, run):
+        if _CLK_TCK is None:
+            return
+        path = os.path.join(os.path.dirname(run.walltime_path),
+                            SAMPLES_NAME + '.' + run.name)
+        with self._lock:
+            self._runs[run] = _RunSamples(run, path)
+
+    def remove(self, run):
+        """Stop sampling run. Its file is closed by the sampler thread."""
+        with self._lock:
+            samples = self._runs.pop(run, None)
+            if samples is not None:
+                self._removed.append(samples)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                active = list(self._runs.values())
+                removed = self._removed
+                self._removed = []
+            for samples in removed:
+                self._close(samples)
+            if active:
+                self._sample(active, read_proc_stats())
+        with self._lock:
+            done = list(self._runs.values()) + self._removed
+            self._runs.clear()
+            self._removed = []
+        for samples in done:
+            self._close(samples)
+
+    def _sample(self, active, groups):
+        now = time.time()
+        for samples in active:
+            procs = groups.get(samples.pgid, [])
+            ticks = dict((pid, t) for pid, t, rss, threads in procs)
+            delta = sum(t - samples.ticks.get(pid, 0)
+                        for pid, t in ticks.items())
+            if samples.last_time is not None and now > samples.last_time:
+                elapsed = now - samples.last_time
+            else:
+                elapsed = self.interval
+            cpu_percent = 100.0 * delta / _CLK_TCK / elapsed
+            samples.ticks = ticks
+            samples.last_time = now
+            line = '%.3f,%d,%.1f,%d,%d\n' % (
+                now, len(procs), cpu_percent,
+                sum(rss for pid, t, rss, threads in procs) * _PAGE_KB,
+                sum(threads for pid, t, rss, threads in procs))
+            try:
+                if samples.file is None:
+                    samples.file = open(samples.path, 'w')
+                    samples.file.write(SAMPLES_HEADER)
+                samples.file.write(line)
+                samples.file.flush()
+            except IOError as e:
+                _log.error('%s failed to write samples: %s',
+                           samples.run.log_prefix, str(e))
+
+    def _close(self, samples):
+        if samples.file is not None:
+            samples.file.close()
+            samples.file = None
@@ -1,7 +1,9 @@
 """
-Classes related to finding a job that can run on available resources. Does
-not assume any knowledge of how long each job will take. Designed for greedy
-search of a job that will fit whenever resources are freed.
+Classes related to finding a job that can run on available resources. The
+default GreedyPolicy does not assume any knowledge of how long each job will
+take, and does a greedy search for a job that will fit whenever resources
+are freed. BackfillPolicy uses runtime estimates to reserve nodes for big
+jobs so they are not starved, and backfills shorter jobs into the gaps.
 
 In the context of Cheetah workflows, it's unlikely that there will be more than
 a few hundred jobs, so it's not worth optimizing the python search code very
@@ -13,6 +15,22 @@ nodes.
 
 import bisect
 import threading
+import math
+from collections import deque
+
+
+# Running jobs that have exceeded their runtime estimate are assumed to be
+# about to finish.
+OVERDUE_DELAY = 1
+
+POLICY_NAMES = ['greedy', 'easy', 'conservative']
+
+# Reservations made by the conservative policy on each pop. Every
+# reservation adds up to two steps to the availability profile, and every
+# queued job is checked against the whole profile, so protecting every job
+# in a queue of thousands would cost O(queue ** 2) per pop. Jobs past the
+# first CONSERVATIVE_RESERVATIONS are only backfilled, as with EASY.
+CONSERVATIVE_RESERVATIONS = 100
 
 
 class JobList(object):
@@ -60,5 +78,190 @@ class JobList(object):
                 return job
             return None
 
+    def remove_job(self, job):
+        """Remove the specified job from the list. Raises ValueError if it
+        is not in the list."""
+        cost = self._costfn(job)
+        with self._lock:
+            i = bisect.bisect_left(self._costs, cost)
+            while i < len(self._jobs) and self._costs[i] == cost:
+                if self._jobs[i] is job:
+                    del self._jobs[i]
+                    del self._costs[i]
+                    return
+                i += 1
+        raise ValueError('job not in list')
+
+    def get_cost(self, job):
+        return self._costfn(job)
+
+    def __iter__(self):
+        """Iterate over a snapshot of the jobs, in increasing cost
+        order."""
+        with self._lock:
+            return iter(list(self._jobs))
+
     def __len__(self):
         return len(self._costs)
+
+
+class NodePool(object):
+    """Track the free nodes of an allocation with a fixed number of nodes.
+    Nodes are identified by relative names '1' to 'size', which is what is
+    needed to create ERF files on Summit. Not thread safe, callers must
+    synchronize access."""
+
+    def __init__(self, size):
+        self.size = size
+        self._free = deque(str(i + 1) for i in range(size))
+
+    @property
+    def free(self):
+        return len(self._free)
+
+    def take(self, count):
+        """Remove count nodes from the pool and return a list of their
+        names. Raises ValueError if there are not enough free nodes."""
+        if count > len(self._free):
+            raise ValueError('%d nodes requested, only %d free'
+                             % (count, len(self._free)))
+        return [self._free.popleft() for i in range(count)]
+
+    def release(self, names):
+        self._free.extend(names)
+
+
+class GreedyPolicy(object):
+    """Start the highest cost job that fits in the free nodes. Runtime
+    estimates are not used."""
+
+    # the running jobs passed to pop_job are not used, so callers can pass
+    # an empty list
+    uses_running = False
+
+    def pop_job(self, job_list, free_nodes, running, now, runtimefn):
+        return job_list.pop_job(free_nodes)
+
+
+class BackfillPolicy(object):
+    """Backfill scheduling based on runtime estimates.
+
+    Jobs are considered in the same priority order as GreedyPolicy, highest
+    cost first. The first 'reservations' jobs that can't start now are given
+    a reservation at the earliest time enough nodes are expected to be
+    free, and a job is only started now if it does not delay any of the
+    reservations, i.e. it will finish before they start or only uses nodes
+    they don't need. reservations=1 is EASY backfill, reservations=None
+    gives every job a reservation (conservative backfill), which costs
+    O(queue ** 2) per pop, see CONSERVATIVE_RESERVATIONS.
+
+    pop_job is passed the running jobs as a list of (nodes, end_time) pairs,
+    with end_time None if not known, and runtimefn(job), which returns the
+    estimated runtime in seconds or None if not known. Jobs and running jobs
+    with unknown runtime are assumed to run forever, so a job that is stuck
+    behind them can't get a reservation, and jobs with unknown runtime are
+    only backfilled onto nodes that no reservation needs."""
+
+    uses_running = True
+
+    def __init__(self, reservations=1):
+        self.reservations = reservations
+
+    def pop_job(self, job_list, free_nodes, running, now, runtimefn):
+        """Remove and return the job that should be started now, or None if
+        no job can be started. Raises IndexError if the job list is
+        empty."""
+        if len(job_list) == 0:
+            raise IndexError('pop called on empty job list')
+        if free_nodes == 0:
+            return None
+        profile = AvailabilityProfile(now, free_nodes, running)
+        nreserved = 0
+        for job in reversed(list(job_list)):
+            nodes = job_list.get_cost(job)
+            reserving = (self.reservations is None
+                         or nreserved < self.reservations)
+            if nodes > free_nodes and not reserving:
+                # can't start now, and reservations are used up
+                continue
+            runtime = runtimefn(job)
+            if runtime is None:
+                runtime = math.inf
+            start = profile.earliest_start(nodes, runtime)
+            if start == now:
+                job_list.remove_job(job)
+                return job
+            if reserving:
+                if start is not None:
+                    profile.reserve(start, runtime, nodes)
+                nreserved += 1
+        return None
+
+
+def get_policy(name):
+    """Get a new scheduling policy by name, see POLICY_NAMES."""
+    if name == 'easy':
+        return BackfillPolicy(reservations=1)
+    elif name == 'conservative':
+        return BackfillPolicy(reservations=CONSERVATIVE_RESERVATIONS)
+    elif name == 'greedy':
+        return GreedyPolicy()
+    raise ValueError('unknown scheduling policy: %s' % name)
+
+
+class AvailabilityProfile(object):
+    """Piecewise constant number of free nodes over time, starting at now.
+    free[i] nodes are free from times[i] until times[i+1] (or forever for
+    the last entry)."""
+
+    def __init__(self, now, free_nodes, running):
+        self.times = [now]
+        self.free = [free_nodes]
+        ends = []
+        for nodes, end_time in running:
+            if end_time is None:
+                # never released
+                continue
+            ends.append((max(end_time, now + OVERDUE_DELAY), nodes))
+        ends.sort()
+        for end_time, nodes in ends:
+            if end_time == self.times[-1]:
+                self.free[-1] += nodes
+            else:
+                self.times.append(end_time)
+                self.free.append(self.free[-1] + nodes)
+
+    def earliest_start(self, nodes, runtime):
+        """Get the earliest time that nodes are free for runtime seconds, or
+        None if that never happens."""
+        n = len(self.times)
+        for i in range(n):
+            if self.free[i] < nodes:
+                continue
+            end_time = self.times[i] + runtime
+            j = i + 1
+            while j < n and self.times[j] < end_time:
+                if self.free[j] < nodes:
+                    break
+                j += 1
+            else:
+                return self.times[i]
+        return None
+
+    def reserve(self, start, runtime, nodes):
+        """Mark nodes as used from start for runtime seconds."""
+        end_time = start + runtime
+        self._split(start)
+        if not math.isinf(end_time):
+            self._split(end_time)
+        i = bisect.bisect_left(self.times, start)
+        j = bisect.bisect_left(self.times, end_time, i)
+        for k in range(i, j):
+            self.free[k] -= nodes
+
+    def _split(self, t):
+        i = bisect.bisect_left(self.times, t)
+        if i < len(self.times) and self.times[i] == t:
+            return
+        self.times.insert(i, t)
+        self.free.insert(i, self.free[i-1])
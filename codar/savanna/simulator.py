@@ -0,0 +1,213 @@
+"""
+Offline replay of a sweep group with a virtual clock, to compare scheduling
+policies before using them on a real allocation.
+
+The simulator drives the real JobList, NodePool and scheduling policies
+through the PipelineRunner node allocation code, but pipelines are not
+started: each one holds its nodes for its runtime, and the clock jumps to
+the next pipeline to finish. The runtime of a pipeline is taken from the
+codar.workflow.walltime.* files of a previous attempt that succeeded, or
+from the runtime_estimate in the fob, or from --default-runtime. Pipelines
+with none of these are left out of the simulation and counted as unknown.
+
+Since the walltime files are also what the real scheduler uses as runtime
+estimates, the backfill policies see exact estimates for the pipelines
+with walltime files. Nodes are held by a pipeline until all of its runs are
+done, releasing nodes for runs that finish early is not simulated.
+
+For each policy, reports the makespan, node utilization over the makespan,
+and the queue wait of every pipeline, as JSON:
+
+    python -m codar.savanna.simulator --max-nodes 32 \\
+        --processes-per-node 42 group/fobs.json > replay.json
+"""
+
+import sys
+import json
+import heapq
+import argparse
+
+from codar.savanna.consumer import PipelineRunner
+from codar.savanna.model import Pipeline
+from codar.savanna.producer import iter_pipeline_data
+from codar.savanna.scheduler import POLICY_NAMES, get_policy
+
+
+class SimulatedRunner(PipelineRunner):
+    """PipelineRunner on a virtual clock that starts at 0, with no
+    supervisor. Add the pipelines with add_pipeline, then call simulate.
+    Not thread safe."""
+
+    def __init__(self, max_nodes, machine_name, processes_per_node,
+                 scheduler_policy=None, deadline=None):
+        self.clock = 0.0
+        PipelineRunner.__init__(self, None, max_nodes, machine_name,
+                                processes_per_node,
+                                scheduler_policy=scheduler_policy,
+                                deadline=deadline)
+        self._runtimes = {}
+        self._events = []
+        self._busy_node_seconds = 0.0
+        self.results = []
+
+    def _create_supervisor(self):
+        return None
+
+    def _now(self):
+        return self.clock
+
+    def add_simulated_pipeline(self, pipeline, runtime):
+        """Add pipeline to the job list, to finish runtime seconds after
+        it is started."""
+        self._runtimes[pipeline] = runtime
+        self.add_pipeline(pipeline)
+
+    def _start_pipeline(self, pipeline, nodes_assigned):
+        with self.pipelines_lock:
+            pipeline.start_time = self.clock
+            pipeline.nodes_assigned = list(nodes_assigned)
+            self._running_pipelines.add(pipeline)
+        end_time = self.clock + self._runtimes[pipeline]
+        heapq.heappush(self._events, (end_time, len(self.results), pipeline))
+        self.results.append(dict(id=pipeline.id,
+                                 nodes=pipeline.get_nodes_used(),
+                                 wait=self.clock,
+                                 runtime=self._runtimes[pipeline]))
+
+    def _finish_simulated_pipeline(self, pipeline):
+        self._runtime_history[pipeline.iteration_key] = \
+            self.clock - pipeline.start_time
+        with self.free_cv:
+            self.node_pool.release(pipeline.release_all_nodes())
+            self._nodes_changed()
+        with self.pipelines_lock:
+            self._running_pipelines.remove(pipeline)
+
+    def simulate(self):
+        """Run until the job list is empty, or no more pipelines can be
+        started before the deadline. Returns the makespan."""
+        while True:
+            with self.free_cv:
+                while len(self.job_list) > 0:
+                    pipeline = self._pop_job()
+                    if pipeline is None:
+                        break
+                    nodes_assigned = self._allocate_nodes(pipeline)
+                    self._start_pipeline(pipeline, nodes_assigned)
+            if not self._events:
+                break
+            end_time, _, pipeline = heapq.heappop(self._events)
+            self._busy_node_seconds += ((end_time - self.clock)
+                                        * (self.max_nodes - self.free_nodes))
+            self.clock = end_time
+            self._finish_simulated_pipeline(pipeline)
+        return self.clock
+
+    def get_summary(self):
+        makespan = self.clock
+        node_seconds = self.max_nodes * makespan
+        waits = sorted(r['wait'] for r in self.results)
+        summary = dict(makespan=makespan,
+                       max_nodes=self.max_nodes,
+                       node_seconds_busy=self._busy_node_seconds,
+                       utilization=(self._busy_node_seconds / node_seconds
+                                    if node_seconds > 0 else None),
+                       pipelines_started=len(self.results),
+                       pipelines_not_started=(len(self._runtimes)
+                                              - len(self.results)),
+                       wait_mean=(sum(waits) / len(waits) if waits else None),
+                       wait_p50=_percentile(waits, 50),
+                       wait_max=waits[-1] if waits else None)
+        if self.deadline is not None:
+            summary['pipelines_late'] = sum(
+                1 for r in self.results
+                if r['wait'] + r['runtime'] > self.deadline)
+        return summary
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * p / 100.0))]
+
+
+def get_simulated_runtime(pipeline, default_runtime=None):
+    """Runtime to simulate for pipeline, or None if it is unknown."""
+    runtime = pipeline.get_previous_runtime()
+    if runtime is None:
+        runtime = pipeline.runtime_estimate
+    if runtime is None:
+        runtime = default_runtime
+    return runtime
+
+
+def simulate_policy(fobs_path, policy_name, max_nodes, processes_per_node,
+                    machine_name=None, deadline=None, default_runtime=None,
+                    include_pipelines=True):
+    """Replay the pipelines in fobs_path with the named policy, and return
+    a dict with the results."""
+    sim = None
+    unknown = 0
+    for data in iter_pipeline_data(fobs_path):
+        pipeline = Pipeline.from_data(data)
+        if sim is None:
+            sim = SimulatedRunner(max_nodes,
+                                  machine_name or pipeline.machine_name
+                                  or 'local',
+                                  processes_per_node,
+                                  scheduler_policy=get_policy(policy_name),
+                                  deadline=deadline)
+        runtime = get_simulated_runtime(pipeline, default_runtime)
+        if runtime is None:
+            unknown += 1
+            continue
+        sim.add_simulated_pipeline(pipeline, runtime)
+    if sim is None:
+        raise ValueError('no pipelines in %s' % fobs_path)
+    sim.simulate()
+    result = dict(policy=policy_name, pipelines_unknown=unknown)
+    result.update(sim.get_summary())
+    if include_pipelines:
+        result['pipelines'] = sim.results
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay a sweep group with different scheduling '
+                    'policies, using the runtimes of a previous attempt')
+    parser.add_argument('fobs_path',
+                        help='fobs.json of the group; the walltime files '
+                             'are read from the run directories')
+    parser.add_argument('--max-nodes', type=int, required=True)
+    parser.add_argument('--processes-per-node', type=int, required=True)
+    parser.add_argument('--machine-name',
+                        help='Default is the machine_name of the pipelines')
+    parser.add_argument('--policy', choices=POLICY_NAMES, action='append',
+                        help='Policy to simulate, can be repeated (default: '
+                             'all policies)')
+    parser.add_argument('--walltime', type=float,
+                        help='Seconds in the allocation. Pipelines that are '
+                             'not expected to finish in time are not '
+                             'started')
+    parser.add_argument('--default-runtime', type=float,
+                        help='Runtime of pipelines without walltime files '
+                             'or runtime estimate. By default they are '
+                             'left out')
+    parser.add_argument('--summary-only', action='store_true',
+                        help='Leave out the per-pipeline waits')
+    args = parser.parse_args()
+
+    results = []
+    for policy_name in args.policy or POLICY_NAMES:
+        results.append(simulate_policy(
+            args.fobs_path, policy_name, args.max_nodes,
+            args.processes_per_node, args.machine_name, args.walltime,
+            args.default_runtime, not args.summary_only))
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 """
 Class for maintaining state of all FOB runs that the workflow consumer is
-managing. State is saved in a JSON file, overwritten on each state change.
+managing.
+
+State is kept as a JSON snapshot plus an append-only journal. Each state
+change appends a single JSON line to the journal, and the snapshot is only
+rewritten (atomically, via a temp file and rename) when the journal has grown
+larger than the snapshot. This keeps the cost of each state change constant
+on average, instead of rewriting the whole file for every change. Readers
+should use load_workflow_status, which replays the journal on top of the
+snapshot to get the current logical state.
 """
 
 import json
@@ -19,30 +27,137 @@ REASON_FAILED = 'failed'
 REASON_SUCCEEDED = 'succeeded'
 REASON_EXCEPTION = 'exception'
 REASON_NOFIT = 'nofit'
+REASON_NOTIME = 'notime'
+
+JOURNAL_SUFFIX = '.journal'
+
+# Don't bother compacting tiny journals, the snapshot is cheap to read and
+# the journal is cheap to replay.
+COMPACT_MIN_RECORDS = 1000
+
+
+def journal_path(file_path):
+    return file_path + JOURNAL_SUFFIX
+
+
+def status_exists(file_path):
+    """True if there is any saved status, either as a snapshot or as a
+    journal that has not yet been compacted."""
+    return (os.path.isfile(file_path)
+            or os.path.isfile(journal_path(file_path)))
+
+
+def load_workflow_status(file_path):
+    """Get the current state of all pipelines as a dict, mapping pipeline id
+    to state data. Reads the snapshot in file_path (if it exists) and replays
+    the journal on top of it. A truncated last line in the journal, e.g. if
+    the workflow was killed during a write, is ignored."""
+    state = {}
+    if os.path.isfile(file_path):
+        with open(file_path) as f:
+            state = json.load(f)
+    jpath = journal_path(file_path)
+    if os.path.isfile(jpath):
+        with open(jpath) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                state[record.pop('id')] = record
+    return state
+
+
+def has_not_started(file_path):
+    """True if any pipeline in the saved status has not been started, used
+    by the group submit scripts to skip groups with no work left."""
+    return any(data.get('state') == NOT_STARTED
+               for data in load_workflow_status(file_path).values())
 
 
 class WorkflowStatus(threading.Thread):
-    def __init__(self, file_path):
+    def __init__(self, file_path, compact_min_records=COMPACT_MIN_RECORDS):
         threading.Thread.__init__(self, name='Thread-status-0')
         self.file_path = file_path
+        self.journal_path = journal_path(file_path)
+        self.compact_min_records = compact_min_records
         self._lock = threading.Lock()
         self._state = defaultdict(dict)
+        self._journal = None
+        self._journal_records = 0
 
-        # If status file exists from a previous run, load it first, so that
-        # you dont overwrite it only with runs from this job
-        if os.path.isfile(file_path):
-            with open(file_path, 'r') as f:
-                self._state = json.load(f)
+        # If status exists from a previous run, load it first, so that
+        # you dont overwrite it only with runs from this job. Fold any
+        # journal left behind by a killed job into a fresh snapshot.
+        if status_exists(file_path):
+            self._state.update(load_workflow_status(file_path))
+        with self._lock:
+            self._compact()
 
     def set_state(self, pipeline_state):
         with self._lock:
-            self._state[pipeline_state.id] = pipeline_state.as_data()
-            self._save()
+            data = pipeline_state.as_data()
+            self._state[pipeline_state.id] = data
+            self._append(pipeline_state.id, data)
+            if self._journal_records > max(self.compact_min_records,
+                                           len(self._state)):
+                self._compact()
+
+    def get_state(self, pipeline_id):
+        """Get state data for the specified pipeline, or None if the pipeline
+        is not known."""
+        with self._lock:
+            data = self._state.get(pipeline_id)
+            if data is None:
+                return None
+            return dict(data)
+
+    def close(self):
+        """Write a final snapshot and remove the journal. Safe to call more
+        than once."""
+        with self._lock:
+            self._compact()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def _append(self, pipeline_id, data):
+        """Append a state change to the journal. Must be called with lock
+        acquired!"""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        record = dict(data)
+        record['id'] = pipeline_id
+        self._journal.write(json.dumps(record, separators=(',', ':')))
+        self._journal.write('\n')
+        self._journal.flush()
+        self._journal_records += 1
+
+    def _compact(self):
+        """Atomically replace the snapshot with the current state and start
+        a new journal. Must be called with lock acquired!
 
-    def _save(self):
-        """Save state to file_path. Must be called with lock acquired!"""
-        with open(self.file_path, 'w') as f:
-            json.dump(self._state, f, indent=2)
+        If the job dies between the rename and the truncate, the old journal
+        is replayed on top of the new snapshot, which is harmless since
+        replaying it produces the same state."""
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            # One pipeline per line keeps the file readable and grep-able
+            # without paying for the pure python indenting encoder.
+            f.write('{\n')
+            f.write(',\n'.join('%s: %s' % (json.dumps(k), json.dumps(v))
+                               for k, v in self._state.items()))
+            f.write('\n}\n')
+        os.replace(tmp_path, self.file_path)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w')
+        self._journal_records = 0
 
 
 class PipelineState(object):
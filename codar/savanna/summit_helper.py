@@ -1,6 +1,8 @@
-from codar.savanna.machines import SummitNode
+import functools
 import math
 
+from codar.savanna.machines import SummitNode
+
 
 def get_nodes_reqd(res_set, nrs):
     """Get the no. of nodes that will be required based on the resource set
@@ -22,43 +24,109 @@ def create_erf_file(run):
 
 
 def _create_erf_file_res_set(run, nodes_assigned, res_set):
-    pass
+    """Write the ERF for a run laid out with resource sets, packed onto
+    each node in order, so the ranks of resource set k get the cores and
+    gpus following those of resource set k-1."""
+    _write_erf_file(run.erf_file, run.exe, run.args,
+                    _get_rank_block(_res_set_key(res_set),
+                                    tuple(nodes_assigned), run.nprocs))
 
 
 def _create_erf_file_node_config(erf_file_path, run_exe, run_args,
                                  nprocs, num_nodes_reqd, nodes_assigned,
                                  node_config):
-    str = _get_first_erf_block(run_exe, run_args)
-    for i in range(num_nodes_reqd):
-        next_host = nodes_assigned[i]
-        rank_offset = i * node_config.num_ranks_per_node
-        for j in range(node_config.num_ranks_per_node):
-            rank_id = rank_offset+j
-            str += '\nrank: {}: {{ host: {}; cpu: '.format(rank_id,
-                                                           next_host)
-            for index, core_id in enumerate(node_config.cpu[j]):
-                if index > 0:
-                    str += ', '
-                str += "{{{}-{}}}".format(core_id*4, core_id*4+3)
-
-            if len(node_config.gpu[j]) > 0:
-                str += " ; gpu: {"
-
-            for gpu_id in node_config.gpu[j]:
-                str += "{},".format(gpu_id)
-
-            # Remove the last comma
-            str = str[:-1]
-            str += "}"
-
-            str += " } : app 0"
-            if rank_id == nprocs-1:
-                break
-
-    # jsrun fails without this line break
-    str += "\n"
+    _write_erf_file(erf_file_path, run_exe, run_args,
+                    _get_rank_block(_node_config_key(node_config),
+                                    tuple(nodes_assigned[:num_nodes_reqd]),
+                                    nprocs))
+
+
+def _write_erf_file(erf_file_path, run_exe, run_args, rank_block):
+    # jsrun fails without the final line break
     with open(erf_file_path, 'w') as f:
-        f.write(str)
+        f.write(_get_first_erf_block(run_exe, run_args))
+        f.write(rank_block)
+        f.write("\n")
+
+
+def _node_config_key(node_config):
+    """Hashable form of a NodeConfig, used as the rank template cache key.
+    """
+    return ('node_config',
+            tuple(tuple(cores) for cores in
+                  node_config.cpu[:node_config.num_ranks_per_node]),
+            tuple(tuple(gpus) for gpus in
+                  node_config.gpu[:node_config.num_ranks_per_node]))
+
+
+def _res_set_key(res_set):
+    """Hashable form of a ResourceSet, with the cores and gpus of each rank
+    on a node, so it can share the rank template code with NodeConfig."""
+    total_cpus = res_set.rs_per_host * res_set.cpus_per_rs
+    total_gpus = res_set.rs_per_host * res_set.gpus_per_rs
+    node = SummitNode()
+    if total_cpus > len(node.cpu) or total_gpus > len(node.gpu):
+        raise ValueError(
+            "resource set layout needs {} cpus and {} gpus per node, "
+            "node has {} and {}".format(total_cpus, total_gpus,
+                                        len(node.cpu), len(node.gpu)))
+
+    cpus = []
+    gpus = []
+    # If the cores of a resource set can't be split evenly between its
+    # tasks, every task may use all of them.
+    split = res_set.cpus_per_rs % res_set.tasks_per_rs == 0
+    cpus_per_task = res_set.cpus_per_rs // res_set.tasks_per_rs
+    for k in range(res_set.rs_per_host):
+        rs_cpus = range(k * res_set.cpus_per_rs,
+                        (k + 1) * res_set.cpus_per_rs)
+        rs_gpus = tuple(range(k * res_set.gpus_per_rs,
+                              (k + 1) * res_set.gpus_per_rs))
+        for t in range(res_set.tasks_per_rs):
+            if split:
+                cpus.append(tuple(rs_cpus[t * cpus_per_task:
+                                          (t + 1) * cpus_per_task]))
+            else:
+                cpus.append(tuple(rs_cpus))
+            gpus.append(rs_gpus)
+    return ('res_set', tuple(cpus), tuple(gpus))
+
+
+def _compile_rank_template(layout_key):
+    """Get the resources part of the ERF rank line for each rank on a
+    node, e.g. 'cpu: {0-3}, {4-7} ; gpu: {0,1}'."""
+    _, cpus, gpus = layout_key
+    template = []
+    for rank_cpus, rank_gpus in zip(cpus, gpus):
+        line = 'cpu: ' + ', '.join('{%d-%d}' % (core_id*4, core_id*4+3)
+                                   for core_id in rank_cpus)
+        if rank_gpus:
+            line += ' ; gpu: {' + ','.join(str(gpu_id)
+                                           for gpu_id in rank_gpus) + '}'
+        template.append(line)
+    return template
+
+
+@functools.lru_cache(maxsize=256)
+def _get_rank_block(layout_key, hosts, nprocs):
+    """Get the rank lines of the ERF for nprocs ranks of the layout,
+    placed on hosts in order. Runs of a campaign mostly share a few layouts
+    and node lists, so the result is cached."""
+    template = _compile_rank_template(layout_key)
+    if not template:
+        raise ValueError('layout has no ranks')
+    ranks_per_node = len(template)
+    lines = []
+    for rank_id in range(nprocs):
+        node_index, local_rank = divmod(rank_id, ranks_per_node)
+        if node_index >= len(hosts):
+            raise ValueError(
+                'layout with {} ranks per node needs more than the {} nodes '
+                'assigned for {} ranks'.format(ranks_per_node, len(hosts),
+                                               nprocs))
+        lines.append('\nrank: {}: {{ host: {}; {} }} : app 0'.format(
+            rank_id, hosts[node_index], template[local_rank]))
+    return ''.join(lines)
 
 
 def _get_first_erf_block(run_exe, run_args):
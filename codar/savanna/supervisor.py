@@ -0,0 +1,537 @@
+"""
+Single event loop that supervises every child process started by the
+workflow.
+
+Each Run used to be its own thread, blocking in Popen.wait and sleeping in
+a process group poll loop, with extra threads for kills. With thousands of
+concurrent runs that means thousands of OS threads. The ProcessSupervisor
+replaces all of them with one thread that:
+
+ - detects child exit, using a pidfd registered with a selector when the
+   platform supports it (Linux >= 5.3, python >= 3.9), falling back to
+   polling with waitpid every poll_interval seconds otherwise,
+ - fires timers (run timeouts, kill grace periods, process group checks)
+   from a heap,
+ - runs callbacks submitted from other threads with call_soon.
+
+Once a group leader has been reaped, GroupWait checks for the rest of its
+process group, which are not children of the workflow and can't be waited
+on directly, starting a few milliseconds after the exit so a group that
+exits with its leader is finished right away.
+
+Exited children are reaped with os.wait4, and the resource usage of the
+process and the descendants it waited for is attached to the Popen object
+as proc.usage (see get_usage).
+
+All Run and Pipeline state transitions happen on the supervisor thread, so
+callbacks must not block.
+
+AsyncioSupervisor provides the same interface on top of an asyncio event
+loop, for the asyncio engine, where the loop thread plays the role of the
+supervisor thread.
+"""
+
+import os
+import sys
+import asyncio
+import heapq
+import itertools
+import logging
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+POLL_INTERVAL = 0.1
+
+# Delay before the first and the maximum delay between later checks for
+# the rest of a process group, see GroupWait.
+GROUP_CHECK_MIN = 0.01
+GROUP_CHECK_MAX = 1
+
+# A /proc scan for live processes is shared by the group checks done
+# within this many seconds of it, see _group_has_live_process.
+GROUP_SCAN_MAX_AGE = 0.1
+
+# Keys of proc.usage, CPU times are in seconds.
+USAGE_KEYS = ['utime', 'stime', 'maxrss_kb', 'nvcsw', 'nivcsw',
+              'read_bytes', 'write_bytes']
+
+_log = logging.getLogger('codar.savanna.supervisor')
+
+
+class Timer(object):
+    """Handle returned by call_later, pass to cancel to prevent it from
+    firing."""
+    def __init__(self, when, fn, args):
+        self.when = when
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+
+class ProcessSupervisor(threading.Thread):
+    """Watch child processes and fire timers from a single thread. The
+    spawn, call_soon, call_later, cancel and signal_group methods are thread
+    safe. Callbacks are always executed on the supervisor thread."""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        threading.Thread.__init__(self, name='Thread-supervisor-0')
+        # Does not own any state that needs cleanup, the consumer waits
+        # for all runs to complete before stopping the supervisor.
+        self.daemon = True
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._ready = deque()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._polled = {}
+        self._stopping = False
+        self._closed = False
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the supervisor thread, after any callbacks that
+        are already pending."""
+        with self._lock:
+            self._ready.append((fn, args))
+        self._wakeup()
+
+    def call_later(self, delay, fn, *args):
+        """Run fn(*args) on the supervisor thread after delay seconds.
+        Returns a Timer which can be passed to cancel."""
+        timer = Timer(time.monotonic() + delay, fn, args)
+        with self._lock:
+            heapq.heappush(self._timers,
+                           (timer.when, next(self._timer_seq), timer))
+        self._wakeup()
+        return timer
+
+    def cancel(self, timer):
+        # Lazy deletion, cancelled timers are dropped when they reach
+        # the top of the heap.
+        timer.cancelled = True
+
+    def spawn(self, args, env, cwd, stdout_path, stderr_path,
+              on_start, on_exit, on_error):
+        """Launch a process as the leader of a new process group, with
+        output redirected to the specified paths, or to file descriptors
+        from an OutputSink, which are closed once the process is created.
+        on_start(proc) is called once the process has been created,
+        possibly before this returns, and on_exit(proc) is called on the
+        supervisor thread after it has been reaped (returncode is set). If
+        the process can't be created, on_error(exception) is called on the
+        supervisor thread instead. The callbacks must not assume they are
+        called with any of the caller's locks held."""
+        try:
+            with _open_output(stdout_path) as out, \
+                    _open_output(stderr_path) as err:
+                proc = subprocess.Popen(args, env=env, cwd=cwd,
+                                        stdout=out, stderr=err,
+                                        preexec_fn=os.setpgrp)
+        except Exception as e:
+            self.call_soon(on_error, e)
+            return
+        on_start(proc)
+        self.call_soon(self._watch, proc, on_exit)
+
+    def signal_group(self, proc, signum):
+        """Send signum to the process group lead by proc. Returns False if
+        the group no longer exists. Signal 0 can be used to check for
+        existence, and also returns False if the group only has exited
+        processes that have not been reaped yet."""
+        return _signal_group(proc.pid, signum)
+
+    def stop(self):
+        """Exit the loop once no processes are being watched and there are
+        no pending callbacks. Outstanding timers are discarded."""
+        with self._lock:
+            self._stopping = True
+        self._wakeup()
+
+    def run(self):
+        try:
+            self._loop()
+        finally:
+            with self._lock:
+                self._closed = True
+                self._selector.close()
+                os.close(self._wake_r)
+                os.close(self._wake_w)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if (self._stopping and not self._ready and not self._polled
+                        and len(self._selector.get_map()) == 1):
+                    return
+                timeout = self._get_timeout()
+
+            for key, mask in self._selector.select(timeout):
+                if key.fd == self._wake_r:
+                    self._drain_wakeup()
+                    continue
+                self._selector.unregister(key.fd)
+                os.close(key.fd)
+                proc, on_exit = key.data
+                if not _reap(proc):
+                    # reaped elsewhere or a spurious wakeup, fall back to
+                    # polling so the exit is not lost
+                    self._polled[proc.pid] = key.data
+                else:
+                    self._call(on_exit, (proc,))
+
+            for pid, (proc, on_exit) in list(self._polled.items()):
+                if _reap(proc):
+                    del self._polled[pid]
+                    self._call(on_exit, (proc,))
+
+            self._run_timers()
+
+            with self._lock:
+                ready = self._ready
+                self._ready = deque()
+            for fn, args in ready:
+                self._call(fn, args)
+
+    def _get_timeout(self):
+        """Seconds until the next event that requires waking up, or None
+        to wait indefinitely. Must be called with lock acquired!"""
+        if self._ready:
+            return 0
+        timeout = None
+        if self._timers:
+            timeout = max(0, self._timers[0][0] - time.monotonic())
+        if self._polled:
+            if timeout is None or timeout > self.poll_interval:
+                timeout = self.poll_interval
+        return timeout
+
+    def _run_timers(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2])
+        for timer in due:
+            if not timer.cancelled:
+                self._call(timer.fn, timer.args)
+
+    def _watch(self, proc, on_exit):
+        if hasattr(os, 'pidfd_open'):
+            try:
+                fd = os.pidfd_open(proc.pid)
+            except OSError:
+                # not supported by the running kernel
+                pass
+            else:
+                self._selector.register(fd, selectors.EVENT_READ,
+                                        (proc, on_exit))
+                return
+        self._polled[proc.pid] = (proc, on_exit)
+
+    def _call(self, fn, args):
+        try:
+            fn(*args)
+        except:
+            # Don't let a bad callback take down the loop, which would
+            # leave every other run unsupervised.
+            _log.exception('exception in supervisor callback %r', fn)
+
+    def _wakeup(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                os.write(self._wake_w, b'\0')
+            except BlockingIOError:
+                # pipe is full, so a wakeup is already pending
+                pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class GroupWait(object):
+    """Wait until the process group lead by proc no longer exists, after
+    the leader has been reaped, then call on_done(gone) on the supervisor
+    thread, with gone False if the group was still there after give_up
+    seconds. The group is checked immediately, then with exponential back
+    off from GROUP_CHECK_MIN to GROUP_CHECK_MAX seconds. If it is still
+    there after kill_wait seconds, every check sends SIGKILL. Works with
+    any supervisor, since it only uses signal_group and call_later.
+    Inspired by proctrack_pgid plugin from slurm."""
+
+    def __init__(self, supervisor, proc, on_done, kill_wait, give_up,
+                 log_prefix=None):
+        self.supervisor = supervisor
+        self.proc = proc
+        self.on_done = on_done
+        self.kill_wait = kill_wait
+        self.give_up = give_up
+        self.log_prefix = log_prefix or str(proc.pid)
+        self._start = None
+        self._delay = GROUP_CHECK_MIN
+        self._signum = 0
+
+    def start(self):
+        self._start = time.monotonic()
+        self._check()
+
+    def _check(self):
+        if self._signum != 0:
+            self.supervisor.signal_group(self.proc, self._signum)
+        # 0 is the null signal, does error checking only, and doesn't count
+        # exited processes that are waiting to be reaped
+        if not self.supervisor.signal_group(self.proc, 0):
+            # pgroup no longer exists, we are done waiting
+            self.on_done(True)
+            return
+        waited = time.monotonic() - self._start
+        if waited >= self.give_up:
+            _log.error('%s pgroup did not exit', self.log_prefix)
+            self.on_done(False)
+            return
+        if waited >= self.kill_wait and self._signum == 0:
+            self._signum = signal.SIGKILL
+            _log.warning('%s pgroup still exists after %.1fs, sending KILL',
+                         self.log_prefix, waited)
+        delay = min(self._delay, self.give_up - waited)
+        if self._signum == 0:
+            delay = min(delay, max(0, self.kill_wait - waited))
+        self._delay = min(self._delay * 2, GROUP_CHECK_MAX)
+        self.supervisor.call_later(delay, self._check)
+
+
+def _open_output(path):
+    """Open an output path for a child process. A file descriptor, e.g.
+    the write end of a pipe from an OutputSink, is used as is, and closed
+    with the returned file."""
+    if isinstance(path, int):
+        return os.fdopen(path, 'wb')
+    return open(path, 'w')
+
+
+def _signal_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:
+        return False
+    if signum != 0:
+        # /proc is only scanned for existence checks, see GroupWait
+        return True
+    return _group_has_live_process(pgid)
+
+
+class _GroupScan(object):
+    """Process groups with a process that has not exited, from one scan of
+    /proc, shared by the checks of all groups. Exited processes stay in
+    their group until reaped, which for orphans is done by init, and some
+    container inits only reap every few seconds, so killpg alone can't
+    tell if a group is done.
+
+    A group found live in a scan up to GROUP_SCAN_MAX_AGE seconds old is
+    reported live, which at worst delays the next check of GroupWait. A
+    group missing from an old scan may have been created since, so it is
+    only reported gone by a fresh scan. A group without live processes
+    can't get new ones, so each group costs at most one scan of its own,
+    at its end."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._time = None
+        self._live = None
+
+    def has_live_process(self, pgid):
+        """Returns True if /proc can't be read."""
+        with self._lock:
+            now = time.monotonic()
+            if (self._time is not None and self._live is not None
+                    and now - self._time <= GROUP_SCAN_MAX_AGE
+                    and pgid in self._live):
+                return True
+            self._live = _scan_live_groups()
+            self._time = now
+            return self._live is None or pgid in self._live
+
+
+def _scan_live_groups():
+    """Get the set of process group ids with a process that has not
+    exited, or None if /proc can't be read."""
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return None
+    live = set()
+    for pid in pids:
+        try:
+            with open('/proc/%s/stat' % pid, 'rb') as f:
+                data = f.read()
+        except OSError:
+            # exited since listdir
+            continue
+        # state and pgid are fields 3 and 5, after the parenthesized comm
+        fields = data[data.rfind(b')') + 2:].split()
+        try:
+            if fields[0] not in (b'Z', b'X'):
+                live.add(int(fields[2]))
+        except (IndexError, ValueError):
+            continue
+    return live
+
+
+_group_scan = _GroupScan()
+
+
+def _group_has_live_process(pgid):
+    return _group_scan.has_live_process(pgid)
+
+
+def get_usage(rusage, io=None):
+    """Get a dict with USAGE_KEYS from the rusage of a reaped process, and
+    the read_bytes and write_bytes from its /proc/<pid>/io, if available.
+    """
+    usage = dict(utime=rusage.ru_utime, stime=rusage.ru_stime,
+                 maxrss_kb=rusage.ru_maxrss, nvcsw=rusage.ru_nvcsw,
+                 nivcsw=rusage.ru_nivcsw, read_bytes=None, write_bytes=None)
+    if io is not None:
+        usage['read_bytes'] = io.get('read_bytes')
+        usage['write_bytes'] = io.get('write_bytes')
+    return usage
+
+
+def _read_proc_io(pid):
+    """Parse /proc/<pid>/io, or return None if it can't be read (not
+    Linux, or no permission)."""
+    try:
+        with open('/proc/%d/io' % pid) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    io = {}
+    for line in lines:
+        k, _, v = line.partition(':')
+        io[k.strip()] = int(v)
+    return io
+
+
+def _reap(proc):
+    """Reap proc if it has exited, setting returncode and usage. Returns
+    False if it is still running."""
+    if proc.returncode is not None:
+        return True
+    try:
+        # Wait without reaping, so the exited process's I/O counters can
+        # still be read from /proc.
+        if os.waitid(os.P_PID, proc.pid,
+                     os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+            return False
+        io = _read_proc_io(proc.pid)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # reaped elsewhere, no usage available
+        return proc.poll() is not None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    proc.usage = get_usage(rusage, io)
+    return True
+
+
+def new_event_loop():
+    """Create an event loop for the asyncio engine. On python < 3.12 the
+    default child watcher uses a thread per process, so use the pidfd
+    watcher when the platform supports it (3.12 does this by default)."""
+    loop = asyncio.new_event_loop()
+    if sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher'):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            # not supported by the running kernel
+            pass
+        else:
+            watcher = asyncio.PidfdChildWatcher()
+            asyncio.set_child_watcher(watcher)
+            watcher.attach_loop(loop)
+    return loop
+
+
+class AsyncioSupervisor(object):
+    """Supervisor interface implemented with coroutines on an asyncio event
+    loop, using asyncio.create_subprocess_exec to launch processes and the
+    loop's timers for timeouts. call_soon and signal_group are thread safe,
+    call_later and cancel must be called on the loop thread, which is where
+    all callbacks are executed. Processes are reaped by the loop's child
+    watcher, so proc.usage is not available."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._tasks = set()
+
+    def call_soon(self, fn, *args):
+        self.loop.call_soon_threadsafe(self._call, fn, args)
+
+    def call_later(self, delay, fn, *args):
+        return self.loop.call_later(delay, self._call, fn, args)
+
+    def cancel(self, timer):
+        timer.cancel()
+
+    def spawn(self, args, env, cwd, stdout_path, stderr_path,
+              on_start, on_exit, on_error):
+        """See ProcessSupervisor.spawn. The process is created by a task
+        on the loop, so on_start is always called after this returns."""
+        task = self.loop.create_task(self._spawn(args, env, cwd, stdout_path,
+                                                 stderr_path, on_start,
+                                                 on_exit, on_error))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _spawn(self, args, env, cwd, stdout_path, stderr_path,
+                     on_start, on_exit, on_error):
+        try:
+            with _open_output(stdout_path) as out, \
+                    _open_output(stderr_path) as err:
+                proc = await asyncio.create_subprocess_exec(
+                                        *args, env=env, cwd=cwd,
+                                        stdout=out, stderr=err,
+                                        preexec_fn=os.setpgrp)
+        except Exception as e:
+            self._call(on_error, (e,))
+            return
+        self._call(on_start, (proc,))
+        await proc.wait()
+        self._call(on_exit, (proc,))
+
+    def signal_group(self, proc, signum):
+        """See ProcessSupervisor.signal_group."""
+        return _signal_group(proc.pid, signum)
+
+    def stop(self):
+        # Nothing to do, the loop is owned by the caller. Use wait_closed
+        # to wait for processes that are still being watched.
+        pass
+
+    async def wait_closed(self):
+        """Wait until no processes are being watched."""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def _call(self, fn, args):
+        try:
+            fn(*args)
+        except:
+            _log.exception('exception in supervisor callback %r', fn)
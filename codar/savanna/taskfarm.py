@@ -0,0 +1,506 @@
+"""
+Task farm execution mode, for groups with many small pipelines.
+
+Normally every Run is its own job launcher invocation (mpiexec, srun,
+aprun), and for runs of a few processes, launcher startup and job step
+creation can take longer than the run itself. In task farm mode, a single
+launcher invocation at the start of the job starts one long lived worker
+process per node, and runs that fit on a single node are sent to the
+worker on their assigned node, which starts them as local processes.
+
+The TaskFarm lives in the workflow process. It provides the supervisor
+interface for each node (see NodeSupervisor), so Run and Pipeline work the
+same way as without the farm: output still goes to the per-run stdout and
+stderr files, and the return and walltime files are written by the Run
+when the worker reports that the process group has exited. Timers and
+callbacks are delegated to the workflow's supervisor.
+
+Workers connect back to the workflow process over TCP and exchange JSON
+messages, one per line. Worker rank i runs the tasks for relative node
+name str(i + 1), the naming used by the consumer's NodePool.
+"""
+
+import os
+import sys
+import json
+import socket
+import selectors
+import itertools
+import threading
+import binascii
+import signal
+import logging
+
+from codar.savanna.model import KILL_WAIT, WAIT_DELAY_GIVE_UP
+from codar.savanna.supervisor import ProcessSupervisor, GroupWait
+
+
+TOKEN_VAR = 'CODAR_TASK_FARM_TOKEN'
+
+# Environment variables set by common launchers and MPI implementations
+# with the rank of the process, checked in order.
+RANK_VARS = ['CODAR_TASK_FARM_RANK', 'PMIX_RANK', 'PMI_RANK',
+             'OMPI_COMM_WORLD_RANK', 'SLURM_PROCID', 'ALPS_APP_PE']
+
+WORKER_STDOUT_NAME = 'codar.workflow.taskfarm.stdout'
+WORKER_STDERR_NAME = 'codar.workflow.taskfarm.stderr'
+
+# Return code reported for tasks that were running on a worker that exited
+# or lost its connection.
+LOST_RETURNCODE = -signal.SIGKILL
+
+_log = logging.getLogger('codar.savanna.taskfarm')
+
+
+class TaskProcess(object):
+    """Stands in for the Popen object of a process started by a worker.
+    pid is the pid on the worker's node."""
+    def __init__(self, task_id, worker):
+        self.task_id = task_id
+        self.worker = worker
+        self.pid = None
+        self.returncode = None
+        self.usage = None
+
+
+class NodeSupervisor(object):
+    """Supervisor interface for running processes on a single node of the
+    task farm. Timers and callbacks use the workflow's supervisor.
+    kill_wait is the grace period of the run, used by the worker when the
+    process group outlives its leader."""
+
+    def __init__(self, farm, node_name, kill_wait=KILL_WAIT):
+        self.farm = farm
+        self.node_name = node_name
+        self.kill_wait = kill_wait
+        self.supervisor = farm.supervisor
+
+    def call_soon(self, fn, *args):
+        self.supervisor.call_soon(fn, *args)
+
+    def call_later(self, delay, fn, *args):
+        return self.supervisor.call_later(delay, fn, *args)
+
+    def cancel(self, timer):
+        self.supervisor.cancel(timer)
+
+    def spawn(self, args, env, cwd, stdout_path, stderr_path,
+              on_start, on_exit, on_error):
+        self.farm.spawn(self.node_name, args, env, cwd, stdout_path,
+                        stderr_path, on_start, on_exit, on_error,
+                        self.kill_wait)
+
+    def signal_group(self, proc, signum):
+        return self.farm.signal_task(proc, signum)
+
+
+class _Worker(object):
+    """Workflow side state of a worker. Messages sent before the worker
+    connects are queued."""
+    def __init__(self, rank):
+        self.rank = rank
+        self.conn = None
+        self.lost = False
+        self.pending = []
+        self.tasks = {}
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        """Returns False if the worker is gone."""
+        data = (json.dumps(msg) + '\n').encode('utf-8')
+        with self.lock:
+            if self.lost:
+                return False
+            if self.conn is None:
+                self.pending.append(data)
+                return True
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                # handled when the read side sees the connection close
+                pass
+            return True
+
+
+class TaskFarm(threading.Thread):
+    """Start a worker on each node of the allocation and run tasks on them.
+    runner is the job launcher used to start the workers, one per node, or
+    None to start them as local processes. task_runner is used to wrap the
+    command of each task on its node, e.g. a node local mpiexec for runs
+    with more than one process, or None to run the executable directly, in
+    which case only single process runs are accepted."""
+
+    def __init__(self, supervisor, runner, nodes, task_runner=None,
+                 working_dir=None):
+        threading.Thread.__init__(self, name='Thread-taskfarm-0')
+        # The supervisor waits for the workers to exit, nothing to clean
+        # up here.
+        self.daemon = True
+        self.supervisor = supervisor
+        self.runner = runner
+        self.nodes = nodes
+        self.task_runner = task_runner
+        self.working_dir = working_dir or os.getcwd()
+        self._token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self._workers = [_Worker(rank) for rank in range(nodes)]
+        self._task_seq = itertools.count()
+        self._stopping = False
+        self._launchers = []
+
+        # Workers started by the runner connect from the compute nodes, to
+        # the address of this host; local workers use the loopback
+        # address. Other interfaces are not listened on.
+        if runner is None:
+            host = '127.0.0.1'
+        else:
+            host = socket.gethostbyname(socket.gethostname())
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind((host, 0))
+        self._listener.listen(128)
+        self.address = self._listener.getsockname()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._connections = {}
+
+    def accepts(self, run):
+        """True if run can be started by the task farm: it must fit on a
+        single node, and be able to run without the job launcher."""
+        if run.runner_override or run.nodes != 1 or not run.nodes_assigned:
+            return False
+        if run.machine is not None and run.machine.name.lower() == 'summit':
+            return False
+        return run.nprocs == 1 or self.task_runner is not None
+
+    def assign(self, run):
+        """Make run start on the worker of its node if accepted. Returns
+        True if the run will be started by the task farm."""
+        if not self.accepts(run):
+            return False
+        run.runner = self.task_runner
+        run.supervisor = NodeSupervisor(self, run.nodes_assigned[0],
+                                        run.kill_wait)
+        # the process group is on the worker's node, and the worker writes
+        # its output to files
+        run.sampler = None
+        run.output_sink = None
+        return True
+
+    def start_workers(self):
+        """Start the worker processes, through the supervisor so they are
+        reaped and waited for like any other process. Tasks sent before a
+        worker connects are queued. Raises ValueError if the runner can't
+        start one worker per node."""
+        worker_args = ['-m', 'codar.savanna.taskfarm',
+                       self.address[0], str(self.address[1])]
+        launch_args = None
+        if self.runner is not None:
+            try:
+                launch_args = self.runner.wrap_per_node(
+                                sys.executable, worker_args, self.nodes)
+            except ValueError:
+                self._selector.close()
+                self._listener.close()
+                raise
+        self.start()
+        env = os.environ.copy()
+        env[TOKEN_VAR] = self._token
+        # Make sure the worker can import this package, even if it is not
+        # installed.
+        package_root = os.path.dirname(os.path.dirname(os.path.dirname(
+                                            os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join(
+            p for p in [package_root, env.get('PYTHONPATH')] if p)
+        stdout_path = os.path.join(self.working_dir, WORKER_STDOUT_NAME)
+        stderr_path = os.path.join(self.working_dir, WORKER_STDERR_NAME)
+        if launch_args is None:
+            for rank in range(self.nodes):
+                rank_env = dict(env)
+                rank_env['CODAR_TASK_FARM_RANK'] = str(rank)
+                self._spawn_launcher([sys.executable] + worker_args,
+                                     rank_env,
+                                     stdout_path + '.%d' % rank,
+                                     stderr_path + '.%d' % rank)
+        else:
+            self._spawn_launcher(launch_args, env, stdout_path, stderr_path)
+        _log.info('task farm listening on %s:%d, %d workers',
+                  self.address[0], self.address[1], self.nodes)
+
+    def _spawn_launcher(self, args, env, stdout_path, stderr_path):
+        self.supervisor.spawn(args, env, self.working_dir,
+                              stdout_path, stderr_path,
+                              self._launchers.append,
+                              self._launcher_exited,
+                              self._launcher_error)
+
+    def _launcher_exited(self, proc):
+        if not self._stopping:
+            _log.error('task farm worker launcher exited with %d',
+                       proc.returncode)
+        self._fail_unconnected()
+
+    def _launcher_error(self, exc):
+        _log.error('task farm workers could not be started: %s', exc)
+        self._fail_unconnected()
+
+    def _fail_unconnected(self):
+        # Workers that never connected will never run their queued tasks.
+        # Connected workers are handled when their connection closes.
+        for worker in self._workers:
+            with worker.lock:
+                if worker.conn is not None or worker.lost:
+                    continue
+                worker.lost = True
+                worker.pending = []
+            self._worker_lost(worker)
+
+    def spawn(self, node_name, args, env, cwd, stdout_path, stderr_path,
+              on_start, on_exit, on_error, kill_wait=KILL_WAIT):
+        """See ProcessSupervisor.spawn. The process is started by the worker
+        of the node with relative name node_name, which kills what is left
+        of its process group kill_wait seconds after it exits."""
+        worker = self._workers[int(node_name) - 1]
+        task_id = next(self._task_seq)
+        proc = TaskProcess(task_id, worker)
+        with worker.lock:
+            worker.tasks[task_id] = (proc, on_start, on_exit, on_error)
+        msg = dict(op='spawn', task=task_id, args=args, env=env, cwd=cwd,
+                   stdout=stdout_path, stderr=stderr_path,
+                   kill_wait=kill_wait)
+        if not worker.send(msg):
+            with worker.lock:
+                del worker.tasks[task_id]
+            self.supervisor.call_soon(on_error, OSError(
+                'task farm worker for node %s is not running' % node_name))
+
+    def signal_task(self, proc, signum):
+        """See ProcessSupervisor.signal_group. Workers report tasks as
+        exited once the whole process group is gone, so the group exists
+        until then."""
+        if proc.returncode is not None:
+            return False
+        if signum != 0:
+            proc.worker.send(dict(op='signal', task=proc.task_id,
+                                  signum=int(signum)))
+        return True
+
+    def stop(self):
+        """Tell the workers to exit. Their launchers are waited for by the
+        supervisor."""
+        self._stopping = True
+        for worker in self._workers:
+            worker.send(dict(op='exit'))
+
+    def run(self):
+        try:
+            self._loop()
+        finally:
+            self._selector.close()
+            self._listener.close()
+
+    def _loop(self):
+        while True:
+            if self._stopping and not self._connections:
+                return
+            for key, mask in self._selector.select(1.0):
+                if key.fileobj is self._listener:
+                    conn, addr = self._listener.accept()
+                    self._connections[conn] = [None, b'']
+                    self._selector.register(conn, selectors.EVENT_READ)
+                else:
+                    self._read(key.fileobj)
+
+    def _read(self, conn):
+        worker, buf = self._connections[conn]
+        try:
+            data = conn.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        buf += data
+        lines = buf.split(b'\n')
+        self._connections[conn][1] = lines.pop()
+        for line in lines:
+            try:
+                msg = json.loads(line.decode('utf-8'))
+            except ValueError:
+                _log.error('bad task farm message: %r', line)
+                continue
+            if worker is None:
+                worker = self._hello(conn, msg)
+                if worker is None:
+                    return
+            else:
+                self._handle(worker, msg)
+
+    def _hello(self, conn, msg):
+        rank = msg.get('rank')
+        if (msg.get('op') != 'hello' or msg.get('token') != self._token
+                or not isinstance(rank, int)
+                or not 0 <= rank < len(self._workers)):
+            _log.error('rejecting task farm connection: %r', msg)
+            self._close(conn)
+            return None
+        worker = self._workers[rank]
+        with worker.lock:
+            if worker.conn is not None or worker.lost:
+                _log.error('duplicate task farm worker rank %d', rank)
+                self._close(conn)
+                return None
+            worker.conn = conn
+            pending = worker.pending
+            worker.pending = []
+            for data in pending:
+                conn.sendall(data)
+        self._connections[conn][0] = worker
+        _log.debug('task farm worker %d connected from %s', rank,
+                   msg.get('host'))
+        return worker
+
+    def _handle(self, worker, msg):
+        op = msg.get('op')
+        with worker.lock:
+            task = worker.tasks.get(msg.get('task'))
+            if task is not None and op in ('exited', 'error'):
+                del worker.tasks[msg['task']]
+        if task is None:
+            return
+        proc, on_start, on_exit, on_error = task
+        if op == 'started':
+            proc.pid = msg['pid']
+            self.supervisor.call_soon(on_start, proc)
+        elif op == 'exited':
+            proc.returncode = msg['returncode']
+            proc.usage = msg.get('usage')
+            self.supervisor.call_soon(on_exit, proc)
+        elif op == 'error':
+            self.supervisor.call_soon(on_error, OSError(msg['error']))
+
+    def _close(self, conn):
+        self._selector.unregister(conn)
+        worker = self._connections.pop(conn)[0]
+        conn.close()
+        if worker is None:
+            return
+        with worker.lock:
+            worker.lost = True
+            worker.conn = None
+        if not self._stopping:
+            _log.error('task farm worker %d disconnected', worker.rank)
+        self._worker_lost(worker)
+
+    def _worker_lost(self, worker):
+        with worker.lock:
+            tasks = list(worker.tasks.values())
+            worker.tasks.clear()
+        for proc, on_start, on_exit, on_error in tasks:
+            if proc.pid is None:
+                self.supervisor.call_soon(on_error, OSError(
+                    'task farm worker %d exited' % worker.rank))
+            else:
+                proc.returncode = LOST_RETURNCODE
+                self.supervisor.call_soon(on_exit, proc)
+
+
+def get_rank():
+    for var in RANK_VARS:
+        value = os.environ.get(var)
+        if value:
+            return int(value)
+    raise ValueError('rank not found in environment, checked %s'
+                     % ', '.join(RANK_VARS))
+
+
+class TaskWorker(object):
+    """Worker side of the task farm. Starts tasks as local processes, each
+    the leader of a new process group, and reports when the group has
+    exited, using the same back off and kill policy as Run."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.supervisor = ProcessSupervisor()
+        self._send_lock = threading.Lock()
+        self._tasks = {}
+
+    def send(self, msg):
+        data = (json.dumps(msg) + '\n').encode('utf-8')
+        with self._send_lock:
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                # the workflow is gone, tasks are killed on exit
+                pass
+
+    def run(self, rank, token):
+        self.supervisor.start()
+        self.send(dict(op='hello', rank=rank, token=token,
+                       host=socket.gethostname()))
+        try:
+            for line in self.sock.makefile('rb'):
+                msg = json.loads(line.decode('utf-8'))
+                op = msg['op']
+                if op == 'spawn':
+                    self.supervisor.call_soon(self._spawn, msg)
+                elif op == 'signal':
+                    self.supervisor.call_soon(self._signal, msg['task'],
+                                              msg['signum'])
+                elif op == 'exit':
+                    break
+        finally:
+            self.supervisor.call_soon(self._kill_all)
+            self.supervisor.stop()
+            self.supervisor.join()
+            self.sock.close()
+
+    def _spawn(self, msg):
+        task_id = msg['task']
+
+        def on_start(proc):
+            self._tasks[task_id] = proc
+            self.send(dict(op='started', task=task_id, pid=proc.pid))
+
+        def on_error(exc):
+            self.send(dict(op='error', task=task_id,
+                           error='%s: %s' % (type(exc).__name__, exc)))
+
+        kill_wait = msg.get('kill_wait', KILL_WAIT)
+        self.supervisor.spawn(msg['args'], msg['env'], msg['cwd'],
+                              msg['stdout'], msg['stderr'], on_start,
+                              lambda proc: self._pgroup_wait(task_id,
+                                                             kill_wait),
+                              on_error)
+
+    def _pgroup_wait(self, task_id, kill_wait):
+        """Report the task as exited once its process group no longer
+        exists, see GroupWait."""
+        proc = self._tasks[task_id]
+
+        def on_done(gone):
+            del self._tasks[task_id]
+            self.send(dict(op='exited', task=task_id,
+                           returncode=proc.returncode,
+                           usage=getattr(proc, 'usage', None)))
+
+        GroupWait(self.supervisor, proc, on_done, kill_wait,
+                  WAIT_DELAY_GIVE_UP, 'task %d' % task_id).start()
+
+    def _signal(self, task_id, signum):
+        proc = self._tasks.get(task_id)
+        if proc is not None:
+            self.supervisor.signal_group(proc, signum)
+
+    def _kill_all(self):
+        for proc in self._tasks.values():
+            self.supervisor.signal_group(proc, signal.SIGKILL)
+
+
+def worker_main(host, port):
+    rank = get_rank()
+    sock = socket.create_connection((host, int(port)))
+    TaskWorker(sock).run(rank, os.environ.get(TOKEN_VAR))
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    worker_main(*sys.argv[1:3])
@@ -0,0 +1,181 @@
+"""
+Timeline of a workflow in Chrome trace event format, for viewing in
+chrome://tracing or https://ui.perfetto.dev.
+
+Each node of the allocation is a process track named "node <name>". Thread
+0 of a node shows the pipeline holding it, from when the nodes are taken
+until they are released, so idle gaps and fragmentation are visible. Thread
+i+1 shows run i of the pipeline on that node, split in phases:
+
+ - prep: creating the ERF file and the runner arguments
+ - spawn: creating the process
+ - running: until the group leader exits, or until it is sent a kill
+   signal if it was killed
+ - kill: from the first kill signal until the group leader exits
+ - teardown: waiting for the rest of the process group
+
+The "pipelines" process track has an async span for the time each
+pipeline waits in the job list, and for its post process script.
+
+The file is written as events happen, so the closing bracket is missing
+until the workflow finishes. Trace viewers accept that, so a running or
+killed workflow's trace can still be loaded.
+"""
+
+import json
+import time
+import threading
+
+
+PIPELINES_PID = 0
+
+
+class TraceWriter(object):
+    """Write trace events for the consumer. All methods are thread
+    safe."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._file = open(file_path, 'w')
+        self._file.write('[\n')
+        self._first = True
+        self._node_pids = {}
+        self._node_holds = {}
+        self._thread_names = {}
+        self._write(dict(ph='M', name='process_name', pid=PIPELINES_PID,
+                         tid=0, args=dict(name='pipelines')))
+
+    def pipeline_queued(self, pipeline):
+        self._async(pipeline, 'b', 'queued', 'queue')
+
+    def pipeline_dropped(self, pipeline, reason):
+        """Pipeline removed from the job list without being started."""
+        self._async(pipeline, 'e', 'queued', 'queue', dict(reason=reason))
+
+    def nodes_taken(self, pipeline, nodes):
+        self._async(pipeline, 'e', 'queued', 'queue')
+        now = time.time()
+        with self._lock:
+            for name in nodes:
+                self._node_holds[name] = (pipeline.id, now)
+
+    def nodes_released(self, nodes):
+        now = time.time()
+        with self._lock:
+            for name in nodes:
+                hold = self._node_holds.pop(name, None)
+                if hold is None:
+                    continue
+                pipe_id, start = hold
+                self._span(self._get_node_pid(name), 0, pipe_id, 'pipeline',
+                           start, now)
+
+    def pipeline_finished(self, pipeline):
+        """Write the phases of each run, on every node it used."""
+        with self._lock:
+            for index, run in enumerate(pipeline.runs):
+                if not run.nodes_assigned:
+                    continue
+                phases = self._get_run_phases(run)
+                for name in run.nodes_assigned:
+                    pid = self._get_node_pid(name)
+                    self._thread_name(pid, index + 1, run.name)
+                    for phase, start, end in phases:
+                        self._span(pid, index + 1, phase, 'run', start, end,
+                                   dict(pipeline=pipeline.id))
+
+    def post_process_finished(self, pipeline, start, end):
+        with self._lock:
+            for ph, ts in (('b', start), ('e', end)):
+                self._write(dict(ph=ph, name='post-process',
+                                 cat='post-process', id=str(pipeline.id),
+                                 pid=PIPELINES_PID, tid=0,
+                                 ts=_micros(ts)))
+
+    def close(self):
+        """Finish the JSON array. Safe to call more than once."""
+        with self._lock:
+            if self._file is None:
+                return
+            now = time.time()
+            for name, (pipe_id, start) in self._node_holds.items():
+                self._span(self._get_node_pid(name), 0, pipe_id,
+                           'pipeline', start, now)
+            self._node_holds.clear()
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _get_run_phases(run):
+        t = run.get_phase_times()
+        phases = []
+        if t['launch'] is not None and t['spawn'] is not None:
+            phases.append(('prep', t['launch'], t['spawn']))
+        if t['spawn'] is not None and t['started'] is not None:
+            phases.append(('spawn', t['spawn'], t['started']))
+        if t['started'] is not None:
+            exited = t['exited'] or t['end']
+            kill = t['kill']
+            if kill is not None and exited is not None and kill < exited:
+                phases.append(('running', t['started'], kill))
+                phases.append(('kill', kill, exited))
+            elif exited is not None:
+                phases.append(('running', t['started'], exited))
+        if t['exited'] is not None and t['end'] is not None:
+            phases.append(('teardown', t['exited'], t['end']))
+        return phases
+
+    def _async(self, pipeline, ph, name, cat, args=None):
+        event = dict(ph=ph, name=name, cat=cat, id=str(pipeline.id),
+                     pid=PIPELINES_PID, tid=0, ts=_micros(time.time()))
+        if ph == 'b':
+            event['args'] = dict(pipeline=pipeline.id)
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._write(event)
+
+    def _get_node_pid(self, name):
+        """Must be called with lock acquired!"""
+        pid = self._node_pids.get(name)
+        if pid is None:
+            pid = len(self._node_pids) + 1
+            self._node_pids[name] = pid
+            self._write(dict(ph='M', name='process_name', pid=pid, tid=0,
+                             args=dict(name='node %s' % name)))
+            self._write(dict(ph='M', name='process_sort_index', pid=pid,
+                             tid=0, args=dict(sort_index=pid)))
+            self._thread_name(pid, 0, 'pipeline')
+        return pid
+
+    def _thread_name(self, pid, tid, name):
+        """Must be called with lock acquired!"""
+        if self._thread_names.get((pid, tid)) == name:
+            return
+        self._thread_names[(pid, tid)] = name
+        self._write(dict(ph='M', name='thread_name', pid=pid, tid=tid,
+                         args=dict(name=name)))
+
+    def _span(self, pid, tid, name, cat, start, end, args=None):
+        """Must be called with lock acquired!"""
+        event = dict(ph='X', name=name, cat=cat, pid=pid, tid=tid,
+                     ts=_micros(start), dur=_micros(max(0, end - start)))
+        if args:
+            event['args'] = args
+        self._write(event)
+
+    def _write(self, event):
+        """Must be called with lock acquired!"""
+        if self._file is None:
+            return
+        if not self._first:
+            self._file.write(',\n')
+        self._first = False
+        self._file.write(json.dumps(event, separators=(',', ':')))
+        self._file.flush()
+
+
+def _micros(seconds):
+    return int(seconds * 1000000)
@@ -0,0 +1,12 @@
+
+export CODAR_CHEETAH_EXPERIMENT_DIR="/root/package/test_output/nose/test_cheetah/test_model/test_error_campaign_missing_adios_xml/root"
+export CODAR_CHEETAH_MACHINE_CONFIG="/root/package/codar/cheetah/data/machine_config/titan/submit-env.sh"
+export CODAR_CHEETAH_APP_CONFIG=""
+export CODAR_WORKFLOW_SCRIPT="/root/package/codar/savanna/main.py"
+export CODAR_WORKFLOW_RUNNER="aprun"
+export CODAR_CHEETAH_WORKFLOW_LOG_LEVEL="DEBUG"
+export CODAR_WORKFLOW_SCHEDULER_POLICY="greedy"
+export CODAR_WORKFLOW_OUTPUT="files"
+export CODAR_WORKFLOW_MAX_POST_PROCESSES="0"
+export CODAR_CHEETAH_UMASK=""
+export CODAR_PYTHON="/root/.pyenv/versions/3.11.7/bin/python"
@@ -0,0 +1,2 @@
+#!/bin/sh
+case "$PWD" in */run-3.*) exit 1;; esac
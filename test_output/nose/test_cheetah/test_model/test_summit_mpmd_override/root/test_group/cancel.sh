@@ -0,0 +1,4 @@
+#!/bin/bash
+
+cd $(dirname $0)
+bkill $(cat codar.cheetah.jobid.txt | cut -d: -f2)
@@ -0,0 +1 @@
+export CODAR_PYTHON="/root/.pyenv/versions/3.11.7/bin/python"
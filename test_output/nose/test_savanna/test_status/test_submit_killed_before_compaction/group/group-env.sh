@@ -0,0 +1 @@
+export CODAR_CHEETAH_GROUP_WALLTIME=60
@@ -0,0 +1,59 @@
+#!/bin/bash
+
+cd "$(dirname $0)"
+source ../campaign-env.sh
+source group-env.sh
+
+if [ -f "$CODAR_CHEETAH_MACHINE_CONFIG" ]; then
+    source "$CODAR_CHEETAH_MACHINE_CONFIG"
+fi
+
+# Don't submit job if all experiments have been run. The status journal
+# must be replayed, the snapshot is stale if the last job was killed.
+if [ -f codar.workflow.status.json ]; then
+    "$CODAR_PYTHON" -c 'import sys
+from codar.savanna.status import has_not_started
+sys.exit(0 if has_not_started(sys.argv[1]) else 3)' codar.workflow.status.json
+    if [ $? == 3 ]; then
+        echo "No more experiments remaining. Skipping group .."
+        exit
+    fi
+fi
+
+# convert walltime from seconds to HH:MM:SS format needed by PBS
+
+secs=$CODAR_CHEETAH_GROUP_WALLTIME
+SLURM_WALLTIME=$(printf '%02d:%02d:%02d\n' $(($secs/3600)) $(($secs%3600/60)) $(($secs%60)))
+
+extra_args=""
+if [ -n "$CODAR_CHEETAH_SCHEDULER_ACCOUNT" ]; then
+    extra_args="--account $CODAR_CHEETAH_SCHEDULER_ACCOUNT"
+fi
+
+if [ -n "$CODAR_CHEETAH_SCHEDULER_CONSTRAINT" ]; then
+    extra_args="$extra_args --constraint=$CODAR_CHEETAH_SCHEDULER_CONSTRAINT"
+fi
+
+if [ -n "$CODAR_CHEETAH_SCHEDULER_LICENSE" ]; then
+    extra_args="$extra_args --license=$CODAR_CHEETAH_SCHEDULER_LICENSE"
+fi
+
+OUTPUT=$(sbatch --parsable \
+        --partition=$CODAR_CHEETAH_SCHEDULER_QUEUE \
+        --job-name="$CODAR_CHEETAH_CAMPAIGN_NAME-$CODAR_CHEETAH_GROUP_NAME" \
+        --nodes=$CODAR_CHEETAH_GROUP_NODES \
+        --time=$SLURM_WALLTIME \
+        $extra_args \
+        run-group.sbatch)
+
+rval=$?
+
+if [ $rval != 0 ]; then
+    echo "SUBMIT FAILED:"
+    echo $OUTPUT
+    exit $rval
+fi
+
+JOBID=$OUTPUT
+
+echo "SLURM:$JOBID" > codar.cheetah.jobid.txt
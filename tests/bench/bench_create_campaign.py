@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark creating the run directories of a campaign with different numbers
+of workers (cheetah create-campaign --jobs). The synthetic campaign has one
+group with nruns runs of two codes in component subdirectories, a few small
+input files copied to every run, a key value config file edited per run,
+and optionally a run directory setup script. For each size and worker
+count, reports the seconds taken, runs per second and the speedup over a
+single worker.
+
+The speedup comes from overlapping the latency of file system operations
+and setup scripts, so it depends on the file system more than on the
+number of CPUs. On a local disk or tmpfs each operation is fast and the
+workers mostly contend for the interpreter lock; use --output-dir on the
+parallel file system, or --setup-sleep to emulate a slow setup script.
+
+Usage: bench_create_campaign.py [--workers N ...] [--no-setup-script]
+                                [--setup-sleep SECONDS] [--output-dir DIR]
+                                [nruns ...] > results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+from codar.cheetah.model import Campaign
+from codar.cheetah.parameters import (SweepGroup, Sweep, ParamCmdLineArg,
+                                      ParamKeyValue)
+
+
+def _make_app_dir(work_dir, setup_script, setup_sleep):
+    app_dir = os.path.join(work_dir, 'app')
+    os.makedirs(app_dir)
+    inputs = []
+    for i in range(4):
+        path = os.path.join(app_dir, 'input-%d.dat' % i)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 4096)
+        inputs.append(path)
+    with open(os.path.join(app_dir, 'sim.cfg'), 'w') as f:
+        f.write('steps=10\nsize=64\n')
+    inputs.append(os.path.join(app_dir, 'sim.cfg'))
+    setup_path = None
+    if setup_script:
+        setup_path = os.path.join(app_dir, 'setup.sh')
+        with open(setup_path, 'w') as f:
+            f.write('#!/bin/sh\nsleep %s\necho setup > setup.out\n'
+                    % setup_sleep)
+        os.chmod(setup_path, 0o755)
+    return app_dir, inputs, setup_path
+
+
+def _campaign_class(nruns, inputs, setup_path):
+    class BenchCampaign(Campaign):
+        name = 'bench'
+        supported_machines = ['local']
+        codes = [('sim', dict(exe='sim')), ('analysis', dict(exe='analysis'))]
+        run_dir_setup_script = setup_path
+        sweeps = [
+            SweepGroup(name='group', nodes=2, component_subdirs=True,
+                       parameter_groups=[
+              Sweep([ParamCmdLineArg('sim', 'arg', 1,
+                                     [str(i) for i in range(nruns)]),
+                     ParamKeyValue('sim', 'steps', 'sim.cfg', 'steps',
+                                   ['20']),
+                     ParamCmdLineArg('analysis', 'arg', 1, ['a'])])
+            ])
+        ]
+    BenchCampaign.inputs = inputs
+    return BenchCampaign
+
+
+def bench(nruns, workers, args, work_dir):
+    app_dir, inputs, setup_path = _make_app_dir(
+        os.path.join(work_dir, 'app-%d-%d' % (nruns, workers)),
+        not args.no_setup_script, args.setup_sleep)
+    campaign = _campaign_class(nruns, inputs, setup_path)('local', app_dir)
+    out_dir = os.path.join(work_dir, 'campaign-%d-%d' % (nruns, workers))
+    start = time.perf_counter()
+    campaign.make_experiment_run_dir(out_dir, _check_code_paths=False,
+                                     workers=workers)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return dict(nruns=nruns, workers=workers, seconds=elapsed,
+                runs_per_second=nruns / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark parallel campaign creation')
+    parser.add_argument('--workers', type=int, action='append',
+                        help='Worker count, can be repeated (default: 1, '
+                             '4, 16)')
+    parser.add_argument('--no-setup-script', action='store_true')
+    parser.add_argument('--setup-sleep', type=float, default=0,
+                        help='Seconds the run directory setup script '
+                             'sleeps (default: %(default)s)')
+    parser.add_argument('--output-dir',
+                        help='Where to create the campaigns, e.g. on the '
+                             'parallel file system (default: a temporary '
+                             'directory)')
+    parser.add_argument('sizes', type=int, nargs='*', default=[1000])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='codar-bench-create-',
+                                dir=args.output_dir)
+    results = []
+    try:
+        for n in args.sizes:
+            baseline = None
+            for workers in args.workers or [1, 4, 16]:
+                result = bench(n, workers, args, work_dir)
+                if baseline is None:
+                    baseline = result['seconds']
+                result['speedup'] = baseline / result['seconds']
+                results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
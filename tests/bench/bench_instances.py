@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of sweep instances during campaign creation, without
+touching the file system. The synthetic sweep has 8 parameters of the types
+used by the launcher (runner, command line args and options, key value,
+env var) over two codes, and one derived parameter. For each size,
+reports:
+
+ - usec_per_instance: time to generate an instance and make the calls
+   Run and the launcher make for every run (argv, nprocs, hostfile, sched
+   opts, the four get_parameter_values_by_type calls and as_dict)
+ - bytes_per_instance: traced memory per instance, with all instances
+   alive at once
+
+Usage: bench_instances.py [ninstances ...] > results.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+from codar.cheetah.parameters import Sweep, ParamRunner, ParamCmdLineArg, \
+    ParamCmdLineOption, ParamKeyValue, ParamEnvVar, ParamAdiosXML, \
+    ParamADIOS2XML, ParamConfig
+
+
+def _make_sweep(n):
+    # about n points in the cross product
+    sizes = [str(i) for i in range(max(1, n // 64))]
+    return Sweep([
+        ParamRunner('sim', 'nprocs', [1, 2, 4, 8]),
+        ParamCmdLineArg('sim', 'size', 1, sizes),
+        ParamCmdLineOption('sim', 'steps', '--steps', [10, 20]),
+        ParamKeyValue('sim', 'cfg', 'sim.cfg', 'mode', ['a', 'b']),
+        ParamEnvVar('sim', 'omp', 'OMP_NUM_THREADS', [1, 2]),
+        ParamRunner('analysis', 'nprocs', [1, 2]),
+        ParamCmdLineArg('analysis', 'in', 1, ['sim.bp']),
+        ParamCmdLineArg('analysis', 'size', 2,
+                        lambda d: int(d['sim']['size']) * 2),
+    ])
+
+
+def _use(inst):
+    inst.get_codes_argv()
+    for target in ('sim', 'analysis'):
+        inst.get_nprocs(target)
+        inst.get_hostfile(target)
+        inst.get_sched_opts(target)
+    (inst.get_parameter_values_by_type(ParamAdiosXML)
+     or inst.get_parameter_values_by_type(ParamADIOS2XML))
+    inst.get_parameter_values_by_type(ParamConfig)
+    inst.get_parameter_values_by_type(ParamKeyValue)
+    inst.get_parameter_values_by_type(ParamEnvVar)
+    inst.as_dict()
+
+
+def bench(n):
+    sweep = _make_sweep(n)
+    start = time.perf_counter()
+    count = 0
+    for inst in sweep.iter_instances():
+        _use(inst)
+        count += 1
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = list(sweep.iter_instances())
+    for inst in instances:
+        _use(inst)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del instances
+    return dict(ninstances=count, usec_per_instance=elapsed / count * 1e6,
+                bytes_per_instance=used / count)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark sweep instances')
+    parser.add_argument('sizes', type=int, nargs='*', default=[10000])
+    args = parser.parse_args()
+    results = [bench(n) for n in args.sizes]
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Benchmark how fast the Savanna consumer can launch and retire pipelines,
+using the local machine with no runner and a no-op executable, so it can be
+run on a laptop. For each pipeline count, reports:
+
+ - pipelines_per_second: pipelines started and retired per second, from
+   the start of run_pipelines until all are done
+ - start_latency_p50/p99_ms: time from nodes being freed by a finished
+   pipeline until the next queued pipeline is started on them
+ - status_write_usec_per_pipeline: time spent writing the status file,
+   per pipeline, and status_write_fraction of the total time
+ - queued_bytes_per_pipeline: growth of the process RSS per pipeline
+   waiting in the job list, before any are started
+
+All pipelines are added before the consumer starts, so the job list is
+never empty and the scheduler is never waiting on the producer. With
+--deadline, the consumer has a deadline that many seconds after the start
+and every pipeline has a runtime estimate of one second, so the check for
+pipelines that can't finish in time is done on every start.
+
+Usage: bench_savanna.py [--max-nodes N] [--exe PATH] [--engine ENGINE]
+                        [--no-status] [--deadline SECONDS]
+                        [npipelines ...] > results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import asyncio
+
+from codar.savanna.consumer import PipelineRunner, AsyncPipelineRunner
+from codar.savanna.model import Pipeline
+from codar.savanna.supervisor import new_event_loop
+
+
+class _LatencyMixin(object):
+    """Record the time from nodes being freed to the next pipeline start,
+    and the time spent writing status."""
+
+    def _init_bench(self):
+        self.start_latencies = []
+        self.status_seconds = 0.0
+        self._freed_time = None
+        if self._status is not None:
+            set_state = self._status.set_state
+
+            def timed_set_state(state):
+                start = time.perf_counter()
+                set_state(state)
+                self.status_seconds += time.perf_counter() - start
+
+            self._status.set_state = timed_set_state
+
+    def _nodes_changed(self, released=None):
+        PipelineRunner._nodes_changed(self, released)
+        if released and self._freed_time is None:
+            self._freed_time = time.perf_counter()
+
+    def _start_pipeline(self, pipeline, nodes_assigned):
+        PipelineRunner._start_pipeline(self, pipeline, nodes_assigned)
+        if self._freed_time is not None:
+            self.start_latencies.append(time.perf_counter()
+                                        - self._freed_time)
+            self._freed_time = None
+
+
+class BenchRunner(_LatencyMixin, PipelineRunner):
+    def __init__(self, *args, **kwargs):
+        PipelineRunner.__init__(self, *args, **kwargs)
+        self._init_bench()
+
+
+class AsyncBenchRunner(_LatencyMixin, AsyncPipelineRunner):
+    def __init__(self, *args, **kwargs):
+        AsyncPipelineRunner.__init__(self, *args, **kwargs)
+        self._init_bench()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        # max RSS, in kB on Linux but bytes on macOS; only a fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _pipeline(i, exe, work_dir, runtime_estimate):
+    # All pipelines share a working dir, and output goes to /dev/null, so
+    # the benchmark measures Savanna rather than the file system.
+    run = dict(name='bench', exe=exe, args=[], sched_args=None, nprocs=1,
+               working_dir=work_dir, stdout_path='/dev/null',
+               stderr_path='/dev/null')
+    return Pipeline.from_data(dict(id='bench-%d' % i, runs=[run],
+                                   working_dir=work_dir,
+                                   machine_name='local', total_nodes=1,
+                                   runtime_estimate=runtime_estimate))
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def bench(npipelines, args, work_dir):
+    status_file = None
+    if not args.no_status:
+        status_file = os.path.join(work_dir, 'status-%d.json' % npipelines)
+    deadline = None
+    runtime_estimate = None
+    if args.deadline is not None:
+        deadline = time.time() + args.deadline
+        runtime_estimate = 1
+    kwargs = dict(runner=None, max_nodes=args.max_nodes,
+                  machine_name='local', processes_per_node=1,
+                  status_file=status_file, deadline=deadline)
+    loop = None
+    if args.engine == 'asyncio':
+        loop = new_event_loop()
+        asyncio.set_event_loop(loop)
+        consumer = AsyncBenchRunner(loop=loop, **kwargs)
+    else:
+        consumer = BenchRunner(**kwargs)
+
+    rss_before = _rss_bytes()
+    for i in range(npipelines):
+        consumer.add_pipeline(_pipeline(i, args.exe, work_dir,
+                                        runtime_estimate))
+    rss_queued = _rss_bytes()
+    consumer.stop()
+
+    start = time.perf_counter()
+    if loop is not None:
+        try:
+            loop.run_until_complete(consumer.run_pipelines())
+        finally:
+            loop.close()
+    else:
+        consumer.run_pipelines()
+    elapsed = time.perf_counter() - start
+
+    latencies = consumer.start_latencies
+    return dict(npipelines=npipelines, engine=args.engine,
+                max_nodes=args.max_nodes, exe=args.exe,
+                status=status_file is not None,
+                deadline=args.deadline,
+                seconds=elapsed,
+                pipelines_per_second=npipelines / elapsed,
+                start_latency_p50_ms=_ms(_percentile(latencies, 50)),
+                start_latency_p99_ms=_ms(_percentile(latencies, 99)),
+                status_write_usec_per_pipeline=(consumer.status_seconds
+                                                / npipelines * 1e6),
+                status_write_fraction=consumer.status_seconds / elapsed,
+                queued_bytes_per_pipeline=((rss_queued - rss_before)
+                                           / npipelines))
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return seconds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark Savanna pipeline launch throughput')
+    parser.add_argument('--max-nodes', type=int, default=16)
+    parser.add_argument('--exe', default='/bin/true')
+    parser.add_argument('--engine', choices=['thread', 'asyncio'],
+                        default='thread')
+    parser.add_argument('--no-status', action='store_true')
+    parser.add_argument('--deadline', type=float, default=None)
+    parser.add_argument('sizes', type=int, nargs='*',
+                        default=[100, 10000, 100000])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='codar-bench-savanna-')
+    results = []
+    try:
+        for n in args.sizes:
+            results.append(bench(n, args, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of a pipeline state change in the workflow status file, as
+the number of pipelines in the group grows. Each pipeline goes through the
+same transitions as in a real workflow (not_started, running, done), and the
+mean cost per transition is reported for the journaled WorkflowStatus and for
+the old behavior of rewriting the whole JSON file on every change.
+
+The journaled cost should stay flat as the pipeline count grows, while the
+rewrite cost grows linearly.
+
+Usage: bench_status.py [npipelines ...] > results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+from codar.savanna import status
+from codar.savanna.status import WorkflowStatus, PipelineState
+
+
+class RewriteStatus(object):
+    """The old WorkflowStatus save strategy, kept here for comparison."""
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._state = {}
+
+    def set_state(self, pipeline_state):
+        self._state[pipeline_state.id] = pipeline_state.as_data()
+        with open(self.file_path, 'w') as f:
+            json.dump(self._state, f, indent=2)
+
+    def close(self):
+        pass
+
+
+def _transitions(npipelines):
+    for i in range(npipelines):
+        yield PipelineState('run-%d' % i, status.NOT_STARTED)
+    for i in range(npipelines):
+        yield PipelineState('run-%d' % i, status.RUNNING)
+        yield PipelineState('run-%d' % i, status.DONE,
+                            status.REASON_SUCCEEDED, dict(code=0))
+
+
+def bench(status_class, npipelines, work_dir):
+    path = os.path.join(work_dir, status_class.__name__ + '.json')
+    ws = status_class(path)
+    count = 0
+    start = time.perf_counter()
+    for state in _transitions(npipelines):
+        ws.set_state(state)
+        count += 1
+    ws.close()
+    elapsed = time.perf_counter() - start
+    return dict(backend=status_class.__name__, npipelines=npipelines,
+                transitions=count, seconds=elapsed,
+                usec_per_transition=elapsed / count * 1e6)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]
+    work_dir = tempfile.mkdtemp(prefix='codar-bench-status-')
+    results = []
+    try:
+        for n in sizes:
+            results.append(bench(WorkflowStatus, n, work_dir))
+            # the rewrite backend is quadratic, don't wait forever on it
+            if n <= 1000:
+                results.append(bench(RewriteStatus, n, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
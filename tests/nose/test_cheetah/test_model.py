@@ -2,15 +2,18 @@ import os.path
 import shutil
 import json
 import getpass
+import warnings
 
 from nose.tools import assert_equal
 
-from codar.cheetah import exc
+from codar.cheetah import exc, adios_params
+from codar.cheetah import adios2_interface as adios2
 from codar.cheetah.model import Campaign
 from codar.savanna.model import NodeLayout
+from codar.savanna.producer import iter_pipeline_data, index_path
 from codar.cheetah.parameters import SweepGroup, Sweep
 from codar.cheetah.parameters import ParamRunner, ParamCmdLineArg, \
-                                ParamAdiosXML
+                                ParamAdiosXML, ParamADIOS2XML
 
 from test_cheetah import TEST_OUTPUT_DIR
 
@@ -230,3 +233,264 @@ def test_error_missing_app_dir():
         assert 'does not exist' in str(e), str(e)
     else:
         assert False, 'error not raised on missing app dir'
+
+
+def test_ndjson_fobs_format():
+    class NDJSONCampaign(TestCampaign):
+        name = 'ndjson_fobs'
+        fobs_format = 'ndjson'
+
+    c = NDJSONCampaign('local', '/test')
+    out_dir = os.path.join(TEST_OUTPUT_DIR,
+                           'test_model', 'test_ndjson_fobs_format')
+    fob_path = os.path.join(out_dir, getpass.getuser(),
+                            'test_group', 'fobs.json')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    c.make_experiment_run_dir(out_dir, _check_code_paths=False)
+
+    with open(fob_path) as f:
+        fobs = [json.loads(line) for line in f]
+    assert_equal(len(fobs), 2)
+    assert_equal(fobs, list(iter_pipeline_data(fob_path)))
+    assert os.path.isfile(index_path(fob_path))
+
+
+def test_parallel_create():
+    out_base = os.path.join(TEST_OUTPUT_DIR, 'test_model',
+                            'test_parallel_create')
+    shutil.rmtree(out_base, ignore_errors=True)
+    os.makedirs(out_base)
+    # fails in one run directory
+    setup_path = os.path.join(out_base, 'setup.sh')
+    with open(setup_path, 'w') as f:
+        f.write('#!/bin/sh\ncase "$PWD" in */run-3.*) exit 1;; esac\n')
+    os.chmod(setup_path, 0o755)
+
+    class ParallelCampaign(TestCampaign):
+        name = 'parallel_create'
+        sweeps = [
+            SweepGroup(name='test_group', nodes=1, parameter_groups=[
+              Sweep([ParamCmdLineArg('test', 'arg', 1,
+                                     [str(i) for i in range(20)])])
+            ])
+        ]
+
+    fobs = {}
+    for workers in [1, 4]:
+        c = ParallelCampaign('local', '/test')
+        out_dir = os.path.join(out_base, str(workers))
+        c.make_experiment_run_dir(out_dir, _check_code_paths=False,
+                                  workers=workers)
+        fob_path = os.path.join(out_dir, getpass.getuser(), 'test_group',
+                                'fobs.json')
+        with open(fob_path) as f:
+            fobs[workers] = f.read().replace(out_dir, '')
+    assert_equal(fobs[4], fobs[1])
+
+    class FailingCampaign(ParallelCampaign):
+        run_dir_setup_script = setup_path
+
+    # errors are reported the same way with or without workers, and no
+    # partial fobs file is left behind
+    for workers in [1, 4]:
+        c = FailingCampaign('local', '/test')
+        out_dir = os.path.join(out_base, 'fail-%d' % workers)
+        try:
+            c.make_experiment_run_dir(out_dir, _check_code_paths=False,
+                                      workers=workers)
+        except exc.CheetahException as e:
+            assert 'failed to create 1 run directories' in str(e), str(e)
+            assert 'run-3.iteration-0' in str(e), str(e)
+        else:
+            assert False, 'expected CheetahException'
+        fob_path = os.path.join(out_dir, getpass.getuser(), 'test_group',
+                                'fobs.json')
+        assert not os.path.exists(fob_path), fob_path
+        params_path = os.path.join(out_dir, getpass.getuser(), 'params.json')
+        assert not os.path.exists(params_path), params_path
+
+
+def test_walltime_warning():
+    class TimeoutCampaign(TestCampaign):
+        name = 'walltime_warning'
+        sweeps = [
+            SweepGroup(name='test_group', nodes=1, walltime=600,
+                       per_run_timeout=100, run_repetitions=1,
+                       parameter_groups=[
+              Sweep([ParamCmdLineArg('test', 'arg', 1, ['a', 'b', 'c'])])
+            ])
+        ]
+
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'test_model',
+                           'test_walltime_warning')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    c = TimeoutCampaign('local', '/test')
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        c.make_experiment_run_dir(out_dir, _check_code_paths=False)
+    # 6 runs, counted as they are created
+    messages = [str(warning.message) for warning in w]
+    assert any('+ 60 = 660' in m for m in messages), messages
+    with open(os.path.join(out_dir, getpass.getuser(), 'params.json')) as f:
+        assert_equal(len(json.load(f)), 6)
+
+
+def test_streaming_create():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'test_model',
+                           'test_streaming_create')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    shutil.rmtree(out_dir + '-low', ignore_errors=True)
+
+    class StreamingCampaign(TestCampaign):
+        name = 'streaming_create'
+        sweeps = [
+            SweepGroup(name='test_group', nodes=3, run_repetitions=1,
+                       parameter_groups=[
+              Sweep([ParamCmdLineArg('test', 'arg', 1, ['a', 'b', 'c']),
+                     ParamRunner('test', 'nprocs', [1, 2])]),
+              Sweep([ParamCmdLineArg('test', 'arg', 1, ['d']),
+                     ParamRunner('test', 'nprocs', [3])])
+            ])
+        ]
+
+    c = StreamingCampaign('local', '/test')
+    c.make_experiment_run_dir(out_dir, _check_code_paths=False)
+    user_dir = os.path.join(out_dir, getpass.getuser())
+    group_dir = os.path.join(user_dir, 'test_group')
+
+    # the files are the same as json.dumps of the whole list
+    with open(os.path.join(user_dir, 'params.json')) as f:
+        params_text = f.read()
+    params = json.loads(params_text)
+    assert_equal(params_text, json.dumps(params, indent=2))
+    assert_equal(len(params), 14)
+    assert_equal([p['test']['arg'] for p in params[:7]],
+                 ['a', 'a', 'b', 'b', 'c', 'c', 'd'])
+    with open(os.path.join(group_dir, 'fobs.json')) as f:
+        fobs_text = f.read()
+    fobs = json.loads(fobs_text)
+    assert_equal(fobs_text, json.dumps(fobs, sort_keys=True, indent=4))
+    assert_equal([fob['id'] for fob in fobs[6:8]],
+                 ['run-6.iteration-0', 'run-0.iteration-1'])
+
+    with open(os.path.join(group_dir, 'group-env.sh')) as f:
+        assert 'CODAR_CHEETAH_GROUP_MAX_PROCS="3"' in f.read()
+
+    class LowProcsCampaign(StreamingCampaign):
+        sweeps = [
+            SweepGroup(name='test_group', nodes=3, max_procs=2,
+                       parameter_groups=StreamingCampaign.sweeps[0]
+                                                       .parameter_groups)
+        ]
+
+    c = LowProcsCampaign('local', '/test')
+    try:
+        c.make_experiment_run_dir(out_dir + '-low', _check_code_paths=False)
+    except exc.CheetahException as e:
+        assert 'max_procs for group is too low' in str(e), str(e)
+    else:
+        assert False, 'expected CheetahException'
+
+
+ADIOS2_XML = """<?xml version="1.0"?>
+<adios-config>
+  <io name="SimulationOutput">
+    <engine type="SST">
+      <parameter key="QueueLimit" value="15"/>
+    </engine>
+  </io>
+</adios-config>
+"""
+
+
+def test_adios_xml_params():
+    out_base = os.path.join(TEST_OUTPUT_DIR, 'test_model',
+                            'test_adios_xml_params')
+    shutil.rmtree(out_base, ignore_errors=True)
+    os.makedirs(out_base)
+    adios1_xml = os.path.join(os.path.dirname(__file__), '..', '..',
+                              'heat_transfer.xml')
+    adios2_xml = os.path.join(out_base, 'adios2.xml')
+    with open(adios2_xml, 'w') as f:
+        f.write(ADIOS2_XML)
+
+    class ADIOSCampaign(TestCampaign):
+        name = 'adios_xml_params'
+        codes = [('heat', dict(exe='heat', adios_xml_file=adios1_xml)),
+                 ('sim', dict(exe='sim', adios_xml_file=adios2_xml)),
+                 ('analysis', dict(exe='analysis',
+                                   adios_xml_file=adios2_xml))]
+        sweeps = [
+            SweepGroup(name='test_group', nodes=3, component_subdirs=True,
+                       parameter_groups=[
+              Sweep([ParamAdiosXML('heat', 'transform',
+                                   'adios_transform:heat:T',
+                                   ['none', 'zfp:accuracy=0.001']),
+                     ParamAdiosXML('heat', 'transport',
+                                   'adios_transport:heat',
+                                   ['MPI_AGGREGATE:num_aggregators=4']),
+                     ParamRunner('sim', 'nprocs', [1]),
+                     ParamCmdLineArg('analysis', 'arg', 1, ['a'])]),
+              Sweep([ParamADIOS2XML('sim', 'SimulationOutput', 'engine',
+                                    [{'BPFile': {'Threads': 2}}]),
+                     ParamRunner('heat', 'nprocs', [1]),
+                     ParamCmdLineArg('analysis', 'arg', 1, ['a'])])
+            ])
+        ]
+
+    c = ADIOSCampaign('local', '/test')
+    out_dir = os.path.join(out_base, 'campaign')
+    c.make_experiment_run_dir(out_dir, _check_code_paths=False)
+    group_dir = os.path.join(out_dir, getpass.getuser(), 'test_group')
+
+    # same result as editing the files one parameter at a time
+    expected_dir = os.path.join(out_base, 'expected')
+    os.makedirs(expected_dir)
+    for i, transform in enumerate(['none', 'zfp:accuracy=0.001']):
+        heat_xml = os.path.join(expected_dir, 'heat-%d.xml' % i)
+        shutil.copy(adios1_xml, heat_xml)
+        adios_params.adios_xml_transform(heat_xml, 'heat', 'T', transform)
+        adios_params.adios_xml_transport(heat_xml, 'heat', 'MPI_AGGREGATE',
+                                         'num_aggregators=4')
+        run_dir = os.path.join(group_dir, 'run-%d.iteration-0' % i)
+        with open(heat_xml) as f, \
+                open(os.path.join(run_dir, 'heat',
+                                  'heat_transfer.xml')) as run_f:
+            assert_equal(run_f.read(), f.read())
+    sim_xml = os.path.join(expected_dir, 'sim.xml')
+    shutil.copy(adios2_xml, sim_xml)
+    adios2.set_engine(sim_xml, 'SimulationOutput', 'BPFile',
+                      [{'Threads': 2}])
+    run_dir = os.path.join(group_dir, 'run-2.iteration-0')
+    with open(sim_xml) as f, \
+            open(os.path.join(run_dir, 'sim', 'adios2.xml')) as run_f:
+        assert_equal(run_f.read(), f.read())
+    # components without ADIOS params get the file as is
+    with open(os.path.join(run_dir, 'analysis', 'adios2.xml')) as run_f:
+        assert_equal(run_f.read(), ADIOS2_XML)
+
+
+def test_summit_mpmd_override():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'test_model',
+                           'test_summit_mpmd_override')
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    class SummitCampaign(TestCampaign):
+        name = 'summit_mpmd'
+        supported_machines = ['summit']
+        scheduler_options = dict(summit=dict(project='test'))
+        sweeps = [
+            SweepGroup(name='test_group', nodes=1, launch_mode='mpmd',
+                       parameter_groups=[
+              Sweep([ParamCmdLineArg('test', 'arg', 1, ['a', 'b'])])
+            ])
+        ]
+
+    c = SummitCampaign('summit', '/test')
+    c.make_experiment_run_dir(out_dir, _check_code_paths=False)
+    fob_path = os.path.join(out_dir, getpass.getuser(), 'test_group',
+                            'fobs.json')
+    with open(fob_path) as f:
+        fobs = json.load(f)
+    assert_equal([fob['launch_mode'] for fob in fobs],
+                 ['default', 'default'])
@@ -1,7 +1,10 @@
 
 from nose.tools import assert_equal
 
-from codar.cheetah.parameters import Instance, ParamRunner, ParamCmdLineArg
+from codar.cheetah.exc import CheetahException
+from codar.cheetah.parameters import Instance, Sweep, ParamRunner, \
+    ParamCmdLineArg, ConstrainedSweep, LatinHypercubeSweep, RandomSweep, \
+    OneAtATimeSweep, ParamKeyValue
 
 def test_instance_nprocs_only():
     ds_nprocs = ParamRunner('dataspaces', 'nprocs', [1])
@@ -58,3 +61,118 @@ def test_derived_params_cross_code():
 
     assert_equal(argv_map['code1'], ['val1'])
     assert_equal(argv_map['code2'], ['10'])
+
+
+def test_sweep_iter_instances():
+    sweep = Sweep([ParamCmdLineArg('code1', 'arg1', 1, ['a', 'b', 'c']),
+                   ParamCmdLineArg('code1', 'arg2', 2, [1, 2])])
+    assert_equal(sweep.get_instance_count(), 6)
+    instances = sweep.iter_instances()
+    first = next(instances)
+    assert_equal(first.as_dict(), dict(code1=dict(arg1='a', arg2=1)))
+    assert_equal([inst.as_dict() for inst in sweep.get_instances()],
+                 [first.as_dict()]
+                 + [inst.as_dict() for inst in instances])
+
+
+def _grid_params():
+    return [ParamRunner('sim', 'nprocs', [1, 2, 4, 8]),
+            ParamCmdLineArg('sim', 'threads', 1, [1, 2, 4, 8]),
+            ParamCmdLineArg('sim', 'size', 2, [10, 20, 30])]
+
+
+def test_constrained_sweep():
+    params = _grid_params()
+    calls = []
+
+    def constraint(v):
+        calls.append(1)
+        return v['sim']['nprocs'] * v['sim']['threads'] <= 8
+
+    sweep = ConstrainedSweep(params, constraint)
+    expected = [inst.as_dict() for inst in Sweep(params).get_instances()
+                if inst.as_dict()['sim']['nprocs']
+                   * inst.as_dict()['sim']['threads'] <= 8]
+    assert_equal([inst.as_dict() for inst in sweep.get_instances()],
+                 expected)
+    assert_equal(sweep.get_instance_count(), 30)
+    # decided once nprocs and threads are chosen, not per point
+    assert len(calls) < 2 * 48, len(calls)
+
+
+def test_sampled_sweeps():
+    params = _grid_params()
+    for sweep_class in [LatinHypercubeSweep, RandomSweep]:
+        sweep = sweep_class(params, 6, seed=42)
+        idx_sets = list(sweep.iter_index_sets())
+        assert_equal(len(idx_sets), 6)
+        assert_equal(sweep.get_instance_count(), 6)
+        assert_equal(idx_sets, list(sweep_class(params, 6, seed=42)
+                                    .iter_index_sets()))
+        for idx_set in idx_sets:
+            for p, value_i in zip(params, idx_set):
+                assert 0 <= value_i < len(p)
+    # random points are distinct and in grid order
+    idx_sets = list(RandomSweep(params, 48, seed=1).iter_index_sets())
+    assert_equal(idx_sets, list(Sweep(params).iter_index_sets()))
+    # each value of size is used by exactly 2 of the 6 latin hypercube
+    # points
+    idx_sets = LatinHypercubeSweep(params, 6, seed=3).iter_index_sets()
+    assert_equal(sorted(idx_set[2] for idx_set in idx_sets),
+                 [0, 0, 1, 1, 2, 2])
+
+
+def test_one_at_a_time_sweep():
+    params = _grid_params()
+    sweep = OneAtATimeSweep(params, base=dict(sim=dict(threads=4)))
+    idx_sets = list(sweep.iter_index_sets())
+    assert_equal(sweep.get_instance_count(), 9)
+    assert_equal(idx_sets[0], (0, 2, 0))
+    assert_equal(idx_sets[1:4], [(1, 2, 0), (2, 2, 0), (3, 2, 0)])
+    assert_equal(idx_sets[-2:], [(0, 2, 1), (0, 2, 2)])
+    try:
+        OneAtATimeSweep(params, base=dict(sim=dict(threads=3)))
+    except CheetahException as e:
+        assert 'threads' in str(e), str(e)
+    else:
+        assert False, 'expected CheetahException'
+
+
+def test_sweep_table():
+    params = [ParamRunner('sim', 'nprocs', [1, 2, 4]),
+              ParamCmdLineArg('sim', 'size', 1, [10, 20]),
+              ParamKeyValue('sim', 'mode', 'sim.cfg', 'mode', ['a']),
+              ParamCmdLineArg('analysis', 'size', 1,
+                              lambda d: d['sim']['size'] * 2)]
+    sweep = Sweep(params)
+    table = sweep.get_table()
+    assert_equal(len(table), 6)
+    assert_equal([list(column) for column in table.columns],
+                 [[0, 0, 1, 1, 2, 2], [0, 1, 0, 1, 0, 1], [0] * 6,
+                  [0] * 6])
+
+    tables = list(sweep.iter_tables(size=4))
+    assert_equal([len(t) for t in tables], [4, 2])
+    # instances of a table share the layout, and match the instances
+    # built one parameter at a time
+    for row, inst in enumerate(sweep.iter_instances()):
+        expected = Instance()
+        for p, column in zip(params, table.columns):
+            expected.add_parameter(p, column[row])
+        assert_equal(inst.as_dict(), expected.as_dict())
+        assert_equal(inst.get_codes_argv(), expected.get_codes_argv())
+        assert_equal(inst.get_nprocs('sim'), expected.get_nprocs('sim'))
+        assert_equal(inst.get_nprocs('analysis'), 1)
+        pvs = inst.get_parameter_values_by_type(ParamKeyValue)
+        assert_equal([(pv.name, pv.value, pv.key_name) for pv in pvs],
+                     [('mode', 'a', 'mode')])
+    assert_equal(inst.get_codes_argv(), dict(sim=['20'], analysis=['40']))
+
+    conflict = Sweep([ParamCmdLineArg('sim', 'size', 1, [1]),
+                      ParamRunner('sim', 'size', [2])])
+    try:
+        list(conflict.iter_instances())
+    except ValueError as e:
+        assert 'parameter name conflict' in str(e), str(e)
+    else:
+        assert False, 'expected ValueError'
@@ -0,0 +1,498 @@
+import os
+import json
+import shutil
+import time
+import threading
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from codar.savanna.consumer import PipelineRunner
+from codar.savanna.scheduler import GreedyPolicy, BackfillPolicy
+from codar.savanna.model import Pipeline, RESULT_NAME
+from codar.savanna.status import load_workflow_status, REASON_NOTIME
+from codar.savanna.metrics import load_summary
+from codar.savanna.postprocess import PostProcessQueue
+from codar.savanna.logsink import (load_output_index, read_output,
+                                   get_segment_path)
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _pipeline(pipe_id, nprocs, runtime_estimate):
+    run = dict(name='a', exe='/bin/true', args=[], sched_args=None,
+               nprocs=nprocs, working_dir=TEST_OUTPUT_DIR)
+    return Pipeline.from_data(dict(id=pipe_id, runs=[run],
+                                   working_dir=TEST_OUTPUT_DIR,
+                                   machine_name='local', total_nodes=nprocs,
+                                   runtime_estimate=runtime_estimate))
+
+
+def test_deadline():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer')
+    os.makedirs(out_dir, exist_ok=True)
+    status_path = os.path.join(out_dir, 'deadline.status.json')
+    for path in [status_path, status_path + '.journal']:
+        if os.path.exists(path):
+            os.remove(path)
+
+    consumer = PipelineRunner(runner=None, max_nodes=2, machine_name='local',
+                              processes_per_node=1, status_file=status_path,
+                              deadline=time.time() + 100)
+    consumer.add_pipeline(_pipeline('big-long', 2, 1000))
+    consumer.add_pipeline(_pipeline('small-long', 1, 500))
+    consumer.add_pipeline(_pipeline('small-short', 1, 50))
+    consumer.add_pipeline(_pipeline('unknown', 1, None))
+    with consumer.free_cv:
+        started = set([consumer._pop_job().id, consumer._pop_job().id])
+        assert_equal(started, set(['small-short', 'unknown']))
+        assert_equal(consumer._pop_job(), None)
+        assert_equal(len(consumer.job_list), 0)
+    consumer.stop()
+    consumer.run_pipelines()
+
+    state = load_workflow_status(status_path)
+    for pipe_id in ['big-long', 'small-long']:
+        assert_equal(state[pipe_id]['state'], 'not_started')
+        assert_equal(state[pipe_id]['reason'], REASON_NOTIME)
+
+
+def test_previous_runtime_succeeded_only():
+    # a previous attempt killed at walltime saved a truncated walltime,
+    # which must not be used as the runtime estimate
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'previous')
+    os.makedirs(out_dir, exist_ok=True)
+
+    def estimate(returncode):
+        with open(os.path.join(out_dir, 'codar.workflow.return.a'),
+                  'w') as f:
+            f.write('%d\n' % returncode)
+        with open(os.path.join(out_dir, 'codar.workflow.walltime.a'),
+                  'w') as f:
+            f.write('5.0\n')
+        run = dict(name='a', exe='/bin/true', args=[], sched_args=None,
+                   nprocs=1, working_dir=out_dir, timeout=100)
+        pipeline = Pipeline.from_data(dict(id='previous', runs=[run],
+                                           working_dir=out_dir,
+                                           machine_name='local',
+                                           total_nodes=1))
+        return pipeline.get_runtime_estimate()
+
+    assert_equal(estimate(-15), 100)
+    assert_equal(estimate(1), 100)
+    assert_equal(estimate(0), 5)
+
+
+class _EstimateCounter(PipelineRunner):
+    def __init__(self, *args, **kwargs):
+        PipelineRunner.__init__(self, *args, **kwargs)
+        self.estimate_calls = 0
+
+    def get_runtime_estimate(self, pipeline):
+        self.estimate_calls += 1
+        return PipelineRunner.get_runtime_estimate(self, pipeline)
+
+
+def test_deadline_scaling():
+    # the late pipelines are found without checking the whole job list on
+    # every pop, which was quadratic in the number of queued pipelines
+    n = 2000
+    consumer = _EstimateCounter(runner=None, max_nodes=1,
+                                machine_name='local', processes_per_node=1,
+                                deadline=time.time() + 100)
+    for i in range(n):
+        estimate = 10 if i % 10 == 0 else 1000
+        consumer.add_pipeline(_pipeline('p%d' % i, 1, estimate))
+    started = []
+    with consumer.free_cv:
+        while len(consumer.job_list) > 0:
+            pipeline = consumer._pop_job()
+            if pipeline is None:
+                break
+            started.append(pipeline)
+    assert_equal(len(started), n // 10)
+    assert_equal(len(consumer.job_list), 0)
+    assert_true(consumer.estimate_calls < 4 * n)
+    consumer.stop()
+    consumer.supervisor.stop()
+    consumer.supervisor.join()
+
+
+def test_running_estimates_by_policy():
+    # only policies that use the running pipelines get their estimates
+    for policy, used in [(GreedyPolicy(), False), (BackfillPolicy(), True)]:
+        consumer = _EstimateCounter(runner=None, max_nodes=2,
+                                    machine_name='local',
+                                    processes_per_node=1,
+                                    scheduler_policy=policy)
+        consumer.add_pipeline(_pipeline('first', 1, 10))
+        consumer.add_pipeline(_pipeline('second', 1, 10))
+        with consumer.free_cv:
+            running = consumer._pop_job()
+            running.start_time = time.time()
+            consumer._running_pipelines.add(running)
+            consumer.estimate_calls = 0
+            assert_true(consumer._pop_job() is not None)
+        assert_equal(consumer.estimate_calls > 1, used)
+        consumer.stop()
+        consumer.supervisor.stop()
+        consumer.supervisor.join()
+
+
+class _ReleaseRecorder(PipelineRunner):
+    def __init__(self, *args, **kwargs):
+        PipelineRunner.__init__(self, *args, **kwargs)
+        self.released = []
+
+    def nodes_released(self, pipeline, nodes):
+        PipelineRunner.nodes_released(self, pipeline, nodes)
+        self.released.append((sorted(nodes), pipeline.get_state().state))
+
+
+def test_release_nodes_per_run():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'release')
+    os.makedirs(out_dir, exist_ok=True)
+    runs = [dict(name='sim', exe='/bin/true', args=[], sched_args=None,
+                 nprocs=2, working_dir=out_dir),
+            dict(name='analysis', exe='/bin/sleep', args=['1'],
+                 sched_args=None, nprocs=1, working_dir=out_dir)]
+    pipeline = Pipeline.from_data(dict(id='release', runs=runs,
+                                       working_dir=out_dir,
+                                       machine_name='local', total_nodes=3))
+    consumer = _ReleaseRecorder(runner=None, max_nodes=3,
+                                machine_name='local', processes_per_node=1)
+    consumer.add_pipeline(pipeline)
+    consumer.stop()
+    consumer.run_pipelines()
+
+    # sim nodes are released while analysis is still running
+    assert_equal(len(consumer.released), 2)
+    assert_equal(consumer.released[0], (['1', '2'], 'running'))
+    assert_equal(consumer.released[1][0], ['3'])
+
+    with open(os.path.join(out_dir, RESULT_NAME)) as f:
+        result = json.load(f)
+    assert_equal(result['id'], 'release')
+    assert_equal(sorted(result['runs'].keys()), ['analysis', 'sim'])
+    analysis = result['runs']['analysis']
+    assert_equal(analysis['returncode'], 0)
+    assert_true(analysis['succeeded'])
+    assert_true(analysis['walltime'] >= 1)
+    assert_true(analysis['usage']['maxrss_kb'] > 0)
+    assert_equal(pipeline.get_nodes_held(), 0)
+    assert_equal(consumer.free_nodes, 3)
+
+
+def test_max_queued():
+    consumer = PipelineRunner(runner=None, max_nodes=1, machine_name='local',
+                              processes_per_node=1, max_queued=2)
+    consumer.add_pipeline(_pipeline('first', 1, None))
+    assert_equal(consumer.wait_for_space(), True)
+    consumer.add_pipeline(_pipeline('second', 1, None))
+    assert_true(consumer._job_list_full())
+    with consumer.free_cv:
+        consumer._allocate_nodes(consumer._pop_job())
+    # popping a pipeline makes room for one more
+    assert_equal(consumer.wait_for_space(), True)
+    consumer.add_pipeline(_pipeline('third', 1, None))
+    consumer.stop()
+    assert_equal(consumer.wait_for_space(), False)
+    consumer.supervisor.stop()
+    consumer.supervisor.join()
+
+
+def test_add_after_kill():
+    consumer = PipelineRunner(runner=None, max_nodes=1, machine_name='local',
+                              processes_per_node=1)
+    assert_true(consumer.add_pipeline(_pipeline('first', 1, None)))
+    # a kill between wait_for_space and add_pipeline must not raise, the
+    # producer stops reading instead
+    consumer.kill_all()
+    assert_false(consumer.add_pipeline(_pipeline('second', 1, None)))
+    consumer.stop()
+    consumer.supervisor.stop()
+    consumer.supervisor.join()
+
+
+def test_kill_all():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'kill')
+    os.makedirs(out_dir, exist_ok=True)
+    consumer = PipelineRunner(runner=None, max_nodes=2,
+                              machine_name='local', processes_per_node=1)
+    # one run exits on TERM, the other ignores it and needs a KILL after
+    # its grace period
+    for name, cmd, kill_wait in [
+            ('term', 'sleep 60', None),
+            ('stubborn', "trap '' TERM; sleep 60", 0.5)]:
+        run = dict(name=name, exe='/bin/sh', args=['-c', cmd],
+                   sched_args=None, nprocs=1, working_dir=out_dir,
+                   kill_wait=kill_wait)
+        consumer.add_pipeline(Pipeline.from_data(dict(
+            id=name, runs=[run], working_dir=out_dir, machine_name='local',
+            total_nodes=1)))
+    consumer.stop()
+    thread = threading.Thread(target=consumer.run_pipelines)
+    thread.start()
+    # nodes are allocated before the pipeline is added to the running set
+    deadline = time.time() + 10
+    while (len(consumer._running_pipelines) < 2
+           and time.time() < deadline):
+        time.sleep(0.05)
+    pipelines = list(consumer._running_pipelines)
+    # make sure the processes were created and the trap is set
+    time.sleep(0.5)
+
+    start = time.time()
+    consumer.kill_all()
+    thread.join(10)
+    assert_true(not thread.is_alive())
+    # well before the default 30 second grace period
+    assert_true(time.time() - start < 5)
+    assert_equal(len(pipelines), 2)
+    for pipeline in pipelines:
+        run = pipeline.runs[0]
+        assert_true(run.killed)
+        assert_true(run.get_teardown_time() < 1)
+
+
+def test_task_farm():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'taskfarm')
+    os.makedirs(out_dir, exist_ok=True)
+    consumer = PipelineRunner(runner=None, max_nodes=2,
+                              machine_name='local', processes_per_node=1)
+    consumer.start_task_farm(working_dir=out_dir)
+    pipelines = []
+    for i in range(4):
+        run = dict(name='echo', exe='/bin/echo', args=['task', str(i)],
+                   sched_args=None, nprocs=1,
+                   working_dir=os.path.join(out_dir, str(i)))
+        os.makedirs(run['working_dir'], exist_ok=True)
+        pipelines.append(Pipeline.from_data(dict(
+            id=str(i), runs=[run], working_dir=run['working_dir'],
+            machine_name='local', total_nodes=1)))
+        consumer.add_pipeline(pipelines[-1])
+    consumer.stop()
+    consumer.run_pipelines()
+
+    for i, pipeline in enumerate(pipelines):
+        run = pipeline.runs[0]
+        assert_true(run.succeeded)
+        assert_equal(run.get_returncode(), 0)
+        with open(run.stdout_path) as f:
+            assert_equal(f.read(), 'task %d\n' % i)
+
+
+def test_task_farm_kill_wait():
+    # the run's kill_wait is used by the worker for the rest of the process
+    # group, not the 30 second default
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'taskfarm_kill')
+    os.makedirs(out_dir, exist_ok=True)
+    consumer = PipelineRunner(runner=None, max_nodes=1,
+                              machine_name='local', processes_per_node=1)
+    consumer.start_task_farm(working_dir=out_dir)
+    run = dict(name='orphan', exe='/bin/sh',
+               args=['-c', "(trap '' TERM; sleep 30) & exit 0"],
+               sched_args=None, nprocs=1, working_dir=out_dir,
+               kill_wait=0.3)
+    pipeline = Pipeline.from_data(dict(id='orphan', runs=[run],
+                                       working_dir=out_dir,
+                                       machine_name='local', total_nodes=1))
+    consumer.add_pipeline(pipeline)
+    consumer.stop()
+    start = time.time()
+    consumer.run_pipelines()
+    assert_true(time.time() - start < 5)
+    assert_equal(pipeline.runs[0].get_returncode(), 0)
+
+
+def test_metrics():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'metrics')
+    os.makedirs(out_dir, exist_ok=True)
+    metrics_path = os.path.join(out_dir, 'metrics.jsonl')
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    consumer = PipelineRunner(runner=None, max_nodes=2,
+                              machine_name='local', processes_per_node=1,
+                              metrics_file=metrics_path)
+    for i in range(3):
+        run = dict(name='sleep', exe='/bin/sleep', args=['0.5'],
+                   sched_args=None, nprocs=1,
+                   working_dir=os.path.join(out_dir, str(i)))
+        os.makedirs(run['working_dir'], exist_ok=True)
+        consumer.add_pipeline(Pipeline.from_data(dict(
+            id=str(i), runs=[run], working_dir=run['working_dir'],
+            machine_name='local', total_nodes=1)))
+    consumer.stop()
+    consumer.run_pipelines()
+
+    with open(metrics_path) as f:
+        records = [json.loads(line) for line in f]
+    pipelines = [r for r in records if r['type'] == 'pipeline']
+    assert_equal(sorted(r['id'] for r in pipelines), ['0', '1', '2'])
+    # one of the three had to wait for a node
+    assert_true(max(r['queue_wait'] for r in pipelines) >= 0.4)
+    assert_true(all(r['runs']['sleep']['launch_latency'] >= 0
+                    for r in pipelines))
+
+    summary = load_summary(metrics_path)
+    assert_equal(summary['pipelines_finished'], 3)
+    assert_equal(summary['max_queue_depth'], 3)
+    # 3 x 0.5s runs on 2 nodes, in about 1s
+    assert_true(1.4 <= summary['node_seconds_busy'] <= 2 * summary['elapsed'])
+    assert_true(0 < summary['utilization'] <= 1)
+
+
+def test_trace():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'trace')
+    os.makedirs(out_dir, exist_ok=True)
+    trace_path = os.path.join(out_dir, 'trace.json')
+    runs = [dict(name='sim', exe='/bin/true', args=[], sched_args=None,
+                 nprocs=1, working_dir=out_dir),
+            dict(name='analysis', exe='/bin/sleep', args=['10'],
+                 sched_args=None, nprocs=1, working_dir=out_dir,
+                 timeout=0.2)]
+    consumer = PipelineRunner(runner=None, max_nodes=2,
+                              machine_name='local', processes_per_node=1,
+                              trace_file=trace_path)
+    consumer.add_pipeline(Pipeline.from_data(dict(
+        id='trace', runs=runs, working_dir=out_dir, machine_name='local',
+        total_nodes=2)))
+    consumer.stop()
+    consumer.run_pipelines()
+
+    with open(trace_path) as f:
+        events = json.load(f)
+    spans = [e for e in events if e['ph'] == 'X']
+    pipeline_spans = [e for e in spans if e['cat'] == 'pipeline']
+    assert_equal(len(pipeline_spans), 2)
+    assert_equal(len(set(e['pid'] for e in pipeline_spans)), 2)
+    run_phases = dict(((e['tid'], e['name']), e) for e in spans
+                      if e['cat'] == 'run')
+    assert_true((1, 'running') in run_phases)
+    # analysis was killed by its timeout
+    assert_true(run_phases[(2, 'kill')]['ts']
+                >= run_phases[(2, 'running')]['ts'])
+    queued = [e['ph'] for e in events if e.get('cat') == 'queue']
+    assert_equal(queued, ['b', 'e'])
+
+
+def test_output_sink():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'segments')
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    pipelines = []
+
+    def run_group():
+        consumer = PipelineRunner(runner=None, max_nodes=2,
+                                  machine_name='local', processes_per_node=1)
+        consumer.start_output_sink(out_dir, segment_size=64)
+        for i in range(4):
+            script = 'echo out %d; echo err %d >&2; exit %d' % (i, i, i % 2)
+            run = dict(name='sh', exe='/bin/sh', args=['-c', script],
+                       sched_args=None, nprocs=1,
+                       working_dir=os.path.join(out_dir, str(i)))
+            os.makedirs(run['working_dir'], exist_ok=True)
+            pipelines.append(Pipeline.from_data(dict(
+                id=str(i), runs=[run], working_dir=run['working_dir'],
+                machine_name='local', total_nodes=1)))
+            consumer.add_pipeline(pipelines[-1])
+        consumer.stop()
+        consumer.run_pipelines()
+
+    run_group()
+    index = load_output_index(out_dir)
+    assert_equal(len(index), 4)
+    for i in range(4):
+        working_dir = os.path.join(out_dir, str(i))
+        entry = index[(working_dir, 'sh')]
+        assert_equal(entry['returncode'], i % 2)
+        assert_true(entry['walltime'] > 0)
+        assert_equal(read_output(out_dir, entry, 'stdout'),
+                     ('out %d\n' % i).encode())
+        assert_equal(read_output(out_dir, entry, 'stderr'),
+                     ('err %d\n' % i).encode())
+        # no per-run output files in the run directory
+        assert_equal([name for name in os.listdir(working_dir)
+                      if name.startswith('codar.workflow.')], [RESULT_NAME])
+    # small segment size, so records were spread over several segments
+    assert_true(os.path.exists(get_segment_path(out_dir, 1)))
+
+    # a second submission appends new segments, and uses the walltimes in
+    # the index as runtime estimates
+    last_segment = max(seg for entry in index.values()
+                       for seg, offset, length in entry['stdout'])
+    del pipelines[:]
+    run_group()
+    assert_true(pipelines[0].get_runtime_estimate() is not None)
+    index = load_output_index(out_dir)
+    assert_true(all(seg > last_segment for entry in index.values()
+                    for seg, offset, length in entry['stdout']))
+
+
+def test_post_process_queue():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'postprocess')
+    os.makedirs(out_dir, exist_ok=True)
+    metrics_path = os.path.join(out_dir, 'metrics.jsonl')
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    consumer = PipelineRunner(runner=None, max_nodes=4,
+                              machine_name='local', processes_per_node=1,
+                              metrics_file=metrics_path,
+                              max_post_processes=1)
+    pipelines = []
+    for i in range(4):
+        working_dir = os.path.join(out_dir, str(i))
+        os.makedirs(working_dir, exist_ok=True)
+        run = dict(name='a', exe='/bin/true', args=[], sched_args=None,
+                   nprocs=1, working_dir=working_dir)
+        # the last one is killed by its timeout
+        sleep = '10' if i == 3 else '0.2'
+        pipelines.append(Pipeline.from_data(dict(
+            id=str(i), runs=[run], working_dir=working_dir,
+            machine_name='local', total_nodes=1,
+            post_process_script='/bin/sleep', post_process_args=[sleep],
+            post_process_timeout=0.5)))
+        consumer.add_pipeline(pipelines[-1])
+    start = time.time()
+    consumer.stop()
+    consumer.run_pipelines()
+    elapsed = time.time() - start
+
+    # one at a time: 3 x 0.2s, and 0.5s for the timeout
+    assert_true(elapsed >= 1.0)
+    intervals = sorted((p._post_start_time, p._post_end_time)
+                       for p in pipelines)
+    for (start1, end1), (start2, end2) in zip(intervals, intervals[1:]):
+        assert_true(end1 <= start2)
+    return_path = os.path.join(out_dir, '3',
+                               'codar.workflow.return.post-process')
+    with open(return_path) as f:
+        assert_equal(f.read(), 'None\n')
+
+    summary = load_summary(metrics_path)
+    assert_equal(summary['post_process_runtime']['count'], 4)
+    assert_equal(summary['post_processes_timed_out'], 1)
+    assert_true(summary['max_post_process_queue_depth'] >= 1)
+    assert_true(summary['post_process_wait']['max'] >= 0.4)
+
+
+def test_post_process_queue_killed():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'consumer', 'postprocess-killed')
+    os.makedirs(out_dir, exist_ok=True)
+    queue = PostProcessQueue(max_running=1)
+    pipeline = Pipeline.from_data(dict(
+        id='killed', runs=[dict(name='a', exe='/bin/true', args=[],
+                                sched_args=None, nprocs=1,
+                                working_dir=out_dir)],
+        working_dir=out_dir, machine_name='local',
+        total_nodes=1, post_process_script='/bin/true'))
+    pipeline.post_process_queue = queue
+    pipeline._force_killed = True
+    pipeline._post_done = threading.Event()
+    queue.submit(pipeline)
+    # skipped when started, and no longer counted as running
+    assert_true(pipeline._post_done.is_set())
+    joiner = threading.Thread(target=queue.join, daemon=True)
+    joiner.start()
+    joiner.join(timeout=5)
+    assert_false(joiner.is_alive())
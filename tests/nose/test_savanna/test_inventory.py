@@ -0,0 +1,61 @@
+import os
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from nose.tools import assert_equal
+
+from codar.savanna.consumer import PipelineRunner
+from codar.savanna.model import Pipeline
+from codar.savanna.inventory import get_adios_file_sizes, INVENTORY_NAME
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+def _make_run_dir(name):
+    root = os.path.join(TEST_OUTPUT_DIR, 'inventory', name)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    _write(os.path.join(root, 'out.bp'), 10)
+    _write(os.path.join(root, 'out.bp.dir', 'out.bp.0'), 100)
+    _write(os.path.join(root, 'out.bp.dir', 'sub', 'data.0'), 50)
+    _write(os.path.join(root, 'notes.txt'), 7)
+    # component subdirs, and an ADIOS2 directory named .bp
+    _write(os.path.join(root, 'sim', 'field.bp'), 20)
+    _write(os.path.join(root, 'sim', 'deep', 'diag.bp', 'data.0'), 30)
+    _write(os.path.join(root, 'sim', 'deep', 'diag.bp', 'md.idx'), 5)
+    return root
+
+
+EXPECTED = {'out.bp': 10, 'out.bp.dir': 150, 'sim/field.bp': 20,
+            'sim/deep/diag.bp': 35}
+
+
+def test_adios_file_sizes():
+    root = _make_run_dir('sizes')
+    assert_equal(get_adios_file_sizes(root), EXPECTED)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert_equal(get_adios_file_sizes(root, pool.map), EXPECTED)
+
+
+def test_consumer_inventory():
+    root = _make_run_dir('consumer')
+    run = dict(name='a', exe='/bin/true', args=[], sched_args=None,
+               nprocs=1, working_dir=root)
+    consumer = PipelineRunner(runner=None, max_nodes=1,
+                              machine_name='local', processes_per_node=1)
+    consumer.add_pipeline(Pipeline.from_data(dict(
+        id='inventory', runs=[run], working_dir=root, machine_name='local',
+        total_nodes=1)))
+    consumer.stop()
+    consumer.run_pipelines()
+
+    # written before run_pipelines returns
+    with open(os.path.join(root, INVENTORY_NAME)) as f:
+        assert_equal(json.load(f), EXPECTED)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+from nose.tools import assert_equal, assert_true
+
+from codar.savanna.producer import (get_pipeline_reader, iter_pipeline_data,
+                                    NDJSONPipelineReader,
+                                    NDJSONPipelineWriter, index_path,
+                                    SocketPipelineProducer,
+                                    SocketPipelineClient)
+from codar.savanna.consumer import PipelineRunner, AsyncPipelineRunner
+from codar.savanna.supervisor import new_event_loop
+from codar.savanna.status import (WorkflowStatus, PipelineState, DONE, KILLED,
+                                  load_workflow_status)
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _pipeline_data(pipe_id):
+    run = dict(name='a', exe='/bin/true', args=[], sched_args=None,
+               nprocs=1, working_dir=TEST_OUTPUT_DIR)
+    return dict(id=pipe_id, runs=[run], working_dir=TEST_OUTPUT_DIR,
+                machine_name='local', total_nodes=1)
+
+
+def _setup(name, n):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'producer', name)
+    os.makedirs(out_dir, exist_ok=True)
+    fobs_path = os.path.join(out_dir, 'fobs.json')
+    status_path = os.path.join(out_dir, 'status.json')
+    for path in [status_path, status_path + '.journal']:
+        if os.path.exists(path):
+            os.remove(path)
+    ids = ['run-%d' % i for i in range(n)]
+    with NDJSONPipelineWriter(fobs_path) as w:
+        for pipe_id in ids:
+            w.write(_pipeline_data(pipe_id))
+
+    # previous submission finished some of the pipelines
+    status = WorkflowStatus(status_path)
+    status.set_state(PipelineState('run-1', DONE))
+    status.set_state(PipelineState('run-3', KILLED))
+    status.set_state(PipelineState('run-4', DONE))
+    status.close()
+    return fobs_path, status_path, ids
+
+
+def test_ndjson_reader():
+    fobs_path, status_path, ids = _setup('ndjson', 6)
+    expected = ['run-0', 'run-2', 'run-3', 'run-5']
+
+    reader = get_pipeline_reader(fobs_path, status_path)
+    assert_true(isinstance(reader, NDJSONPipelineReader))
+    assert_true(reader._index_is_current())
+    assert_equal([p.id for p in reader.read_pipelines()], expected)
+
+    # without the index, every line is parsed
+    os.remove(index_path(fobs_path))
+    reader = get_pipeline_reader(fobs_path, status_path)
+    assert_equal([p.id for p in reader.read_pipelines()], expected)
+    assert_equal([d['id'] for d in iter_pipeline_data(fobs_path)], ids)
+
+
+def test_ndjson_writer_abort():
+    # a failure while writing must not leave a partial workflow behind
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'producer', 'abort')
+    os.makedirs(out_dir, exist_ok=True)
+    fobs_path = os.path.join(out_dir, 'fobs.json')
+    try:
+        with NDJSONPipelineWriter(fobs_path) as w:
+            w.write(_pipeline_data('run-0'))
+            raise ValueError('run-1 failed')
+    except ValueError:
+        pass
+    assert_true(not os.path.exists(fobs_path))
+    assert_true(not os.path.exists(index_path(fobs_path)))
+
+
+def test_json_reader():
+    fobs_path, status_path, ids = _setup('json', 3)
+    with open(fobs_path, 'w') as f:
+        json.dump([_pipeline_data(pipe_id) for pipe_id in ids], f, indent=4)
+    reader = get_pipeline_reader(fobs_path, status_path)
+    assert_true(not isinstance(reader, NDJSONPipelineReader))
+    assert_equal([p.id for p in reader.read_pipelines()], ['run-0', 'run-2'])
+    assert_equal([d['id'] for d in iter_pipeline_data(fobs_path)], ids)
+
+
+def _socket_setup(name):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'producer', name)
+    os.makedirs(out_dir, exist_ok=True)
+    status_path = os.path.join(out_dir, 'status.json')
+    for path in [status_path, status_path + '.journal']:
+        if os.path.exists(path):
+            os.remove(path)
+    return os.path.join(out_dir, 'workflow.sock'), status_path
+
+
+def _submit(socket_path, responses):
+    with SocketPipelineClient(socket_path, timeout=10) as client:
+        responses.append(client.add_pipeline(_pipeline_data('run-0')))
+        responses.append(client.add_pipeline(_pipeline_data('run-0')))
+        responses.append(client.request(op='bogus'))
+        responses.append(client.get_status('run-0'))
+        responses.append(client.stop())
+
+
+def _check_responses(responses, status_path):
+    assert_equal(responses[0], dict(ok=True, id='run-0'))
+    assert_true(not responses[1]['ok'])
+    assert_true('duplicate' in responses[1]['error'])
+    assert_equal(responses[2], dict(ok=False, error='unknown op: bogus'))
+    assert_true(responses[3]['ok'])
+    assert_true(responses[3]['state'] in ('not_started', 'running', 'done'))
+    assert_equal(responses[4], dict(ok=True))
+    state = load_workflow_status(status_path)
+    assert_equal(state['run-0']['reason'], 'succeeded')
+
+
+def test_socket_producer():
+    socket_path, status_path = _socket_setup('socket')
+    consumer = PipelineRunner(runner=None, max_nodes=1, machine_name='local',
+                              processes_per_node=1, status_file=status_path)
+    producer = SocketPipelineProducer(consumer, socket_path)
+    t_consumer = threading.Thread(target=consumer.run_pipelines)
+    t_consumer.start()
+    t_server = threading.Thread(target=producer.serve)
+    t_server.start()
+    for i in range(100):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+
+    responses = []
+    _submit(socket_path, responses)
+    t_server.join(10)
+    assert_true(not t_server.is_alive())
+    assert_true(not os.path.exists(socket_path))
+    consumer.stop()
+    t_consumer.join(10)
+    _check_responses(responses, status_path)
+
+
+def test_socket_producer_asyncio():
+    socket_path, status_path = _socket_setup('socket_asyncio')
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    consumer = AsyncPipelineRunner(loop=loop, runner=None, max_nodes=1,
+                                   machine_name='local', processes_per_node=1,
+                                   status_file=status_path)
+    producer = SocketPipelineProducer(consumer, socket_path)
+    responses = []
+
+    async def produce():
+        task = loop.create_task(producer.serve_async())
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.05)
+        await loop.run_in_executor(None, _submit, socket_path, responses)
+        await task
+        consumer.stop()
+
+    try:
+        loop.run_until_complete(asyncio.gather(consumer.run_pipelines(),
+                                               produce()))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    _check_responses(responses, status_path)
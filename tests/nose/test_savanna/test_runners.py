@@ -0,0 +1,50 @@
+import os
+
+from nose.tools import assert_equal, assert_raises
+
+from codar.savanna.runners import MPIRunner, aprun, srun, jsrun, \
+                                  mpiexec_per_node_args
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _fake_mpiexec(name, version):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'runners')
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, name)
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\necho "%s"\n' % version)
+    os.chmod(path, 0o755)
+    return MPIRunner(path, '-n', per_node_args=mpiexec_per_node_args)
+
+
+def test_wrap_per_node():
+    args = ['-m', 'worker']
+    assert_equal(srun.wrap_per_node('python', args, 4, find_in_path=False),
+                 ['srun', '-n', '4', '-N', '4', 'python'] + args)
+    assert_equal(aprun.wrap_per_node('python', args, 4, find_in_path=False),
+                 ['aprun', '-n', '4', '-N', '1', 'python'] + args)
+    assert_equal(jsrun.wrap_per_node('python', args, 4),
+                 ['jsrun', '-n', '4', '-r', '1', '-a', '1', '-c', 'ALL_CPUS',
+                  '-g', 'ALL_GPUS', '-b', 'none', 'python'] + args)
+
+
+def test_wrap_per_node_unsupported():
+    # no way to tell the runner where to put the processes
+    runner = MPIRunner('mpirun', '-np')
+    assert_raises(ValueError, runner.wrap_per_node, 'python', [], 4)
+
+
+def test_wrap_per_node_mpiexec():
+    # the placement syntax depends on the MPI implementation
+    args = ['-m', 'worker']
+    runner = _fake_mpiexec('openmpi', 'mpiexec (OpenRTE) 4.1.2')
+    assert_equal(runner.wrap_per_node('python', args, 4, find_in_path=False),
+                 [runner.exe, '-n', '4', '--map-by', 'ppr:1:node',
+                  'python'] + args)
+    runner = _fake_mpiexec('mpich', 'HYDRA build details:')
+    assert_equal(runner.wrap_per_node('python', args, 4, find_in_path=False),
+                 [runner.exe, '-n', '4', '-ppn', '1', 'python'] + args)
+    runner = _fake_mpiexec('other', 'some other mpiexec')
+    assert_raises(ValueError, runner.wrap_per_node, 'python', args, 4,
+                  find_in_path=False)
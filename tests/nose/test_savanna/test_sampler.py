@@ -0,0 +1,49 @@
+import os
+
+from nose.tools import assert_equal, assert_true
+
+from codar.savanna.consumer import PipelineRunner
+from codar.savanna.model import Pipeline
+from codar.savanna.sampler import (read_proc_stats, SAMPLES_NAME,
+                                   SAMPLES_HEADER)
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def test_read_proc_stats():
+    if not os.path.exists('/proc/self/stat'):
+        return
+    groups = read_proc_stats()
+    procs = groups[os.getpgid(0)]
+    assert_true(any(pid == os.getpid() for pid, t, rss, threads in procs))
+
+
+def test_sample_run():
+    if not os.path.exists('/proc/self/stat'):
+        return
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'sampler')
+    os.makedirs(out_dir, exist_ok=True)
+    samples_path = os.path.join(out_dir, SAMPLES_NAME + '.sleep')
+    if os.path.exists(samples_path):
+        os.remove(samples_path)
+    run = dict(name='sleep', exe='/bin/sh',
+               args=['-c', 'sleep 1 & sleep 1; wait'],
+               sched_args=None, nprocs=1, working_dir=out_dir)
+    pipeline = Pipeline.from_data(dict(id='sampler', runs=[run],
+                                       working_dir=out_dir,
+                                       machine_name='local', total_nodes=1))
+    consumer = PipelineRunner(runner=None, max_nodes=1,
+                              machine_name='local', processes_per_node=1)
+    consumer.start_sampler(0.1)
+    consumer.add_pipeline(pipeline)
+    consumer.stop()
+    consumer.run_pipelines()
+    consumer.sampler.join(5)
+
+    with open(samples_path) as f:
+        lines = f.readlines()
+    assert_equal(lines[0], SAMPLES_HEADER)
+    assert_true(len(lines) > 3)
+    # sh and both sleeps
+    nprocs = [int(line.split(',')[1]) for line in lines[1:]]
+    assert_equal(max(nprocs), 3)
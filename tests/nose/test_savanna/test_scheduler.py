@@ -2,7 +2,9 @@
 
 from nose.tools import assert_equal, assert_in
 
-from codar.savanna.scheduler import JobList
+from codar.savanna import scheduler
+from codar.savanna.scheduler import JobList, GreedyPolicy, BackfillPolicy, \
+                                    get_policy, CONSERVATIVE_RESERVATIONS
 
 
 def test_job_list():
@@ -21,3 +23,109 @@ def test_job_list():
         assert_in('empty', str(e))
     else:
         assert False, 'expected IndexError, got no error'
+
+
+class _Job(object):
+    def __init__(self, name, nodes, runtime):
+        self.name = name
+        self.nodes = nodes
+        self.runtime = runtime
+
+    def __repr__(self):
+        return self.name
+
+
+def _job_list(*jobs):
+    return JobList(lambda j: j.nodes, jobs)
+
+
+def test_job_list_remove():
+    a, b, c = _Job('a', 4, 1), _Job('b', 4, 1), _Job('c', 2, 1)
+    jl = _job_list(a, b, c)
+    jl.remove_job(b)
+    assert_equal(list(jl), [c, a])
+    try:
+        jl.remove_job(b)
+    except ValueError:
+        pass
+    else:
+        assert False, 'expected ValueError, got no error'
+
+
+def test_greedy_policy():
+    big, small = _Job('big', 8, 100), _Job('small', 2, 10)
+    jl = _job_list(big, small)
+    policy = GreedyPolicy()
+    assert_equal(policy.pop_job(jl, 4, [(4, 50)], 0, None), small)
+    assert_equal(policy.pop_job(jl, 4, [(4, 50)], 0, None), None)
+
+
+def test_easy_backfill():
+    # 4 of 8 nodes free, the other 4 are released at t=50. The head job
+    # needs all 8, so it gets a reservation at t=50.
+    runtimefn = lambda j: j.runtime
+    running = [(4, 50)]
+    big = _Job('big', 8, 100)
+    too_long = _Job('too_long', 4, 60)
+    short = _Job('short', 2, 40)
+    jl = _job_list(big, too_long, short)
+    policy = BackfillPolicy()
+    # too_long would delay big, short finishes before the reservation
+    assert_equal(policy.pop_job(jl, 4, running, 0, runtimefn), short)
+    assert_equal(policy.pop_job(jl, 2, running, 0, runtimefn), None)
+    assert_equal(list(jl), [too_long, big])
+
+    # greedy would have started too_long and delayed big
+    jl = _job_list(big, too_long, short)
+    assert_equal(GreedyPolicy().pop_job(jl, 4, running, 0, runtimefn),
+                 too_long)
+
+
+def test_easy_backfill_extra_nodes():
+    # 6 nodes free, 4 more at t=50. The head job needs 8, leaving 2 nodes
+    # it doesn't need, which a job can use for any length of time.
+    runtimefn = lambda j: j.runtime
+    big = _Job('big', 8, 100)
+    unknown = _Job('unknown', 3, None)
+    extra = _Job('extra', 2, None)
+    jl = _job_list(big, unknown, extra)
+    policy = BackfillPolicy()
+    assert_equal(policy.pop_job(jl, 6, [(4, 50)], 0, runtimefn), extra)
+    assert_equal(policy.pop_job(jl, 4, [(4, 50), (2, None)], 0, runtimefn),
+                 None)
+
+
+def test_conservative_backfill():
+    # EASY only protects the head job, conservative protects all of them
+    runtimefn = lambda j: j.runtime
+    running = [(4, 50), (4, 100)]
+    head = _Job('head', 10, 10)
+    second = _Job('second', 6, 10)
+    third = _Job('third', 2, 80)
+    args = (2, running, 0, runtimefn)
+    jl = _job_list(head, second, third)
+    assert_equal(BackfillPolicy(reservations=1).pop_job(jl, *args), third)
+    jl = _job_list(head, second, third)
+    assert_equal(BackfillPolicy(reservations=None).pop_job(jl, *args), None)
+
+
+def test_conservative_reservations_bounded():
+    # only the biggest queued jobs get a reservation, so the availability
+    # profile and the cost of each pop don't grow with the queue
+    reserved = []
+    reserve = scheduler.AvailabilityProfile.reserve
+
+    def counting_reserve(profile, start, runtime, nodes):
+        reserved.append(nodes)
+        reserve(profile, start, runtime, nodes)
+
+    scheduler.AvailabilityProfile.reserve = counting_reserve
+    try:
+        jobs = [_Job('job-%d' % i, 4, 10) for i in range(1000)]
+        jl = _job_list(*jobs)
+        policy = get_policy('conservative')
+        assert_equal(policy.pop_job(jl, 2, [(8, 50)], 0, lambda j: j.runtime),
+                     None)
+    finally:
+        scheduler.AvailabilityProfile.reserve = reserve
+    assert_equal(len(reserved), CONSERVATIVE_RESERVATIONS)
@@ -0,0 +1,78 @@
+import os
+import json
+
+from nose.tools import assert_equal, assert_almost_equal
+
+from codar.savanna.simulator import simulate_policy
+from codar.savanna.scheduler import POLICY_NAMES
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _write_fobs(out_dir):
+    """Write a group with pipelines that have walltime files of a
+    successful attempt, a runtime estimate, or neither."""
+    pipelines = []
+    for pipe_id, nodes, walltime, estimate in [('a', 2, 100, None),
+                                               ('b', 4, 100, None),
+                                               ('c', 1, 100, None),
+                                               ('d', 1, None, 1000),
+                                               ('e', 1, None, None)]:
+        run_dir = os.path.join(out_dir, pipe_id)
+        os.makedirs(run_dir, exist_ok=True)
+        walltime_path = os.path.join(run_dir, 'codar.workflow.walltime.run')
+        return_path = os.path.join(run_dir, 'codar.workflow.return.run')
+        if walltime is not None:
+            with open(walltime_path, 'w') as f:
+                f.write('%d\n' % walltime)
+            with open(return_path, 'w') as f:
+                f.write('0\n')
+        else:
+            for path in [walltime_path, return_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        run = dict(name='run', exe='/bin/true', args=[], sched_args=None,
+                   nprocs=nodes)
+        pipelines.append(dict(id=pipe_id, runs=[run], working_dir=run_dir,
+                              machine_name='local', total_nodes=nodes,
+                              runtime_estimate=estimate))
+    fobs_path = os.path.join(out_dir, 'fobs.json')
+    with open(fobs_path, 'w') as f:
+        json.dump(pipelines, f)
+    return fobs_path
+
+
+def test_simulate_greedy():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'simulator')
+    fobs_path = _write_fobs(out_dir)
+
+    result = simulate_policy(fobs_path, 'greedy', 4, 1)
+    assert_equal(result['pipelines_unknown'], 1)
+    assert_equal(result['pipelines_started'], 4)
+    # b takes all nodes first, then a, c and d start together
+    assert_equal(result['makespan'], 1100)
+    assert_equal(result['node_seconds_busy'], 1700)
+    assert_almost_equal(result['utilization'], 1700 / 4400.0)
+    waits = dict((p['id'], p['wait']) for p in result['pipelines'])
+    assert_equal(waits, dict(a=100, b=0, c=100, d=100))
+
+    # d is not expected to finish before the end of the allocation
+    result = simulate_policy(fobs_path, 'greedy', 4, 1, deadline=500,
+                             include_pipelines=False)
+    assert_equal(result['pipelines_started'], 3)
+    assert_equal(result['pipelines_not_started'], 1)
+    assert_equal(result['makespan'], 200)
+    assert_equal(result['pipelines_late'], 0)
+
+
+def test_simulate_all_policies():
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'simulator')
+    fobs_path = _write_fobs(out_dir)
+    for policy_name in POLICY_NAMES:
+        result = simulate_policy(fobs_path, policy_name, 4, 1,
+                                 default_runtime=10)
+        assert_equal(result['pipelines_unknown'], 0)
+        assert_equal(result['pipelines_started'], 5)
+        assert_equal(result['pipelines_not_started'], 0)
+        busy = sum(p['nodes'] * p['runtime'] for p in result['pipelines'])
+        assert_equal(result['node_seconds_busy'], busy)
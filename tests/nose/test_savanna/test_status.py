@@ -0,0 +1,112 @@
+import os
+import sys
+import shutil
+import json
+import subprocess
+
+from nose.tools import assert_equal
+
+from codar.savanna import status
+from codar.savanna.status import WorkflowStatus, PipelineState, \
+                                 load_workflow_status
+
+from test_savanna import TEST_OUTPUT_DIR, source_path
+
+
+def _status_path(test_name):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'test_status', test_name)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    return os.path.join(out_dir, 'codar.workflow.status.json')
+
+
+def test_journal_replay():
+    path = _status_path('test_journal_replay')
+    ws = WorkflowStatus(path)
+    ws.set_state(PipelineState('run-0', status.NOT_STARTED))
+    ws.set_state(PipelineState('run-1', status.NOT_STARTED))
+    ws.set_state(PipelineState('run-0', status.DONE, status.REASON_SUCCEEDED,
+                               dict(code=0)))
+
+    # snapshot is still empty, state is only in the journal
+    with open(path) as f:
+        assert_equal(json.load(f), {})
+    data = load_workflow_status(path)
+    assert_equal(data['run-0']['state'], status.DONE)
+    assert_equal(data['run-0']['return_codes'], dict(code=0))
+    assert_equal(data['run-1']['state'], status.NOT_STARTED)
+
+    ws.close()
+    assert not os.path.exists(status.journal_path(path))
+    with open(path) as f:
+        assert_equal(json.load(f), data)
+
+
+def test_journal_truncated_record():
+    path = _status_path('test_journal_truncated_record')
+    ws = WorkflowStatus(path)
+    ws.set_state(PipelineState('run-0', status.RUNNING))
+    with open(status.journal_path(path), 'a') as f:
+        f.write('{"id":"run-0","sta')
+    assert_equal(load_workflow_status(path)['run-0']['state'], status.RUNNING)
+
+    # restarting folds the journal into a new snapshot
+    ws2 = WorkflowStatus(path)
+    assert_equal(ws2.get_state('run-0')['state'], status.RUNNING)
+    with open(path) as f:
+        assert_equal(json.load(f)['run-0']['state'], status.RUNNING)
+
+
+def test_compaction():
+    path = _status_path('test_compaction')
+    ws = WorkflowStatus(path, compact_min_records=10)
+    for i in range(25):
+        ws.set_state(PipelineState('run-%d' % (i % 5), status.RUNNING))
+    # journal is compacted once it has more records than the snapshot
+    assert ws._journal_records <= 10
+    data = load_workflow_status(path)
+    assert_equal(sorted(data.keys()), ['run-%d' % i for i in range(5)])
+
+
+def _run_submit(group_dir):
+    """Run the SLURM group submit script, with an sbatch on the PATH that
+    just prints a job id. Returns True if the job was submitted."""
+    script = os.path.join(source_path, 'codar', 'cheetah', 'data',
+                          'scheduler', 'slurm', 'group', 'submit.sh')
+    shutil.copy(script, group_dir)
+    bin_dir = os.path.join(group_dir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    sbatch = os.path.join(bin_dir, 'sbatch')
+    with open(sbatch, 'w') as f:
+        f.write('#!/bin/sh\necho 42\n')
+    os.chmod(sbatch, 0o755)
+    with open(os.path.join(group_dir, '..', 'campaign-env.sh'), 'w') as f:
+        f.write('export CODAR_PYTHON="%s"\n' % sys.executable)
+    with open(os.path.join(group_dir, 'group-env.sh'), 'w') as f:
+        f.write('export CODAR_CHEETAH_GROUP_WALLTIME=60\n')
+    jobid_path = os.path.join(group_dir, 'codar.cheetah.jobid.txt')
+    if os.path.exists(jobid_path):
+        os.remove(jobid_path)
+    env = dict(os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env['PATH']
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in [source_path, env.get('PYTHONPATH')] if p)
+    subprocess.check_call(['bash', os.path.join(group_dir, 'submit.sh')],
+                          env=env, stdout=subprocess.DEVNULL)
+    return os.path.exists(jobid_path)
+
+
+def test_submit_killed_before_compaction():
+    path = _status_path('test_submit_killed_before_compaction/group')
+    group_dir = os.path.dirname(path)
+    ws = WorkflowStatus(path)
+    ws.set_state(PipelineState('run-0', status.DONE, status.REASON_SUCCEEDED))
+    ws.set_state(PipelineState('run-1', status.NOT_STARTED))
+    # killed at walltime: no close, so the snapshot is still empty and the
+    # remaining work is only in the journal
+    with open(path) as f:
+        assert_equal(json.load(f), {})
+    assert_equal(_run_submit(group_dir), True)
+
+    ws.set_state(PipelineState('run-1', status.DONE, status.REASON_SUCCEEDED))
+    assert_equal(_run_submit(group_dir), False)
@@ -0,0 +1,66 @@
+import os
+
+from nose.tools import assert_equal, assert_raises
+
+from codar.savanna import summit_helper
+from codar.savanna.model import NodeConfig, ResourceSet
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _read_erf(name, create, *args):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'summit_helper')
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, name + '.erf_input')
+    create(path, *args)
+    with open(path) as f:
+        return f.read().split('\n')
+
+
+def test_erf_node_config():
+    nc = NodeConfig()
+    nc.num_ranks_per_node = 2
+    nc.cpu = [[0, 1], [2]]
+    nc.gpu = [[0, 1], []]
+    lines = _read_erf('node_config',
+                      summit_helper._create_erf_file_node_config,
+                      'sim', ['-a'], 3, 2, ['h1', 'h2'], nc)
+    assert_equal(lines[0], 'app 0: sim -a')
+    assert_equal(lines[-4:], [
+        'rank: 0: { host: h1; cpu: {0-3}, {4-7} ; gpu: {0,1} } : app 0',
+        'rank: 1: { host: h1; cpu: {8-11} } : app 0',
+        'rank: 2: { host: h2; cpu: {0-3}, {4-7} ; gpu: {0,1} } : app 0',
+        ''])
+
+
+class _Run(object):
+    def __init__(self, erf_file, nprocs, nodes_assigned, res_set):
+        self.erf_file = erf_file
+        self.exe = 'sim'
+        self.args = []
+        self.nprocs = nprocs
+        self.nodes_assigned = nodes_assigned
+        self.res_set = res_set
+
+
+def test_erf_res_set():
+    res_set = ResourceSet(rs_per_host=2, tasks_per_rs=2, cpus_per_rs=4,
+                          gpus_per_rs=1)
+
+    def create(path):
+        summit_helper._create_erf_file_res_set(
+            _Run(path, 5, ['h1', 'h2'], res_set), ['h1', 'h2'], res_set)
+
+    lines = _read_erf('res_set', create)
+    assert_equal(lines[-6:], [
+        'rank: 0: { host: h1; cpu: {0-3}, {4-7} ; gpu: {0} } : app 0',
+        'rank: 1: { host: h1; cpu: {8-11}, {12-15} ; gpu: {0} } : app 0',
+        'rank: 2: { host: h1; cpu: {16-19}, {20-23} ; gpu: {1} } : app 0',
+        'rank: 3: { host: h1; cpu: {24-27}, {28-31} ; gpu: {1} } : app 0',
+        'rank: 4: { host: h2; cpu: {0-3}, {4-7} ; gpu: {0} } : app 0',
+        ''])
+
+
+def test_erf_res_set_too_big():
+    res_set = ResourceSet(rs_per_host=7, gpus_per_rs=1)
+    assert_raises(ValueError, summit_helper._res_set_key, res_set)
@@ -0,0 +1,193 @@
+import os
+import time
+import signal
+import asyncio
+import threading
+import subprocess
+
+from nose.tools import assert_equal, assert_true
+
+from codar.savanna import supervisor
+from codar.savanna.supervisor import (ProcessSupervisor, AsyncioSupervisor,
+                                      GroupWait, new_event_loop, USAGE_KEYS)
+
+from test_savanna import TEST_OUTPUT_DIR
+
+
+def _output_path(name):
+    out_dir = os.path.join(TEST_OUTPUT_DIR, 'supervisor')
+    os.makedirs(out_dir, exist_ok=True)
+    return os.path.join(out_dir, name)
+
+
+def test_timers():
+    sup = ProcessSupervisor()
+    sup.start()
+    fired = []
+    done = threading.Event()
+    sup.call_later(0.2, fired.append, 'late')
+    t = sup.call_later(0.1, fired.append, 'cancelled')
+    sup.cancel(t)
+    sup.call_later(0.05, fired.append, 'early')
+    sup.call_soon(fired.append, 'soon')
+    sup.call_later(0.3, done.set)
+    assert_true(done.wait(5))
+    sup.stop()
+    sup.join(5)
+    assert_equal(fired, ['soon', 'early', 'late'])
+
+
+def test_spawn_many():
+    sup = ProcessSupervisor()
+    sup.start()
+    n = 50
+    lock = threading.Lock()
+    codes = {}
+    all_done = threading.Event()
+
+    def on_exit(proc):
+        with lock:
+            codes[proc.pid] = proc.returncode
+            if len(codes) == n:
+                all_done.set()
+
+    pids = []
+    for i in range(n):
+        sup.spawn(['/bin/sh', '-c', 'exit %d' % (i % 4)], os.environ,
+                  None, _output_path('out.%d' % i), _output_path('err.%d' % i),
+                  lambda proc: pids.append(proc.pid), on_exit, None)
+    assert_true(all_done.wait(10))
+    sup.stop()
+    sup.join(5)
+    assert_true(not sup.is_alive())
+    assert_equal([codes[pid] for pid in pids], [i % 4 for i in range(n)])
+
+
+def test_usage():
+    sup = ProcessSupervisor()
+    sup.start()
+    exited = []
+    done = threading.Event()
+
+    def on_exit(proc):
+        exited.append(proc)
+        done.set()
+
+    out_path = _output_path('usage.out')
+    sup.spawn(['/bin/sh', '-c', 'head -c 100000 /dev/zero; exit 2'],
+              os.environ, None, out_path, _output_path('usage.err'),
+              lambda proc: None, on_exit, None)
+    assert_true(done.wait(10))
+    sup.stop()
+    sup.join(5)
+    proc = exited[0]
+    assert_equal(proc.returncode, 2)
+    assert_equal(sorted(proc.usage.keys()), sorted(USAGE_KEYS))
+    assert_true(proc.usage['maxrss_kb'] > 0)
+    if os.path.exists('/proc/self/io'):
+        assert_true(proc.usage['write_bytes'] is not None)
+
+
+def test_group_wait():
+    sup = ProcessSupervisor()
+    sup.start()
+    lock = threading.Lock()
+    waits = {}
+    all_done = threading.Event()
+
+    def on_exit(name, kill_wait, proc):
+        exit_time = time.time()
+
+        def on_done(gone):
+            with lock:
+                waits[name] = (gone, time.time() - exit_time)
+                if len(waits) == 3:
+                    all_done.set()
+
+        GroupWait(sup, proc, on_done, kill_wait, 10, name).start()
+
+    # the group leader exits before the rest of its group: a child that
+    # exits by itself soon after, and one that ignores TERM and is killed
+    # after kill_wait
+    for name, cmd, kill_wait in [
+            ('alone', 'exit 0', 30),
+            ('child', 'sleep 0.2 & exit 0', 30),
+            ('stubborn', "(trap '' TERM; sleep 30) & exit 0", 0.3)]:
+        sup.spawn(['/bin/sh', '-c', cmd], os.environ, None,
+                  _output_path('group.%s.out' % name),
+                  _output_path('group.%s.err' % name), lambda proc: None,
+                  lambda proc, name=name, kill_wait=kill_wait:
+                      on_exit(name, kill_wait, proc),
+                  None)
+    assert_true(all_done.wait(10))
+    sup.stop()
+    sup.join(5)
+    assert_true(all(gone for gone, waited in waits.values()))
+    assert_true(waits['alone'][1] < 0.1)
+    assert_true(0.2 <= waits['child'][1] < 1)
+    assert_true(0.3 <= waits['stubborn'][1] < 1.5)
+
+
+def test_signal_group_scan():
+    # only the null signal existence check looks for a live process in
+    # /proc, other signals just need the group to exist
+    scans = []
+    scan = supervisor._group_has_live_process
+    supervisor._group_has_live_process = \
+        lambda pgid: scans.append(pgid) or scan(pgid)
+    proc = subprocess.Popen(['sleep', '30'], start_new_session=True)
+    sup = ProcessSupervisor()
+    try:
+        assert_true(sup.signal_group(proc, signal.SIGCONT))
+        assert_equal(scans, [])
+        assert_true(sup.signal_group(proc, 0))
+        assert_equal(scans, [proc.pid])
+    finally:
+        supervisor._group_has_live_process = scan
+        proc.kill()
+        proc.wait()
+
+
+def test_group_scan_shared():
+    # checking many groups at once scans /proc once, while a group that is
+    # not in a recent scan is checked again before it is reported gone
+    scans = []
+    scan = supervisor._scan_live_groups
+    supervisor._scan_live_groups = lambda: scans.append(1) or scan()
+    procs = [subprocess.Popen(['sleep', '30'], start_new_session=True)
+             for i in range(5)]
+    try:
+        group_scan = supervisor._GroupScan()
+        assert_true(all(group_scan.has_live_process(proc.pid)
+                        for proc in procs))
+        assert_equal(len(scans), 1)
+        new_proc = subprocess.Popen(['sleep', '30'], start_new_session=True)
+        procs.append(new_proc)
+        assert_true(group_scan.has_live_process(new_proc.pid))
+        assert_equal(len(scans), 2)
+    finally:
+        supervisor._scan_live_groups = scan
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+def test_asyncio_spawn():
+    loop = new_event_loop()
+    sup = AsyncioSupervisor(loop)
+    events = []
+    sup.spawn(['/bin/sh', '-c', 'exit 3'], os.environ, None,
+              _output_path('aio.out'), _output_path('aio.err'),
+              lambda proc: events.append('start'),
+              lambda proc: events.append(proc.returncode),
+              lambda e: events.append('error'))
+    sup.spawn(['/nonexistent'], os.environ, None,
+              _output_path('aio.out.2'), _output_path('aio.err.2'),
+              lambda proc: events.append('start2'),
+              lambda proc: events.append('exit2'),
+              lambda e: events.append('error2'))
+    try:
+        loop.run_until_complete(sup.wait_closed())
+    finally:
+        loop.close()
+    assert_equal(sorted(events, key=str), [3, 'error2', 'start'])